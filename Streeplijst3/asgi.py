@@ -9,8 +9,8 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+from streeplijst.handlers import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Streeplijst3.settings')
 
-application = get_asgi_application()
+application = get_asgi_application()  # Requests to the Streeplijst API use a lean middleware stack
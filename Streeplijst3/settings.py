@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 import os
 from pathlib import Path
+from corsheaders.defaults import default_headers
 from dotenv import load_dotenv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'streeplijst.middleware.ServerTimingMiddleware',  # First, so the total time includes all other middleware
+    'streeplijst.middleware.DeadlineMiddleware',
+    'streeplijst.middleware.TenantMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -55,8 +59,23 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Middleware of the stateless Streeplijst API, which is handled separately from the admin and frontend, see
+# streeplijst/handlers.py. It has no session, authentication, messages, CSRF or clickjacking middleware.
+API_PATH_PREFIX = '/streeplijst'  # Requests to paths starting with this prefix are requests to the API
+API_MIDDLEWARE = [
+    'streeplijst.middleware.ServerTimingMiddleware',  # First, so the total time includes all other middleware
+    'streeplijst.middleware.DeadlineMiddleware',
+    'streeplijst.middleware.TenantMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'corsheaders.middleware.CorsMiddleware',
+]
+
 ROOT_URLCONF = 'Streeplijst3.urls'
 CORS_ORIGIN_ALLOW_ALL = True
+CORS_EXPOSE_HEADERS = ['Server-Timing']  # Allow the frontend to read the time spent on each request
+# Allow the frontend to select a tenant and to profile requests
+CORS_ALLOW_HEADERS = list(default_headers) + ['X-Streeplijst-Tenant', 'X-Streeplijst-Tenant-Key',
+                                              'X-Streeplijst-Profile']
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -142,6 +161,10 @@ STATIC_URL = '/static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Shared state
+
+SHARED_STATE_FOLDER = BASE_DIR / 'state'  # State which is shared between worker processes, e.g. rate limits
+
 # Logging
 
 LOG_FOLDER = BASE_DIR / 'logs'
@@ -161,7 +184,8 @@ LOGGING = {
             'datefmt': '%Y-%m-%d %H:%M:%S',
         },
         'verbose_request': {
-            'format': '{levelname:<8} {asctime} {module:<10} {name:<15} {request_id:<8} {message}',
+            # Milliseconds are included so the timing of requests can be replayed, see streeplijst/loadtest/replay.py
+            'format': '{levelname:<8} {asctime}.{msecs:03.0f} {module:<10} {name:<15} {request_id:<8} {message}',
             'style': '{',
             'datefmt': '%Y-%m-%d %H:%M:%S',
         },
@@ -214,3 +238,17 @@ LOGGING = {
         },
     },
 }
+
+# Webhooks
+
+WEBHOOK_SECRET = os.environ.get('STREEPLIJST_WEBHOOK_SECRET')  # Secret to authenticate webhooks, disabled if not set
+
+# Tenants
+
+TENANTS_FILE = os.environ.get('STREEPLIJST_TENANTS_FILE')  # JSON file with the tenants besides the default tenant
+
+# Profiling
+
+PROFILE_FOLDER = LOG_FOLDER / 'profiles'  # Sampled profiles of local requests, named after their request ID
+PROFILE_SAMPLE_RATE = float(os.environ.get('STREEPLIJST_PROFILE_SAMPLE_RATE', 0))  # Fraction of requests to profile
+PROFILE_SECRET = os.environ.get('STREEPLIJST_PROFILE_SECRET')  # Value of the profile header, only DEBUG if not set
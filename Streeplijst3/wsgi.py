@@ -9,8 +9,8 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/wsgi/
 
 import os
 
-from django.core.wsgi import get_wsgi_application
+from streeplijst.handlers import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Streeplijst3.settings')
 
-application = get_wsgi_application()
+application = get_wsgi_application()  # Requests to the Streeplijst API use a lean middleware stack
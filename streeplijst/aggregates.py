@@ -0,0 +1,214 @@
+import logging
+from collections import defaultdict
+from decimal import Decimal
+from typing import Any, Optional
+
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import F, Sum
+
+from streeplijst.models import MemberPeriodTotal, MemberProductCount, MemberSalesSync, SeenSaleInvoice
+
+aggregates_logger = logging.getLogger('api.local')  # Aggregate problems are logged together with local requests
+
+
+def _to_decimal(amount: Any) -> Decimal:
+    """Convert an amount in euros as sent by Congressus to a Decimal, treating missing amounts as zero."""
+    return Decimal(str(amount)) if amount is not None else Decimal(0)
+
+
+def _sale_period(sale: dict[str, Any]) -> str:
+    """Returns the month of a stripped sale, formatted as YYYY-MM."""
+    date_str = sale.get('invoice_date') or sale.get('created') or ''
+    return date_str[:7]
+
+
+def record_sales(tenant: str, sales: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """
+    Add stripped sales to the running totals of their members, all in a single transaction. A sale which was already
+    recorded only updates the paid and unpaid amounts, since those change when the invoice is paid.
+
+    Failing to record sales never fails the request they were seen in. The sales are recorded when they are seen again
+    during the next synchronization.
+
+    :param tenant: Name of the tenant the sales belong to.
+    :param sales: Stripped sales data, as returned by '_strip_sales_data'.
+    :return: The sales which were new and whose products were counted.
+    """
+    # Sales which cannot be attributed to an invoice or member are skipped, a sale seen twice is recorded once
+    sales_by_id = {sale['id']: sale for sale in sales if sale.get('id') is not None
+                   and sale.get('member_id') is not None}
+    if not sales_by_id:
+        return []
+
+    try:
+        try:
+            with transaction.atomic():
+                return _record_sales(tenant, sales_by_id)
+        except IntegrityError:  # Another worker recorded some of the sales at the same time, update them instead
+            with transaction.atomic():
+                return _record_sales(tenant, sales_by_id)
+    except DatabaseError as e:
+        aggregates_logger.warning(msg=f"Could not record {len(sales_by_id)} sales in aggregates: {e}")
+        return []
+
+
+def _record_sales(tenant: str, sales_by_id: dict[int, dict[str, Any]]) -> list[dict[str, Any]]:
+    """Add stripped sales to the running totals, must be called inside a transaction. Returns the new sales."""
+    seen_invoices = SeenSaleInvoice.objects.filter(tenant=tenant, invoice_id__in=list(sales_by_id))
+    seen_by_id = {seen.invoice_id: seen for seen in seen_invoices}
+
+    period_deltas = defaultdict(lambda: [Decimal(0), Decimal(0), 0])  # Paid, unpaid and count per (member, period)
+    product_deltas = defaultdict(lambda: [0, ''])  # Quantity and latest name per (member, product offer)
+    changed_invoices = []  # Invoices seen before whose amounts changed
+    new_invoices = []
+    new_sales = []
+    for invoice_id, sale in sales_by_id.items():
+        member_id = sale['member_id']
+        price_paid = _to_decimal(sale.get('price_paid'))
+        price_unpaid = _to_decimal(sale.get('price_unpaid'))
+
+        seen = seen_by_id.get(invoice_id)
+        if seen is not None:  # Only apply the change of the amounts since the sale was last seen
+            if price_paid != seen.price_paid or price_unpaid != seen.price_unpaid:
+                period_delta = period_deltas[(member_id, seen.period)]
+                period_delta[0] += price_paid - seen.price_paid
+                period_delta[1] += price_unpaid - seen.price_unpaid
+                seen.price_paid = price_paid
+                seen.price_unpaid = price_unpaid
+                changed_invoices.append(seen)
+            continue
+
+        # The sale is new, add it to the period totals and product counts
+        period = _sale_period(sale)
+        new_invoices.append(SeenSaleInvoice(tenant=tenant, invoice_id=invoice_id, member_id=member_id, period=period,
+                                            price_paid=price_paid, price_unpaid=price_unpaid))
+        new_sales.append(sale)
+        period_delta = period_deltas[(member_id, period)]
+        period_delta[0] += price_paid
+        period_delta[1] += price_unpaid
+        period_delta[2] += 1
+        for item in sale.get('items') or []:
+            product_offer_id = item.get('product_offer_id')
+            if product_offer_id is None:  # Not a product from the webshop, e.g. a manual invoice line
+                continue
+            product_delta = product_deltas[(member_id, product_offer_id)]
+            product_delta[0] += item.get('quantity') or 0
+            product_delta[1] = item.get('name') or ''
+
+    # A sale recorded by another worker in the meantime violates the unique constraint and rolls everything back
+    SeenSaleInvoice.objects.bulk_create(new_invoices)
+    SeenSaleInvoice.objects.bulk_update(changed_invoices, fields=['price_paid', 'price_unpaid'])
+
+    # Create missing totals first, then add to them in the database so concurrent additions are not lost
+    MemberPeriodTotal.objects.bulk_create([MemberPeriodTotal(tenant=tenant, member_id=member_id, period=period)
+                                           for member_id, period in period_deltas], ignore_conflicts=True)
+    for (member_id, period), (delta_paid, delta_unpaid, delta_count) in period_deltas.items():
+        MemberPeriodTotal.objects.filter(tenant=tenant, member_id=member_id, period=period).update(
+            price_paid=F('price_paid') + delta_paid, price_unpaid=F('price_unpaid') + delta_unpaid,
+            invoice_count=F('invoice_count') + delta_count)
+
+    MemberProductCount.objects.bulk_create([MemberProductCount(tenant=tenant, member_id=member_id,
+                                                               product_offer_id=product_offer_id)
+                                            for member_id, product_offer_id in product_deltas], ignore_conflicts=True)
+    for (member_id, product_offer_id), (delta_quantity, name) in product_deltas.items():
+        MemberProductCount.objects.filter(tenant=tenant, member_id=member_id, product_offer_id=product_offer_id).update(
+            quantity=F('quantity') + delta_quantity, name=name)
+    return new_sales
+
+
+def get_sync(tenant: str, member_id: int) -> Optional[MemberSalesSync]:
+    """Returns when the sales of a member of a tenant were last synchronized, or None if they never were."""
+    return MemberSalesSync.objects.filter(tenant=tenant, member_id=member_id).first()
+
+
+def mark_synced(tenant: str, member_id: int, synced_at) -> None:
+    """
+    Store that the sales of a member were synchronized.
+
+    :param tenant: Name of the tenant the member belongs to.
+    :param member_id: Congressus ID of the member.
+    :param synced_at: Time at which the synchronization started.
+    """
+    syncs = MemberSalesSync.objects.filter(tenant=tenant, member_id=member_id)
+    if not syncs.update(synced_at=synced_at):  # First sync
+        MemberSalesSync.objects.create(tenant=tenant, member_id=member_id, synced_at=synced_at)
+    # Invoices which changed after the synchronization started may have been missed, they are fetched next time
+    syncs.filter(sales_changed_at__lte=synced_at).update(sales_changed_at=None)
+
+
+def mark_sales_changed(tenant: str, member_ids: list[int], changed_at) -> None:
+    """
+    Store that sale invoices of members changed, e.g. because they were paid, so they are fetched again on the next
+    synchronization. Members whose sales were never synchronized are ignored.
+
+    :param tenant: Name of the tenant the members belong to.
+    :param member_ids: Congressus IDs of the members.
+    :param changed_at: Time at which the change was reported.
+    """
+    MemberSalesSync.objects.filter(tenant=tenant, member_id__in=member_ids).update(sales_changed_at=changed_at)
+
+
+def get_oldest_unpaid_period(tenant: str, member_id: int) -> Optional[str]:
+    """
+    Returns the month of the oldest invoice of a member which was not paid when it was last seen, formatted as YYYY-MM,
+    or None if all their invoices were paid. Only unpaid invoices can be paid later.
+    """
+    unpaid_invoices = SeenSaleInvoice.objects.filter(tenant=tenant, member_id=member_id).exclude(price_unpaid=0)
+    unpaid_invoices = unpaid_invoices.exclude(period='')  # The month of an invoice without a date is unknown
+    return unpaid_invoices.order_by('period').values_list('period', flat=True).first()
+
+
+def get_top_products(tenant: str, member_id: int, limit: int) -> list[dict[str, Any]]:
+    """
+    Get the products a member bought most often.
+
+    :param tenant: Name of the tenant the member belongs to.
+    :param member_id: Congressus ID of the member.
+    :param limit: Max number of products to return.
+    :return: Product offer ID, name and quantity of the products, most bought first.
+    """
+    products = MemberProductCount.objects.filter(tenant=tenant, member_id=member_id, quantity__gt=0)
+    products = products.order_by('-quantity')[:limit]
+    return [{'product_offer_id': product.product_offer_id, 'name': product.name, 'quantity': product.quantity}
+            for product in products]
+
+
+def get_member_aggregates(tenant: str, member_id: int) -> dict[str, Any]:
+    """
+    Get the running totals of a member.
+
+    :param tenant: Name of the tenant the member belongs to.
+    :param member_id: Congressus ID of the member.
+    :return: Totals over all periods, totals per month (most recent first) and product counts (most bought first).
+    """
+    periods = MemberPeriodTotal.objects.filter(tenant=tenant, member_id=member_id).order_by('-period')
+    totals = periods.aggregate(price_paid=Sum('price_paid'), price_unpaid=Sum('price_unpaid'),
+                               invoice_count=Sum('invoice_count'))
+    products = MemberProductCount.objects.filter(tenant=tenant, member_id=member_id, quantity__gt=0)
+    products = products.order_by('-quantity')
+    sync = get_sync(tenant, member_id)
+
+    return {
+        'member_id': member_id,
+        'synced_at': sync.synced_at if sync else None,
+        'total': {
+            'price_paid': float(totals['price_paid'] or 0),
+            'price_unpaid': float(totals['price_unpaid'] or 0),
+            'invoice_count': totals['invoice_count'] or 0,
+        },
+        'periods': [
+            {
+                'period': period.period,
+                'price_paid': float(period.price_paid),
+                'price_unpaid': float(period.price_unpaid),
+                'invoice_count': period.invoice_count,
+            } for period in periods
+        ],
+        'products': [
+            {
+                'product_offer_id': product.product_offer_id,
+                'name': product.name,
+                'quantity': product.quantity,
+            } for product in products
+        ],
+    }
@@ -0,0 +1,62 @@
+import logging
+import threading
+from typing import Optional
+
+from streeplijst.congressus.rate_limit import Priority
+
+admission_logger = logging.getLogger('api.congressus')  # Admission is logged together with Congressus calls
+
+
+class AdmissionController:
+    """
+    Caps the number of calls to Congressus which are in flight at the same time in this worker, per priority class.
+
+    When Congressus slows down, every call takes longer and the threads of the worker pile up behind them until none
+    are left to answer any request. Calls beyond the cap of their class are not made at all, so they can be answered
+    right away (with an error or stale data) while the capped calls finish. Classes without a cap, like sales, are
+    always admitted.
+    """
+
+    def __init__(self, limits: dict[Priority, int], max_wait: float):
+        """
+        :param limits: Max number of calls in flight per priority class. Classes which are not listed have no cap.
+        :param max_wait: Seconds to wait for a call of another request to finish before the call is rejected.
+        """
+        self.limits = limits
+        self.max_wait = max_wait
+        self._semaphores = {priority: threading.BoundedSemaphore(limit) for priority, limit in limits.items()}
+        self._in_flight = {priority: 0 for priority in Priority}
+        self._lock = threading.Lock()
+
+    def acquire(self, priority: Priority) -> bool:
+        """
+        Try to admit a call. Every admitted call must be released with 'release'.
+
+        :param priority: Priority class of the call.
+        :return: Whether the call was admitted.
+        """
+        semaphore = self._semaphores.get(priority)
+        if semaphore is not None and not semaphore.acquire(timeout=self.max_wait):
+            admission_logger.warning(msg=f"Rejected {priority.name} call to Congressus, "
+                                         f"{self.limits[priority]} calls of this class are in flight")
+            return False
+        with self._lock:
+            self._in_flight[priority] += 1
+        return True
+
+    def release(self, priority: Priority) -> None:
+        """
+        Release a call which was admitted by 'acquire'.
+
+        :param priority: Priority class of the call.
+        """
+        with self._lock:
+            self._in_flight[priority] -= 1
+        semaphore = self._semaphores.get(priority)
+        if semaphore is not None:
+            semaphore.release()
+
+    def in_flight(self, priority: Optional[Priority] = None) -> int:
+        """Returns the number of calls in flight of a priority class, or of all classes."""
+        with self._lock:
+            return self._in_flight[priority] if priority is not None else sum(self._in_flight.values())
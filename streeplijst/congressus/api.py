@@ -1,37 +1,196 @@
 import datetime
 import json
+import math
 import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime as DateTime
-from typing import Tuple
+from typing import Callable, Iterator, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 from deprecated import deprecated
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.exceptions import APIException
 from rest_framework.request import Request
 from rest_framework.response import Response
 
+from streeplijst import aggregates
+from streeplijst.congressus.admission import AdmissionController
 from streeplijst.congressus.api_base import ApiBase
-from streeplijst.congressus.config import STREEPLIJST_PARENT_FOLDER_ID, STREEPLIJST_FOLDER_CONFIGURATION
-from streeplijst.congressus.logging import log_local_request_response, log_congressus_request_response
+from streeplijst.congressus.cache import SharedCache
+from streeplijst.congressus import idempotency
+from streeplijst.congressus.concurrency import run_concurrently
+from streeplijst.congressus import deadline
+from streeplijst.congressus.cursor import PageCursor, decode_cursor, encode_cursor, filter_hash
+from streeplijst.congressus.favourites import FavouriteProducts
+from streeplijst.congressus.latency import LatencyTracker, endpoint_key
+from streeplijst.congressus.config import STREEPLIJST_FOLDER_CONFIGURATION
+from streeplijst.congressus.logging import log_local_request_response, log_congressus_request_response, threading_local
+from streeplijst.congressus.rate_limit import Priority, SharedRateLimiter
+from streeplijst.congressus.recent import RecentPurchases
+from streeplijst.congressus.records import MemberRecord, ProductRecord, SaleInvoiceRecord
+from streeplijst.congressus.search import ProductSearchIndex
+from streeplijst.congressus.snapshot import Snapshotter
+from streeplijst.congressus.tenants import DEFAULT_TENANT_NAME, TENANTS, Tenant
+from streeplijst.congressus import timing
+from streeplijst.congressus.webhooks import WebhookChanges
 from streeplijst.congressus.utils import extract_keys
 
 
+class UnsentResponse(Response):
+    """Response to a call which failed before any request reached Congressus, so nothing was created or changed."""
+
+
 class ApiV30(ApiBase):
     API_VERSION = 'v30'
 
     DEFAULT_INVOICE_TYPE = "webshop"
     DEFAULT_INVOICE_PERIOD_FILTER = datetime.timedelta(weeks=52)  # Default a year back
+    DEFAULT_SALES_ORDER = "invoice_date:desc"  # Default order of paged sales, newest first so they can be shown first
+
+    SALES_PAGE_LIMIT: int = 10  # Default number of sales in a page of sales
+    SALES_PAGE_MAX_LIMIT: int = 100  # Max number of sales in a page of sales
+    SALES_UPSTREAM_PAGE_SIZE: int = 25  # Page size of the Congressus calls made for a page of sales
+
+    CATALOG_CACHE_TTL: int = 15 * 60  # Seconds to cache folders and products
+    MEMBER_CACHE_TTL: int = 10 * 60  # Seconds to cache member details
+    MEMBER_ID_CACHE_TTL: int = 24 * 60 * 60  # Seconds to cache the member ID belonging to a username
+    MEMBER_SEARCH_CACHE_TTL: int = 5 * 60  # Seconds to cache the members found by a search term
+
+    MEMBER_AUTOCOMPLETE_MIN_LENGTH: int = 3  # Min length of a search term before members are autocompleted
+    MEMBER_AUTOCOMPLETE_PAGE_SIZE: int = 100  # Max number of members to fetch for a search term
+    MEMBER_AUTOCOMPLETE_LIMIT: int = 10  # Max number of autocompleted members to return
+
+    AGGREGATES_SYNC_INTERVAL = datetime.timedelta(minutes=5)  # Time before new sales of a member are fetched again
+
+    RECENT_PURCHASES_PER_MEMBER: int = 10  # Number of most recent sales to keep in memory per member
+    RECENT_PURCHASES_MAX_MEMBERS: int = 5000  # Max number of members to keep the most recent sales of in memory
+    RECENT_PURCHASES_MAX_AGE: int = 24 * 60 * 60  # Seconds after which the most recent sales of a member are refetched
+
+    FAVOURITE_PRODUCTS_LIMIT: int = 6  # Number of most bought products of a member to return
+    FAVOURITE_PRODUCTS_CAPACITY: int = 20  # Number of products counted in memory per member
+    FAVOURITE_PRODUCTS_MAX_MEMBERS: int = 5000  # Max number of members to count the products of in memory
+    FAVOURITE_PRODUCTS_MAX_AGE: int = 60 * 60  # Seconds after which the counts of a member are seeded again
+
+    PREFETCH_OPTIONS: Tuple[str, ...] = ('sales', 'favourites')  # Data of a member which can be prefetched
+    PREFETCH_MAX_IN_FLIGHT: int = 2  # Max number of members whose data is prefetched at the same time in this worker
+    PREFETCH_CACHE_TTL: int = 2 * 60  # Seconds to keep prefetched data of a member for the next screen of the kiosk
+
+    BULK_SALE_MAX_SIZE: int = 100  # Max number of sales in a bulk sale
+    BULK_SALE_MAX_PARALLEL: int = 4  # Max number of sales of a bulk sale which are posted at the same time
+    MEMBER_BATCH_MAX_SIZE: int = 100  # Max number of usernames in a batch of members
+    MEMBER_BATCH_MAX_PARALLEL: int = 4  # Max number of members of a batch which are looked up at the same time
+    IDEMPOTENCY_KEY_TTL: int = 24 * 60 * 60  # Seconds to remember the result of a sale posted with an idempotency key
+    IDEMPOTENCY_CLAIM_MARGIN: int = 30  # Extra seconds a request holds an idempotency key, for work between calls
+    IDEMPOTENCY_LOOKUP_PERIOD = datetime.timedelta(days=1)  # Invoices are looked up from this long before the first try
+
+    TIMEOUT_LATENCY_PERCENTILE: float = 0.99  # GET timeouts are based on this latency percentile of the endpoint
+    TIMEOUT_LATENCY_FACTOR: float = 3  # GET timeouts are this factor times the latency percentile of the endpoint
+    HEDGE_LATENCY_PERCENTILE: float = 0.95  # A GET is sent again when it takes longer than this latency percentile
+    HEDGE_MAX_WORKERS: int = 16  # Max number of threads for GETs which may be hedged
+
+    PRODUCT_SEARCH_LIMIT: int = 20  # Default max number of results of a product search
+    CATALOG_INVALIDATION_CHECK_INTERVAL: float = 5  # Seconds between checks for product webhooks of other workers
+
+    # Max number of calls to Congressus in flight per priority class in this worker, sales are always admitted
+    ADMISSION_LIMITS: dict[Priority, int] = {Priority.MEMBER: 8, Priority.BACKGROUND: 4}
+    ADMISSION_MAX_WAIT: float = 0.1  # Seconds to wait for a call of the same class to finish before rejecting a call
+    ADMISSION_RETRY_AFTER: int = 2  # Seconds after which a client may try again when its call was rejected
+
+    SNAPSHOT_VERSION: int = 1  # Version of the snapshot contents, increase it when any snapshot state changes structure
+    SNAPSHOT_INTERVAL: int = 60  # Min number of seconds between two snapshots of the in-memory state
+    SNAPSHOT_MAX_AGE: int = 24 * 60 * 60  # Max number of seconds since a snapshot was written to still restore it
+
+    CONGRESSUS_POOL_SIZE: int = 32  # Max number of connections to Congressus kept open per tenant in this worker
+
+    def __init__(self, tenant: Tenant = None):
+        """
+        :param tenant: Tenant (association) to use the API of, defaults to the default tenant. Each tenant has its own
+            connections, caches, rate limit and in-memory state.
+        """
+        self.tenant = tenant if tenant is not None else TENANTS[DEFAULT_TENANT_NAME]
+        # Connections to Congressus are reused by all calls of this tenant
+        self._session = requests.Session()
+        self._session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=self.CONGRESSUS_POOL_SIZE))
+        self._session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=self.CONGRESSUS_POOL_SIZE))
+        # All workers on this host draw their calls to Congressus from the same token bucket
+        self._rate_limiter = SharedRateLimiter(db_path=settings.SHARED_STATE_FOLDER / 'rate_limit.sqlite3',
+                                               name=f'congressus_{self.namespace}',
+                                               rate=self.CONGRESSUS_RATE_LIMIT,
+                                               capacity=self.CONGRESSUS_RATE_LIMIT_BURST)
+        # Calls are shed when Congressus is too slow to keep up, so they do not take up all threads of this worker
+        self._admission = AdmissionController(limits=self.ADMISSION_LIMITS, max_wait=self.ADMISSION_MAX_WAIT)
+        # All workers on this host share cached catalog and member data, so it is fetched only once per host
+        self._cache = SharedCache(db_path=settings.SHARED_STATE_FOLDER / 'cache.sqlite3',
+                                  namespace=self.namespace)
+        # Another request may only take over a pending key once the request holding it can no longer create or send
+        # the invoice: each call to Congressus waits at most a timeout for the rate limiter and a timeout per attempt.
+        # Looking up and sending the invoice are retried, creating it is attempted once.
+        self._idempotency_store = idempotency.IdempotencyStore(
+            tenant=self.tenant.name, ttl=self.IDEMPOTENCY_KEY_TTL,
+            claim_ttl=(2 * self.CONGRESSUS_TIMEOUT * (2 * self.CONGRESSUS_MAX_RETRIES + 1)
+                       + self.IDEMPOTENCY_CLAIM_MARGIN))
+        # Latency of each Congressus endpoint in this worker, used for timeouts and hedging of GETs
+        self._latency_tracker = LatencyTracker()
+        self._hedge_executor = ThreadPoolExecutor(max_workers=self.HEDGE_MAX_WORKERS,
+                                                  thread_name_prefix='congressus_hedge')
+        self._hedge_slots = threading.BoundedSemaphore(self.HEDGE_MAX_WORKERS)  # Hedged GETs never wait for a thread
+        # Search index over the products in all Streeplijst folders, refreshed in the background when it gets old
+        self._product_index = ProductSearchIndex()
+        self._product_index_refresh_lock = threading.Lock()
+        # When products were last changed according to a webhook, and when this was last read from the shared cache
+        self._catalog_invalidated_check: Tuple[float, Optional[float]] = (-math.inf, None)
+        self._background_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='streeplijst_background')
+        # Most recent sales of members, so they can be shown right after a sale without fetching them from Congressus
+        self._recent_purchases = RecentPurchases(max_members=self.RECENT_PURCHASES_MAX_MEMBERS,
+                                                 max_sales=self.RECENT_PURCHASES_PER_MEMBER,
+                                                 max_age=self.RECENT_PURCHASES_MAX_AGE)
+        # In-memory state is written to a snapshot regularly and restored on startup, so a restarted worker is warm
+        self._snapshotter = Snapshotter(path=settings.SHARED_STATE_FOLDER / f'snapshot_{self.namespace}.bin',
+                                        data_version=self.SNAPSHOT_VERSION, interval=self.SNAPSHOT_INTERVAL,
+                                        max_age=self.SNAPSHOT_MAX_AGE)
+        self._snapshotter.register(name='product_index', get_state=self._product_index.get_state,
+                                   restore_state=self._product_index.restore_state)
+        # Most bought products of members, so they can be shown when a member logs in
+        self._favourite_products = FavouriteProducts(max_members=self.FAVOURITE_PRODUCTS_MAX_MEMBERS,
+                                                     capacity=self.FAVOURITE_PRODUCTS_CAPACITY,
+                                                     max_age=self.FAVOURITE_PRODUCTS_MAX_AGE)
+        self._snapshotter.register(name='favourite_products', get_state=self._favourite_products.get_state,
+                                   restore_state=self._favourite_products.restore_state)
+        # Data of a member is prefetched after they log in, so the next screen of the kiosk is ready right away
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=self.PREFETCH_MAX_IN_FLIGHT,
+                                                     thread_name_prefix='streeplijst_prefetch')
+        self._prefetch_slots = threading.BoundedSemaphore(self.PREFETCH_MAX_IN_FLIGHT)  # Prefetches are never queued
+        self._snapshotter.register(name='recent_purchases', get_state=self._recent_purchases.get_state,
+                                   restore_state=self._recent_purchases.restore_state)
+        self._snapshotter.register(name='latency', get_state=self._latency_tracker.get_state,
+                                   restore_state=self._latency_tracker.restore_state)
+        self._snapshotter.restore()
+        if self._product_index_is_empty():  # Not restored from the snapshot, fill it before the first search
+            self._start_product_index_refresh()
 
     @property
     def _congressus_headers(self) -> dict[str, str]:
         # v30 requires a space between the word Bearer and the token
-        return {'Authorization': 'Bearer ' + os.environ.get('CONGRESSUS_API_TOKEN')}
+        return {'Authorization': 'Bearer ' + self.tenant.api_token}
 
     @property
     def version(self) -> str:
         return self.API_VERSION
 
+    @property
+    def namespace(self) -> str:
+        """Name of the state shared by all workers for this tenant, the default tenant keeps the plain API version."""
+        if self.tenant.name == DEFAULT_TENANT_NAME:
+            return self.API_VERSION
+        return f'{self.API_VERSION}_{self.tenant.name}'
+
     @log_local_request_response
     def list_members(self, req: Request, extra_params: dict = None) -> Response:
         """
@@ -42,22 +201,66 @@ class ApiV30(ApiBase):
 
     @log_local_request_response
     def get_member_by_id(self, req: Request, id: int) -> Response:
-        res = self._congressus_api_call_single(method='get',
-                                               url_endpoint=f'/members/{id}')
-        if status.is_success(res.status_code):  # Request is ok
-            stripped_data = self._strip_member_data(res.data)  # Strip the raw data
-            return Response(data=stripped_data, status=res.status_code)
-        else:  # Response status indicated a failure
-            return res
+        def get_stripped_member() -> Response:
+            res = self._congressus_api_call_single(method='get',
+                                                   url_endpoint=f'/members/{id}',
+                                                   priority=Priority.MEMBER)
+            if status.is_success(res.status_code):  # Request is ok
+                with timing.measure('strip'):
+                    stripped_data = self._strip_member_data(res.data)  # Strip the raw data
+                return Response(data=stripped_data, status=res.status_code)
+            else:  # Response status indicated a failure
+                return res
+
+        return self._cached_call(cache_key=f'member:{id}', ttl=self.MEMBER_CACHE_TTL, call=get_stripped_member)
 
     @log_local_request_response
-    def get_member_by_username(self, req: Request, username: str) -> Response:
+    def get_member_by_username(self, req: Request, username: str, prefetch: list[str] = None) -> Response:
         member_id, member_id_res = self._member_username_to_id(username=username)  # Get member ID
         if member_id == 0:  # No user was found
             return member_id_res  # Return the response message
 
         else:  # A user was found, get details of that user
-            return self.get_member_by_id(id=member_id, req=req)
+            res = self.get_member_by_id(id=member_id, req=req)
+            if prefetch and status.is_success(res.status_code):
+                self._start_prefetch(member_id=member_id, prefetch=prefetch)
+            return res
+
+    @log_local_request_response
+    def get_members_by_usernames(self, req: Request, usernames: list[str]) -> Response:
+        # Usernames are case-insensitive, so look up every member only once
+        unique_usernames = []
+        seen_usernames = set()
+        for username in usernames:
+            if username.lower() not in seen_usernames:
+                seen_usernames.add(username.lower())
+                unique_usernames.append(username)
+        if len(unique_usernames) > self.MEMBER_BATCH_MAX_SIZE:
+            message_data = {'message': f"A batch can contain at most {self.MEMBER_BATCH_MAX_SIZE} usernames"}
+            return Response(data=message_data, status=status.HTTP_400_BAD_REQUEST)
+
+        def get_single_member(username: str) -> dict[str, ...]:
+            # Members and their IDs which were looked up before are taken from the shared cache
+            res = self.get_member_by_username(req=req, username=username)
+            return {'username': username, 'status': res.status_code, 'data': res.data}
+
+        # Look up all members at the same time, each member is looked up in its own thread
+        results = run_concurrently(get_single_member, unique_usernames, max_workers=self.MEMBER_BATCH_MAX_PARALLEL)
+        if all(status.is_success(result['status']) for result in results):  # All members were found
+            return Response(data=results, status=status.HTTP_200_OK)
+        else:  # At least one member could not be found, the result of each member shows which one
+            return Response(data=results, status=status.HTTP_207_MULTI_STATUS)
+
+    @log_local_request_response
+    def autocomplete_members(self, req: Request, term: str) -> Response:
+        term = term.strip().lower()
+        if len(term) < self.MEMBER_AUTOCOMPLETE_MIN_LENGTH:  # Too many members would match
+            return Response(data=[], status=status.HTTP_200_OK)
+
+        members, members_res = self._search_members_by_username_prefix(term=term)
+        if members is None:  # Search failed
+            return members_res  # Return result with failure information
+        return Response(data=members[:self.MEMBER_AUTOCOMPLETE_LIMIT], status=status.HTTP_200_OK)
 
     @log_local_request_response
     def list_products(self, req: Request, extra_params: dict = None) -> Response:
@@ -69,31 +272,53 @@ class ApiV30(ApiBase):
 
     @log_local_request_response
     def list_streeplijst_folders(self, req: Request) -> Response:
-        res = self._congressus_api_call_pagination(method='get',
-                                                   url_endpoint='/product-folders',
-                                                   query_params={'parent_id': STREEPLIJST_PARENT_FOLDER_ID})
+        def get_folders() -> Response:
+            return self._congressus_api_call_pagination(method='get',
+                                                        url_endpoint='/product-folders',
+                                                        query_params={'parent_id': self.tenant.parent_folder_id})
+
         # TODO: Add image files to folders (image urls are not included in Congressus API response)
-        return res
+        return self._cached_call(cache_key='folders', ttl=self.CATALOG_CACHE_TTL, call=get_folders)
 
     @log_local_request_response
     def list_products_in_folder(self, req: Request, folder_id: int) -> Response:
-        res = self._congressus_api_call_pagination(method='get',
-                                                   url_endpoint='/products',
-                                                   query_params={'folder_id': folder_id})  # Add the folder_id
-        if status.is_success(res.status_code):  # Request is ok
-            stripped_products_array = []  # Empty array of stripped products
-            for product in res.data:  # Iterate all products in the response
-                stripped_products_array.append(
-                    self._strip_product_data(raw_product_data=product))  # Strip product data
-            return Response(data=stripped_products_array, status=res.status_code)  # Return response
-        else:  # Response status indicated a failure
-            return res  # Return result with failure information
+        return self._get_products_in_folder(folder_id=folder_id)
+
+    # Not logged like other requests, since it is called on every keystroke and only searches in memory
+    def search_products(self, req: Request, query: str, limit: int = None) -> Response:
+        if limit is None:
+            limit = self.PRODUCT_SEARCH_LIMIT
+
+        if self._product_index_is_empty():  # Still being filled in the background after a start without a snapshot
+            self._start_product_index_refresh()  # Unless it is still running, e.g. when the last refresh failed
+            return Response(data={'message': "Products are still being loaded"},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
+
+        folder_ages = [self._product_index.folder_age(folder['id']) for folder in self.tenant.folder_configuration]
+        # Time since products were changed according to a webhook, which may have been received by another worker
+        invalidated_time = self._catalog_invalidated_time()
+        max_age = self.CATALOG_CACHE_TTL if invalidated_time is None else time.time() - invalidated_time
+        if any(age is None or age > min(max_age, self.CATALOG_CACHE_TTL) for age in folder_ages):  # Index is old
+            self._start_product_index_refresh()
+
+        return Response(data=self._product_index.search(query=query, limit=limit), status=status.HTTP_200_OK)
 
     @log_local_request_response
     def get_sales(self, req: Request, usernames: list[str] = None, member_ids: list[int] = None,
                   invoice_status: str = None,
                   invoice_type: str = None, period_filter: str = None, product_offer_id: list[str] = None,
-                  order: str = None) -> Response:
+                  order: str = None, limit: int = None, cursor: str = None) -> Response:
+        paged = limit is not None or cursor is not None  # Return a single page of sales instead of all sales
+        sales_filter_hash = filter_hash(usernames=usernames, member_ids=member_ids, invoice_status=invoice_status,
+                                        invoice_type=invoice_type, period_filter=period_filter,
+                                        product_offer_id=product_offer_id, order=order)
+        page_cursor = None
+        if cursor is not None:
+            try:
+                page_cursor = decode_cursor(cursor=cursor, expected_filter_hash=sales_filter_hash)
+            except ValueError as e:
+                return Response(data={'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         if usernames:  # If usernames are given, iterate all usernames and convert them to member IDs
             for username in usernames:
                 id, _ = self._member_username_to_id(username)  # Get user ID from username
@@ -108,9 +333,14 @@ class ApiV30(ApiBase):
             period_time = curr_date - self.DEFAULT_INVOICE_PERIOD_FILTER  # Go back default time
             period_filter = period_time.strftime("%Y-%m-%d")  # Convert to string in specific format
 
+        if paged and not order:  # Pages are only stable if the order is fixed
+            order = self.DEFAULT_SALES_ORDER
+
         params = dict()  # Create a parameters dict to hold all request parameters
         if req:  # If a request was passed in, initialize params with the request data
             params = req.query_params.copy()  # Copy the existing params to a mutable copy
+            params.pop('limit', None)  # Paging of local results is not passed on to Congressus
+            params.pop('cursor', None)
 
         params.update({  # Store additional request parameters in the format required by Congressus
             "member_id": member_ids,  # User ids (not usernames)
@@ -121,14 +351,20 @@ class ApiV30(ApiBase):
             "order": order
         })
 
+        if paged:
+            return self._get_sales_page(params=params, limit=limit, page_cursor=page_cursor,
+                                        sales_filter_hash=sales_filter_hash)
+
         # Make request
         res = self._congressus_api_call_pagination(method='get',
                                                    url_endpoint='/sale-invoices',
                                                    query_params=params)
         if status.is_success(res.status_code):  # Request is ok
             stripped_sales_array = []  # Empty array of stripped sales
-            for sale in res.data:  # Iterate all sales in the response
-                stripped_sales_array.append(self._strip_sales_data(raw_sales_data=sale))  # Strip sale data
+            with timing.measure('strip'):
+                for sale in res.data:  # Iterate all sales in the response
+                    stripped_sales_array.append(self._strip_sales_data(raw_sales_data=sale))  # Strip sale data
+            self._observe_sales(stripped_sales=stripped_sales_array)
             return Response(data=stripped_sales_array, status=res.status_code)  # Return response
         else:  # Response status indicated a failure
             return res  # Return result with failure information
@@ -136,33 +372,251 @@ class ApiV30(ApiBase):
     @log_local_request_response
     def get_sales_by_username(self, req: Request, username: str, invoice_status: str = None, invoice_type: str = None,
                               period_filter: str = None, product_offer_id: list[str] = None,
-                              order: str = None) -> Response:
+                              order: str = None, limit: int = None, cursor: str = None) -> Response:
         member_id, member_id_res = self._member_username_to_id(username)  # First convert username to member ID
 
         return self.get_sales(member_ids=[member_id], invoice_status=invoice_status, invoice_type=invoice_type,
-                              period_filter=period_filter, product_offer_id=product_offer_id, order=order, req=req)
+                              period_filter=period_filter, product_offer_id=product_offer_id, order=order,
+                              limit=limit, cursor=cursor, req=req)
 
     @log_local_request_response
-    def post_sale(self, req: Request, member_id: int, items: list[dict[str, ...]]) -> Response:
-        payload = {  # Store the sales parameters in the format required by Congressus
-            "member_id": member_id,  # User id (not username)
-            "items": items,  # List of items
-            "invoice_type": self.DEFAULT_INVOICE_TYPE  # Type of invoice so we can filter
-        }
-        res = self._congressus_api_call_single(method='post',
-                                               url_endpoint='/sale-invoices',
-                                               payload=payload)
+    def get_recent_purchases_by_username(self, req: Request, username: str) -> Response:
+        member_id, member_id_res = self._member_username_to_id(username)  # First convert username to member ID
+        if member_id == 0:  # No user was found
+            return member_id_res  # Return the response message
+
+        return self._get_recent_purchases(req=req, member_id=member_id)
+
+    def _get_recent_purchases(self, req: Optional[Request], member_id: int) -> Response:
+        """
+        Get the most recent sales of a member from memory, from data prefetched by any worker or from Congressus.
+
+        :param req: Original request, or None when the sales are prefetched.
+        :param member_id: Congressus ID of the member.
+        :return: Stripped sales of the member, newest first.
+        """
+        # Sales posted by other workers are not in the memory of this worker, they mark when the member last bought
+        changed = self._cache.get(f'member_sales_changed:{member_id}')
+        recent_sales = self._recent_purchases.get(member_id=member_id, changed=changed)
+        if recent_sales is None:
+            recent_sales = self._get_prefetched(f'prefetched_recent_purchases:{member_id}', changed=changed)
+        if recent_sales is not None:
+            return Response(data=recent_sales, status=status.HTTP_200_OK)
+
+        # Fetch only the first page of the most recent sales
+        res = self.get_sales(req=req, member_ids=[member_id], limit=self.RECENT_PURCHASES_PER_MEMBER)
         if not status.is_success(res.status_code):  # Response status indicated a failure
             return res  # Return result with failure information
+        self._recent_purchases.fill(member_id=member_id, sales=res.data['data'])
+        self._snapshotter.mark_changed()
+        return Response(data=res.data['data'], status=status.HTTP_200_OK)
+
+    @log_local_request_response
+    def get_favourite_products_by_username(self, req: Request, username: str) -> Response:
+        member_id, member_id_res = self._member_username_to_id(username)  # First convert username to member ID
+        if member_id == 0:  # No user was found
+            return member_id_res  # Return the response message
+
+        return self._get_favourite_products(req=req, member_id=member_id)
+
+    def _get_favourite_products(self, req: Optional[Request], member_id: int) -> Response:
+        """
+        Get the most bought products of a member from memory, from data prefetched by any worker or from their sales
+        aggregates.
+
+        :param req: Original request, or None when the products are prefetched.
+        :param member_id: Congressus ID of the member.
+        :return: Product offer ID, name and (approximate) quantity of the most bought products, most bought first.
+        """
+        changed = self._cache.get(f'member_sales_changed:{member_id}')
+        favourites = self._favourite_products.get(member_id=member_id, limit=self.FAVOURITE_PRODUCTS_LIMIT,
+                                                  changed=changed)
+        if favourites is None:
+            favourites = self._get_prefetched(f'prefetched_favourite_products:{member_id}', changed=changed)
+        if favourites is not None:
+            return Response(data=favourites, status=status.HTTP_200_OK)
+
+        # Seed the counts of the member with the product counts of their sales aggregates
+        sync_res = self._sync_sales_aggregates(member_id=member_id)
+        if sync_res is not None and aggregates.get_sync(tenant=self.tenant.name, member_id=member_id) is None:
+            return sync_res  # Failed and there is nothing to show, return result with failure information
+        top_products = aggregates.get_top_products(tenant=self.tenant.name, member_id=member_id,
+                                                   limit=self.FAVOURITE_PRODUCTS_CAPACITY)
+        self._favourite_products.fill(member_id=member_id, products=top_products)
+        self._snapshotter.mark_changed()
+        favourites = self._favourite_products.get(member_id=member_id, limit=self.FAVOURITE_PRODUCTS_LIMIT)
+        return Response(data=favourites, status=status.HTTP_200_OK)
+
+    @log_local_request_response
+    def get_sales_aggregates_by_username(self, req: Request, username: str) -> Response:
+        member_id, member_id_res = self._member_username_to_id(username)  # First convert username to member ID
+        if member_id == 0:  # No user was found
+            return member_id_res  # Return the response message
+
+        sync_res = self._sync_sales_aggregates(member_id=member_id)
+        if sync_res is not None and aggregates.get_sync(tenant=self.tenant.name, member_id=member_id) is None:
+            return sync_res  # Failed and there is nothing to show, return result with failure information
+
+        # If synchronizing failed, the totals of the last successful synchronization are returned
+        return Response(data=aggregates.get_member_aggregates(tenant=self.tenant.name, member_id=member_id),
+                        status=status.HTTP_200_OK)
+
+    @log_local_request_response
+    def post_sale(self, req: Request, member_id: int, items: list[dict[str, ...]],
+                  idempotency_key: str = None) -> Response:
+        invoice_data = None  # Raw invoice data from Congressus, if the invoice was created by an earlier request
+        invoice_status = status.HTTP_201_CREATED  # Status code of creating the invoice
+        claim = None  # Claim on the idempotency key, if the client supplied one
+        if idempotency_key:  # Check whether this sale was already posted with the same key
+            data_fingerprint = idempotency.fingerprint({'member_id': member_id, 'items': items})
+            claim = self._idempotency_store.begin(key=idempotency_key, data_fingerprint=data_fingerprint)
+            if claim.outcome == idempotency.REPLAY:  # Return the stored result without calling Congressus
+                return Response(data=claim.res_data, status=claim.res_status, headers={'Idempotent-Replayed': 'true'})
+            elif claim.outcome == idempotency.IN_PROGRESS:
+                message_data = {'message': f"A sale with idempotency key {idempotency_key} is still being processed"}
+                return Response(data=message_data, status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'})
+            elif claim.outcome == idempotency.MISMATCH:
+                message_data = {'message': f"Idempotency key {idempotency_key} was already used for a different sale"}
+                return Response(data=message_data, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            elif claim.outcome == idempotency.CREATED:  # Invoice exists but was not sent, only retry sending it
+                invoice_data = claim.invoice
+            elif claim.outcome == idempotency.UNKNOWN:  # An earlier request may have created the invoice, look it up
+                invoice_data, lookup_res = self._find_created_invoice(member_id=member_id, items=items,
+                                                                      since=claim.first_used)
+                if lookup_res is not None:  # Creating the invoice without knowing it does not exist may create it twice
+                    self._idempotency_store.mark_unknown(key=idempotency_key, token=claim.token)
+                    return lookup_res  # Return result with failure information
+                if invoice_data is not None and not self._idempotency_store.mark_created(
+                        key=idempotency_key, token=claim.token, invoice=invoice_data):
+                    # Another key with the same sale claimed the invoice first, look it up again on the next try
+                    self._idempotency_store.mark_unknown(key=idempotency_key, token=claim.token)
+                    message_data = {'message': f"A sale with idempotency key {idempotency_key} is still being "
+                                               f"processed"}
+                    return Response(data=message_data, status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'})
+
+        if invoice_data is None:  # Create the invoice
+            payload = {  # Store the sales parameters in the format required by Congressus
+                "member_id": member_id,  # User id (not username)
+                "items": items,  # List of items
+                "invoice_type": self.DEFAULT_INVOICE_TYPE  # Type of invoice so we can filter
+            }
+            # Creating is attempted only once, since the invoice may exist after a timeout and would be created twice
+            res = self._congressus_api_call_single(method='post',
+                                                   url_endpoint='/sale-invoices',
+                                                   payload=payload,
+                                                   max_retries=1,
+                                                   priority=Priority.SALE)
+            if not status.is_success(res.status_code):  # Response status indicated a failure
+                if claim is not None:
+                    # Nothing was created when the call never reached Congressus or Congressus rejected it, so the
+                    # client may retry with the same key. After a timeout or server error the invoice may exist, so
+                    # a retry looks it up before creating it.
+                    nothing_created = isinstance(res, UnsentResponse) or (
+                            status.is_client_error(res.status_code)
+                            and res.status_code != status.HTTP_408_REQUEST_TIMEOUT)
+                    if nothing_created and claim.outcome == idempotency.NEW:
+                        self._idempotency_store.release(key=idempotency_key, token=claim.token)
+                    else:  # An earlier request may still have created the invoice
+                        self._idempotency_store.mark_unknown(key=idempotency_key, token=claim.token)
+                return res  # Return result with failure information
+
+            invoice_data, invoice_status = res.data, res.status_code
+            if claim is not None:  # A retry with the same key must not create the invoice again
+                self._idempotency_store.mark_created(key=idempotency_key, token=claim.token, invoice=invoice_data)
 
         # Request is OK. An extra step for posting a sale is to send the invoice to the buyer immediately
-        res_send = self.send_sale_invoice(req=req, invoice_id=res.data["id"])
+        res_send = self.send_sale_invoice(req=req, invoice_id=invoice_data["id"])
         if not status.is_success(res_send.status_code):
+            if claim is not None:  # A retry with the same key only retries sending the invoice
+                self._idempotency_store.mark_created(key=idempotency_key, token=claim.token, invoice=invoice_data)
             raise APIException(detail=json.dumps(res_send.data), code=res_send.status_code)  # TODO: Log proper warning
 
         # Strip and send the sale data to the frontend
-        stripped_data = self._strip_sales_data(raw_sales_data=res.data)  # Strip sale data
-        return Response(data=stripped_data, status=res.status_code)  # Return sale response
+        with timing.measure('strip'):
+            stripped_data = self._strip_sales_data(raw_sales_data=invoice_data)  # Strip sale data
+        # Other workers fetch the recent sales of the member again, this worker adds the sale to them right away
+        self._cache.set(f'member_sales_changed:{member_id}', value=time.time(), ttl=self.RECENT_PURCHASES_MAX_AGE)
+        self._observe_sales(stripped_sales=[stripped_data])
+        if claim is not None:  # Store the result so a retry with the same key returns it
+            self._idempotency_store.complete(key=idempotency_key, token=claim.token, res_status=invoice_status,
+                                             res_data=stripped_data)
+        return Response(data=stripped_data, status=invoice_status)  # Return sale response
+
+    def _find_created_invoice(self, member_id: int, items: list[dict[str, ...]],
+                              since: datetime.datetime) -> Tuple[Optional[dict], Optional[Response]]:
+        """
+        Look up the invoice of a sale which an earlier request with the same idempotency key may have created. An
+        invoice of the member with the same items matches, unless it belongs to another idempotency key.
+
+        :param member_id: Congressus ID of the member.
+        :param items: Items of the sale.
+        :param since: When the sale was first posted.
+        :return: Raw invoice data, or None if the invoice was not created, and a Response with failure information if
+            the invoices could not be looked up.
+        """
+        params = {
+            "member_id": [member_id],
+            "category": self.DEFAULT_INVOICE_TYPE,
+            "period_filter": (since - self.IDEMPOTENCY_LOOKUP_PERIOD).strftime("%Y-%m-%d"),
+            "order": self.DEFAULT_SALES_ORDER
+        }
+        res = self._congressus_api_call_pagination(method='get', url_endpoint='/sale-invoices', query_params=params,
+                                                   priority=Priority.SALE)
+        if not status.is_success(res.status_code):  # Response status indicated a failure
+            return None, res
+
+        def item_counts(sale_items: list[dict[str, ...]]) -> list[tuple[str, str]]:
+            return sorted((str(item.get('product_offer_id')), str(item.get('quantity'))) for item in sale_items or [])
+
+        sale_item_counts = item_counts(items)
+        candidates = [invoice for invoice in res.data
+                      if invoice.get('member_id') == member_id
+                      and item_counts(invoice.get('items')) == sale_item_counts]
+        claimed_invoice_ids = self._idempotency_store.claimed_invoice_ids([invoice['id'] for invoice in candidates])
+        for invoice in candidates:
+            if invoice['id'] not in claimed_invoice_ids:
+                return invoice, None
+        return None, None
+
+    @log_local_request_response
+    def post_sales_bulk(self, req: Request, sales: list[dict[str, ...]]) -> Response:
+        if len(sales) > self.BULK_SALE_MAX_SIZE:
+            message_data = {'message': f"A bulk sale can contain at most {self.BULK_SALE_MAX_SIZE} sales"}
+            return Response(data=message_data, status=status.HTTP_400_BAD_REQUEST)
+
+        def post_single_sale(sale: dict[str, ...]) -> dict[str, ...]:
+            member_id = sale.get('member_id') if isinstance(sale, dict) else None
+            if not self._is_valid_bulk_sale(sale):  # Sale is incomplete or malformed, do not post it
+                return {
+                    'member_id': member_id,
+                    'status': status.HTTP_400_BAD_REQUEST,
+                    'data': {'message': "Every sale requires an integer member_id, a list of items and optionally a "
+                                        "string idempotency_key"}
+                }
+
+            try:
+                res = self.post_sale(req=req, member_id=member_id, items=sale['items'],
+                                     idempotency_key=sale.get('idempotency_key'))
+                return {'member_id': member_id, 'status': res.status_code, 'data': res.data}
+            except APIException as e:  # The sale was created but could not be sent
+                return {'member_id': member_id, 'status': e.status_code, 'data': {'error': e.detail}}
+
+        # Post all sales at the same time, each sale is created and sent in its own thread
+        results = run_concurrently(post_single_sale, sales, max_workers=self.BULK_SALE_MAX_PARALLEL)
+        if all(status.is_success(result['status']) for result in results):  # All sales were posted
+            return Response(data=results, status=status.HTTP_201_CREATED)
+        else:  # At least one sale failed, the result of each sale shows which one
+            return Response(data=results, status=status.HTTP_207_MULTI_STATUS)
+
+    @staticmethod
+    def _is_valid_bulk_sale(sale: object) -> bool:
+        """Check whether a sale of a bulk sale has the shape of the POST data of a single sale."""
+        if not isinstance(sale, dict):
+            return False
+        member_id, items, idempotency_key = sale.get('member_id'), sale.get('items'), sale.get('idempotency_key')
+        return (isinstance(member_id, int) and not isinstance(member_id, bool)
+                and isinstance(items, list) and len(items) > 0 and all(isinstance(item, dict) for item in items)
+                and (idempotency_key is None or isinstance(idempotency_key, str)))
 
     @log_local_request_response
     def send_sale_invoice(self, req: Request, invoice_id: int) -> Response:
@@ -175,15 +629,65 @@ class ApiV30(ApiBase):
         }
         return self._congressus_api_call_single(method='post',
                                                 url_endpoint=f'/sale-invoices/{invoice_id}/send',
-                                                payload=payload)
+                                                payload=payload,
+                                                priority=Priority.SALE)
+
+    @log_local_request_response
+    def handle_webhook(self, req: Request, changes: WebhookChanges) -> Response:
+        streeplijst_folder_ids = {folder['id'] for folder in self.tenant.folder_configuration}
+        invalidated_keys = []
+
+        # Products are cached per folder, so refresh the folders containing the changed products
+        changed_folder_ids = set(changes.folder_ids)
+        for product_id, folder_id in changes.products:
+            if folder_id is None:  # Look up the folder in the index, or refresh all folders if the product is new
+                folder_id = self._product_index.folder_of(product_id)
+            changed_folder_ids.update([folder_id] if folder_id is not None else streeplijst_folder_ids)
+        if changes.folder_ids:  # Names of the folders may have changed
+            invalidated_keys.append('folders')
+        refreshed_folder_ids = sorted(changed_folder_ids & streeplijst_folder_ids)
+        invalidated_keys += [f'products_in_folder:{folder_id}' for folder_id in refreshed_folder_ids]
+
+        for member_id, username in changes.members:
+            invalidated_keys.append(f'member:{member_id}')
+            if username:  # The username of the member may have changed
+                invalidated_keys.append(f'member_id:{username.lower()}')
+        # Data prefetched for a member after a lookup may contain their old name or outdated sales
+        for member_id in sorted({member_id for member_id, _ in changes.members} | set(changes.sale_member_ids)):
+            invalidated_keys += [f'prefetched_recent_purchases:{member_id}',
+                                 f'prefetched_favourite_products:{member_id}']
+
+        for cache_key in invalidated_keys:
+            self._cache.delete(cache_key)
+        if changes.members:  # Any autocomplete result may contain a changed member, or miss a renamed one
+            self._cache.delete_prefix('member_search:')
+            invalidated_keys.append('member_search:*')
+        for member_id in changes.sale_member_ids:  # Recent purchases and favourites in memory of all workers are old
+            self._cache.set(f'member_sales_changed:{member_id}', value=time.time(), ttl=self.RECENT_PURCHASES_MAX_AGE)
+        if changes.sale_member_ids:  # Invoices may have been paid, the aggregates fetch them on the next request
+            aggregates.mark_sales_changed(tenant=self.tenant.name, member_ids=changes.sale_member_ids,
+                                          changed_at=timezone.now())
+        if refreshed_folder_ids:
+            # Product indexes of other workers are refreshed on one of their next searches
+            invalidated_time = time.time()
+            self._cache.set('catalog_invalidated', value=invalidated_time, ttl=self.CATALOG_CACHE_TTL)
+            self._catalog_invalidated_check = (time.monotonic(), invalidated_time)
+            for folder_id in refreshed_folder_ids:  # Fetch the new products before they are needed
+                self._background_executor.submit(self._get_products_in_folder, folder_id)
+
+        return Response(data={'invalidated': invalidated_keys, 'refreshed_folders': refreshed_folder_ids},
+                        status=status.HTTP_200_OK)
 
     def _congressus_api_call_single(self, method: str, url_endpoint: str, query_params: dict = None,
-                                    payload: dict = None, timeout: int = None, max_retries: int = None) -> Response:
+                                    payload: dict = None, timeout: int = None, max_retries: int = None,
+                                    priority: Priority = Priority.BACKGROUND) -> Response:
         """
         Make a call to the Congressus API where only a single response is expected (no pagination).
 
         If no response is received from Congressus within timeout seconds for retries times, a Response is returned
-        with error code HTTP_408_REQUEST_TIMEOUT.
+        with error code HTTP_408_REQUEST_TIMEOUT. The timeout of a GET is shrunk to the time left before the deadline
+        of the local request, and a GET is not tried again once the deadline has passed. If no request reached
+        Congressus at all, e.g. because the connection was refused, an 'UnsentResponse' is returned instead.
 
         All response headers are stripped.
 
@@ -191,158 +695,716 @@ class ApiV30(ApiBase):
         :param url_endpoint: URL endpoint to call. Example: '/members'
         :param query_params: Optional additional parameters to add as a query.
         :param payload: Optional data to send with a POST request. Is converted from a dict to JSON.
-        :param timeout: Timeout in seconds, defaults to self.CONGRESSUS_TIMEOUT.
+        :param timeout: Timeout in seconds, defaults to a timeout based on the latency of the endpoint for GETs and
+            self.CONGRESSUS_TIMEOUT otherwise.
         :param max_retries: Number of retries in case of a timeout, defaults to self.CONGRESSUS_MAX_RETRIES.
+        :param priority: Priority class used by the shared rate limiter, defaults to Priority.BACKGROUND.
         :return: A Response object.
         """
         if timeout is None:
-            timeout = self.CONGRESSUS_TIMEOUT
+            timeout = self._congressus_timeout(method=method, url_endpoint=url_endpoint)
         if max_retries is None:
             max_retries = self.CONGRESSUS_MAX_RETRIES
 
         params = query_params  # Rename to params
 
-        # Attempt making the request, taking into account the timeout and retries limits
-        start_time = DateTime.now()  # Track current time in case a timeout occurs
-        retries = 0
-        while retries < max_retries:  # Attempt to get a response a number of times
-            try:
-                curr_res = requests.request(method=method,
-                                            url=self._congressus_url_base + url_endpoint,
-                                            headers=self._congressus_headers,
-                                            params=params,
-                                            json=payload,
-                                            timeout=timeout)
-                curr_res_data = None  # We assume no content is sent
-                if curr_res.content:  # If there is any content, convert it to a dict
-                    curr_res_data = curr_res.json()  # Convert data to a python dict
-
-                # Log response and request
-                log_congressus_request_response(res_status=curr_res.status_code, elapsed_time=curr_res.elapsed,
-                                                method=method, url=self._congressus_url_base + url_endpoint,
-                                                params=params, payload=payload)
+        # Reject the call right away when too many calls of its class are already waiting for Congressus
+        if not self._admission.acquire(priority=priority):
+            return self._overloaded_response(method=method, url_endpoint=url_endpoint, params=params,
+                                             payload=payload)
+        try:
+            # Attempt making the request, taking into account the timeout and retries limits
+            start_time = DateTime.now()  # Track current time in case a timeout occurs
+            retries = 0
+            sent = False  # Whether any attempt may have reached Congressus
+            connect_failed = False  # Whether any attempt could not connect to Congressus
+            while retries < max_retries:  # Attempt to get a response a number of times
+                attempt_timeout = self._attempt_timeout(method=method, timeout=timeout)
+                if attempt_timeout is None:  # The deadline of the local request has passed, do not try again
+                    break
+                with timing.measure('rate_limit'):
+                    acquired = self._rate_limiter.acquire(priority=priority, max_wait=attempt_timeout)  # Wait for turn
+                if not acquired:
+                    if sent:  # An earlier attempt may have been processed, so the call timed out rather than not made
+                        break
+                    return self._rate_limited_response(method=method, url_endpoint=url_endpoint, params=params,
+                                                       payload=payload)
+                attempt_timeout = self._attempt_timeout(method=method, timeout=timeout)  # Waiting took time
+                if attempt_timeout is None:  # The deadline passed while waiting for a turn
+                    break
+                try:
+                    curr_res = self._congressus_request(method=method, url_endpoint=url_endpoint, params=params,
+                                                        payload=payload, timeout=attempt_timeout)
+                    curr_res_data = None  # We assume no content is sent
+                    if curr_res.content:  # If there is any content, convert it to a dict
+                        with timing.measure('decode'):
+                            curr_res_data = curr_res.json()  # Convert data to a python dict
+
+                    # Log response and request
+                    log_congressus_request_response(res_status=curr_res.status_code, elapsed_time=curr_res.elapsed,
+                                                    method=method, url=self._congressus_url_base + url_endpoint,
+                                                    params=params, payload=payload)
 
-                # Return the response from the API server converted to a rest_framework.Response object
-                return Response(data=curr_res_data,  # Return the current response data
-                                status=curr_res.status_code,  # Copy the status code
-                                )
-            except (requests.exceptions.Timeout,
-                    requests.exceptions.ConnectionError):  # If request timed out or no connection was made, try again
-                # TODO: Maybe move ConnectionError to its own except block?
-                retries += 1  # Increment the number of retries
-
-        # Log response and request
-        elapsed_time = DateTime.now() - start_time
-        log_congressus_request_response(res_status=status.HTTP_408_REQUEST_TIMEOUT, elapsed_time=elapsed_time,
-                                        method=method, url=self._congressus_url_base + url_endpoint, params=params,
-                                        payload=payload)
+                    # Return the response from the API server converted to a rest_framework.Response object
+                    return Response(data=curr_res_data,  # Return the current response data
+                                    status=curr_res.status_code,  # Copy the status code
+                                    )
+                except (requests.exceptions.Timeout,  # If request timed out or no connection was made, try again
+                        requests.exceptions.ConnectionError) as e:
+                    if self._connection_failed(e):
+                        connect_failed = True
+                    else:  # The request may have been processed by Congressus
+                        sent = True
+                    retries += 1  # Increment the number of retries
+
+            if not sent and connect_failed:  # Every attempt failed before anything was sent
+                log_congressus_request_response(res_status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                                elapsed_time=DateTime.now() - start_time, method=method,
+                                                url=self._congressus_url_base + url_endpoint, params=params,
+                                                payload=payload)
+                return UnsentResponse(data={"error": "Could not connect to Congressus"},
+                                      status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+            # Log response and request
+            elapsed_time = DateTime.now() - start_time
+            log_congressus_request_response(res_status=status.HTTP_408_REQUEST_TIMEOUT, elapsed_time=elapsed_time,
+                                            method=method, url=self._congressus_url_base + url_endpoint, params=params,
+                                            payload=payload)
+
+            # If the number of retries is exceeded, return a response with an error code
+            response_class = Response if sent else UnsentResponse
+            return response_class(data={"error": "Request timeout"}, status=status.HTTP_408_REQUEST_TIMEOUT)
+        finally:
+            self._admission.release(priority=priority)
+
+    @staticmethod
+    def _connection_failed(exception: requests.exceptions.RequestException) -> bool:
+        """
+        Check whether a request failed because no connection to Congressus could be made, so it was never sent. Any
+        other failure may happen after Congressus received the request.
 
-        # If the number of retries is exceeded, return a response with an error code
-        return Response(data={"error": "Request timeout"}, status=status.HTTP_408_REQUEST_TIMEOUT)
+        :param exception: Exception raised by the request.
+        :return: Whether the request was certainly not sent.
+        """
+        if isinstance(exception, requests.exceptions.ConnectTimeout):
+            return True
+        reason = getattr(exception.args[0], 'reason', None) if exception.args else None  # Wrapped urllib3 exception
+        return isinstance(reason, NewConnectionError)
 
     def _congressus_api_call_pagination(self, method: str, url_endpoint: str, page_size: int = 25,
                                         query_params: dict = None, payload: dict = None, timeout: int = None,
-                                        max_retries: int = None) -> Response:
+                                        max_retries: int = None, priority: Priority = Priority.BACKGROUND,
+                                        limit: int = None, stop_predicate: Callable[[dict], bool] = None) -> Response:
         """
         Make a call to the Congressus API where a paginated response is expected. The paginated data will be combined
         into one array, the returned Response will contain all combined data.
 
+        Callers which do not need all data can stop the pagination early: after 'limit' items, or after the page with
+        an item for which 'stop_predicate' is true. No further pages are requested then.
+
         For every page, a timeout and number of retries is set. If no response is received from Congressus within
-        timeout seconds for retries times, a Response is returned with error code HTTP_408_REQUEST_TIMEOUT.
+        timeout seconds for retries times, a Response is returned with error code HTTP_408_REQUEST_TIMEOUT. The same
+        response is returned when the deadline of the local request passes before all pages of a GET were received,
+        since the timeout of every page is shrunk to the time left before the deadline.
 
         All response headers are stripped.
 
         :param method: Method to obtain. Must be 'get' or 'post'
         :param url_endpoint: URL endpoint to call. Example: '/members'
-        :param page_size: Optional page size for paginated responses.
+        :param page_size: Optional page size hint for paginated responses, shrunk to the limit if that is smaller.
         :param query_params: Optional additional parameters to add as a query.
         :param payload: Optional data to send with a POST request. Is converted from a dict to JSON.
-        :param timeout: Timeout in seconds, defaults to self.CONGRESSUS_TIMEOUT.
+        :param timeout: Timeout in seconds, defaults to a timeout based on the latency of the endpoint for GETs and
+            self.CONGRESSUS_TIMEOUT otherwise.
         :param max_retries: Number of retries in case of a timeout, defaults to self.CONGRESSUS_MAX_RETRIES.
+        :param priority: Priority class used by the shared rate limiter, defaults to Priority.BACKGROUND.
+        :param limit: Optional max number of items to return.
+        :param stop_predicate: Optional function which is called with every item, the pagination stops after the page
+            with an item for which it returns True. All items of that page are returned.
         :return: A Response object.
         """
         if timeout is None:
-            timeout = self.CONGRESSUS_TIMEOUT
+            timeout = self._congressus_timeout(method=method, url_endpoint=url_endpoint)
         if max_retries is None:
             max_retries = self.CONGRESSUS_MAX_RETRIES
+        if limit is not None:  # Do not fetch more items than needed
+            page_size = min(page_size, limit)
 
         params = {'page_size': page_size}  # Create dict for query params to send with the request
         if query_params:  # If extra params were provided
             params.update(query_params)  # Add extra params to the existing params
 
-        # Run a loop to make continuous calls to Congressus in case a response contains pagination
-        retries = 0  # Retries are restartTimer after Congressus returns a successful response (i.e. after every page)
-        start_time = DateTime.now()  # Track current time in case a timeout occurs
-        curr_page = 1  # Start at page 1
-        total_res_data = []  # Instantiate empty list to hold all combined data in case of pagination
-        while retries < max_retries:  # Get responses until the number of retries is met or restartTimer
-            params.update({'page': curr_page})  # Add updates pagination options
+        # Reject the call right away when too many calls of its class are already waiting for Congressus
+        if not self._admission.acquire(priority=priority):
+            return self._overloaded_response(method=method, url_endpoint=url_endpoint, params=params,
+                                             payload=payload)
+        try:
+            # Run a loop to make continuous calls to Congressus in case a response contains pagination
+            retries = 0  # Retries are restarted after Congressus returns a successful response (i.e. after every page)
+            start_time = DateTime.now()  # Track current time in case a timeout occurs
+            curr_page = 1  # Start at page 1
+            total_res_data = []  # Instantiate empty list to hold all combined data in case of pagination
+            while retries < max_retries:  # Get responses until the number of retries is met or restartTimer
+                params.update({'page': curr_page})  # Add updates pagination options
+
+                attempt_timeout = self._attempt_timeout(method=method, timeout=timeout)
+                if attempt_timeout is None:  # The deadline of the local request has passed, do not fetch more pages
+                    break
+                with timing.measure('rate_limit'):
+                    acquired = self._rate_limiter.acquire(priority=priority, max_wait=attempt_timeout)  # Wait for turn
+                if not acquired:
+                    return self._rate_limited_response(method=method, url_endpoint=url_endpoint, params=params,
+                                                       payload=payload)
+                attempt_timeout = self._attempt_timeout(method=method, timeout=timeout)  # Waiting took time
+                if attempt_timeout is None:  # The deadline passed while waiting for a turn
+                    break
+
+                # Attempt making the request, taking into account the timeout limit and max number of retries
+                try:  # Try to make the request and catch in case of a timeout
+                    curr_res = self._congressus_request(method=method, url_endpoint=url_endpoint, params=params,
+                                                        payload=payload, timeout=attempt_timeout)
+                    with timing.measure('decode'):
+                        curr_res_data = curr_res.json()  # Convert data to a python dict
+
+                    # Log response and request
+                    log_congressus_request_response(res_status=curr_res.status_code, elapsed_time=curr_res.elapsed,
+                                                    method=method, url=self._congressus_url_base + url_endpoint,
+                                                    params=params, payload=payload)
+
+                    # Check if there is an error in the response and return that error response
+                    if not status.is_success(curr_res.status_code):
+                        # Return the response from the API server converted to a rest_framework.Response object
+                        return Response(data=curr_res_data,  # Return the error response data
+                                        status=curr_res.status_code,  # Copy the status code
+                                        )
+                    # Check that the response actually has pagination, indicated by having a field 'data'
+                    if 'data' not in curr_res_data:  # There is no pagination, return the current response
+                        # Return the response from the API server converted to a rest_framework.Response object
+                        return Response(data=curr_res_data,  # Return the current response data
+                                        status=curr_res.status_code,  # Copy the status code
+                                        )
+                    # The result has pagination, add the result contents to the running total
+                    total_res_data += curr_res_data['data']  # Get the data array and add to running total
+
+                    # Check whether the caller already has all data it needs
+                    has_enough = (limit is not None and len(total_res_data) >= limit) or \
+                                 (stop_predicate is not None and any(map(stop_predicate, curr_res_data['data'])))
+
+                    # Check that there are further pages to request
+                    if curr_res_data['has_next'] is False or has_enough:  # No further pages to request
+                        return Response(data=total_res_data[:limit],  # Return the total array with data
+                                        status=curr_res.status_code,  # Copy the last results status code
+                                        )
+                    else:  # There are more pages in the request, loop again
+                        retries = 0  # Reset number of retries
+                        curr_page += 1  # Increment the current page
+
+                except (requests.exceptions.Timeout,  # If request timed out or no connection was made, try again
+                        requests.exceptions.ConnectionError):
+                    # TODO: Maybe move ConnectionError to its own except block?
+                    retries += 1  # Increment number of retries
+
+            # Log response and request
+            elapsed_time = DateTime.now() - start_time
+            log_congressus_request_response(res_status=status.HTTP_408_REQUEST_TIMEOUT, elapsed_time=elapsed_time,
+                                            method=method, url=self._congressus_url_base + url_endpoint, params=params,
+                                            payload=payload)
+
+            # If the while loop is exited, at some point there were too many timeouts and an error should be returned
+            return Response(data={"error": "Request timeout"}, status=status.HTTP_408_REQUEST_TIMEOUT)
+        finally:
+            self._admission.release(priority=priority)
+
+    def _congressus_api_pages(self, url_endpoint: str, page_size: int, query_params: dict = None, start_page: int = 1,
+                              priority: Priority = Priority.BACKGROUND) -> Iterator[Tuple[int, Response]]:
+        """
+        Get the pages of a paginated GET from the Congressus API one at a time, so the caller can stop as soon as it has
+        enough data. Every page is a separate call with its own timeout and retries, see _congressus_api_call_single.
 
-            # Attempt making the request, taking into account the timeout limit and max number of retries
-            try:  # Try to make the request and catch in case of a timeout
-                curr_res = requests.request(method=method,
-                                            url=self._congressus_url_base + url_endpoint,
-                                            headers=self._congressus_headers,
-                                            params=params,
-                                            json=payload,
-                                            timeout=timeout)
-                curr_res_data = curr_res.json()  # Convert data to a python dict
+        :param url_endpoint: URL endpoint to call. Example: '/sale-invoices'
+        :param page_size: Page size of the calls.
+        :param query_params: Optional additional parameters to add as a query.
+        :param start_page: Page to start at.
+        :param priority: Priority class used by the shared rate limiter, defaults to Priority.BACKGROUND.
+        :return: Iterator of page numbers and their Responses. Stops after the last page or after a failed call.
+        """
+        params = dict(query_params or {})
+        params['page_size'] = page_size
+        curr_page = start_page
+        while True:
+            params['page'] = curr_page
+            res = self._congressus_api_call_single(method='get', url_endpoint=url_endpoint, query_params=params,
+                                                   priority=priority)
+            yield curr_page, res
+            if not status.is_success(res.status_code) or not res.data.get('has_next'):
+                return
+            curr_page += 1
+
+    def _get_sales_page(self, params: dict, limit: Optional[int], page_cursor: Optional[PageCursor],
+                        sales_filter_hash: str) -> Response:
+        """
+        Get a single page of sales. Only the Congressus pages needed for the page are fetched, so the first page of
+        sales costs a single call to Congressus.
+
+        :param params: Query parameters of the calls to /sale-invoices.
+        :param limit: Max number of sales in the page, defaults to SALES_PAGE_LIMIT.
+        :param page_cursor: Cursor of the first sale of the page, or None for the first page.
+        :param sales_filter_hash: Hash of the filters of the sales, stored in the cursor to the next page.
+        :return: A Response object with the sales in 'data' and the cursor to the next page in 'next_cursor', which
+            is None if there are no more sales.
+        """
+        limit = min(limit or self.SALES_PAGE_LIMIT, self.SALES_PAGE_MAX_LIMIT)
+        if page_cursor is None:
+            page_cursor = PageCursor(page=1, offset=0, page_size=self.SALES_UPSTREAM_PAGE_SIZE,
+                                     filter_hash=sales_filter_hash)
+
+        raw_sales = []
+        next_cursor = None
+        offset = page_cursor.offset
+        for curr_page, res in self._congressus_api_pages(url_endpoint='/sale-invoices',
+                                                         page_size=page_cursor.page_size, query_params=params,
+                                                         start_page=page_cursor.page):
+            if not status.is_success(res.status_code):
+                if not raw_sales:  # Nothing to show
+                    return res  # Return result with failure information
+                next_cursor = page_cursor._replace(page=curr_page, offset=0)  # Continue at the failed page
+                break
+
+            page_sales = res.data['data']
+            taken_sales = page_sales[offset:offset + limit - len(raw_sales)]
+            raw_sales += taken_sales
+            if len(raw_sales) >= limit:  # The page is full, so stop fetching
+                next_offset = offset + len(taken_sales)
+                if next_offset < len(page_sales):  # The next sale is in the same Congressus page
+                    next_cursor = page_cursor._replace(page=curr_page, offset=next_offset)
+                elif res.data.get('has_next'):
+                    next_cursor = page_cursor._replace(page=curr_page + 1, offset=0)
+                break
+            offset = 0  # Later Congressus pages are read from the start
+
+        with timing.measure('strip'):
+            stripped_sales_array = [self._strip_sales_data(raw_sales_data=sale) for sale in raw_sales]
+        self._observe_sales(stripped_sales=stripped_sales_array)
+        return Response(data={'data': stripped_sales_array,
+                              'next_cursor': encode_cursor(next_cursor) if next_cursor else None},
+                        status=status.HTTP_200_OK)
+
+    def _get_products_in_folder(self, folder_id: int) -> Response:
+        """
+        Get the stripped products in a folder from the shared cache or Congressus, and update the product search index
+        with them.
 
-                # Log response and request
-                log_congressus_request_response(res_status=curr_res.status_code, elapsed_time=curr_res.elapsed,
-                                                method=method, url=self._congressus_url_base + url_endpoint,
-                                                params=params, payload=payload)
+        :param folder_id: ID of the folder.
+        :return: A Response object.
+        """
+        def get_stripped_products() -> Response:
+            res = self._congressus_api_call_pagination(method='get',
+                                                       url_endpoint='/products',
+                                                       query_params={'folder_id': folder_id})  # Add the folder_id
+            if status.is_success(res.status_code):  # Request is ok
+                stripped_products_array = []  # Empty array of stripped products
+                with timing.measure('strip'):
+                    for product in res.data:  # Iterate all products in the response
+                        stripped_products_array.append(
+                            self._strip_product_data(raw_product_data=product))  # Strip product data
+                return Response(data=stripped_products_array, status=res.status_code)  # Return response
+            else:  # Response status indicated a failure
+                return res  # Return result with failure information
+
+        res = self._cached_call(cache_key=f'products_in_folder:{folder_id}', ttl=self.CATALOG_CACHE_TTL,
+                                call=get_stripped_products)
+        if status.is_success(res.status_code):  # Only products which changed are indexed again
+            self._product_index.update_folder(folder_id=folder_id, products=res.data)
+            self._snapshotter.mark_changed()
+        return res
 
-                # Check if there is an error in the response and return that error response
-                if not status.is_success(curr_res.status_code):
-                    # Return the response from the API server converted to a rest_framework.Response object
-                    return Response(data=curr_res_data,  # Return the error response data
-                                    status=curr_res.status_code,  # Copy the status code
-                                    )
-                # Check that the response actually has pagination, indicated by having a field 'data'
-                if 'data' not in curr_res_data:  # There is no pagination, return the current response
-                    # Return the response from the API server converted to a rest_framework.Response object
-                    return Response(data=curr_res_data,  # Return the current response data
-                                    status=curr_res.status_code,  # Copy the status code
-                                    )
-                # The result has pagination, add the result contents to the running total
-                total_res_data += curr_res_data['data']  # Get the data array and add to running total
+    def _start_prefetch(self, member_id: int, prefetch: list[str]) -> None:
+        """
+        Start fetching data of a member in the background, which the kiosk is likely to request next. Nothing is
+        prefetched when the max number of prefetches is already in flight, so prefetching never adds to a queue of calls
+        to Congressus.
 
-                # Check that there are further pages to request
-                if curr_res_data['has_next'] is False:  # No further pages to request
-                    return Response(data=total_res_data,  # Return the total array with data
-                                    status=curr_res.status_code,  # Copy the last results status code
-                                    )
-                else:  # There are more pages in the request, loop again
-                    retries = 0  # Reset number of retries
-                    curr_page += 1  # Increment the current page
-
-            except (requests.exceptions.Timeout,
-                    requests.exceptions.ConnectionError):  # If request timed out or no connection was made, try again
-                # TODO: Maybe move ConnectionError to its own except block?
-                retries += 1  # Increment number of retries
-
-        # Log response and request
-        elapsed_time = DateTime.now() - start_time
-        log_congressus_request_response(res_status=status.HTTP_408_REQUEST_TIMEOUT, elapsed_time=elapsed_time,
-                                        method=method, url=self._congressus_url_base + url_endpoint, params=params,
-                                        payload=payload)
-
-        # If the while loop is exited, at some point there were too many timeouts and an error should be returned
-        return Response(data={"error": "Request timeout"}, status=status.HTTP_408_REQUEST_TIMEOUT)
+        :param member_id: Congressus ID of the member.
+        :param prefetch: Data to prefetch, see PREFETCH_OPTIONS.
+        """
+        if not self._prefetch_slots.acquire(blocking=False):  # Enough prefetches in flight, skip this one
+            return
+        try:
+            self._prefetch_executor.submit(self._prefetch, member_id, prefetch,
+                                           getattr(threading_local, 'request_id', None))
+        except RuntimeError:  # Executor is shut down
+            self._prefetch_slots.release()
+
+    def _prefetch(self, member_id: int, prefetch: list[str], request_id: Optional[str]) -> None:
+        """
+        Fetch data of a member and keep it in the shared cache for a short time, so any worker can use it. The original
+        request is not used, its query parameters do not apply to the prefetched data.
+
+        :param member_id: Congressus ID of the member.
+        :param prefetch: Data to prefetch, see PREFETCH_OPTIONS.
+        :param request_id: ID of the original request, the prefetch is logged as part of it.
+        """
+        threading_local.request_id = request_id
+        threading_local.depth = 1  # Decorated functions called by the prefetch do not start a new request
+        try:
+            loaders = {'sales': (f'prefetched_recent_purchases:{member_id}', self._get_recent_purchases),
+                       'favourites': (f'prefetched_favourite_products:{member_id}', self._get_favourite_products)}
+            for option in prefetch:
+                cache_key, load = loaders[option]
+                fetched_time = time.time()  # Data is outdated by sales posted after this time
+                res = load(req=None, member_id=member_id)
+                if status.is_success(res.status_code):
+                    self._cache.set(cache_key, value={'data': res.data, 'fetched': fetched_time},
+                                    ttl=self.PREFETCH_CACHE_TTL)
+        finally:
+            threading_local.depth = 0
+            connections.close_all()  # Prefetch threads do not close their database connections by themselves
+            self._prefetch_slots.release()
+
+    def _get_prefetched(self, cache_key: str, changed: Optional[float]) -> Optional[list[dict]]:
+        """
+        Get prefetched data of a member from the shared cache.
+
+        :param cache_key: Cache key of the prefetched data.
+        :param changed: Optional time at which the member last bought something.
+        :return: The prefetched data, or None if nothing was prefetched or the member bought something since.
+        """
+        prefetched = self._cache.get(cache_key)
+        if prefetched is None or (changed is not None and prefetched['fetched'] < changed):
+            return None
+        return prefetched['data']
+
+    def _product_index_is_empty(self) -> bool:
+        """Returns whether there are Streeplijst folders, but none of them are in the product search index yet."""
+        folder_ids = [folder['id'] for folder in self.tenant.folder_configuration]
+        return bool(folder_ids) and all(self._product_index.folder_age(folder_id) is None for folder_id in folder_ids)
+
+    def _catalog_invalidated_time(self) -> Optional[float]:
+        """
+        Returns when products were last changed according to a webhook received by any worker, or None if not
+        recently. It is read from the shared cache at most every CATALOG_INVALIDATION_CHECK_INTERVAL seconds, since it
+        is needed on every search.
+        """
+        checked_at, invalidated_time = self._catalog_invalidated_check
+        now = time.monotonic()
+        if now - checked_at >= self.CATALOG_INVALIDATION_CHECK_INTERVAL:
+            invalidated_time = self._cache.get('catalog_invalidated')
+            self._catalog_invalidated_check = (now, invalidated_time)
+        return invalidated_time
+
+    def _start_product_index_refresh(self) -> None:
+        """Refresh the product search index in the background, unless a refresh is already running."""
+        if self._product_index_refresh_lock.acquire(blocking=False):
+            self._background_executor.submit(self._refresh_product_index, self._product_index_refresh_lock)
+
+    def _refresh_product_index(self, lock: threading.Lock = None) -> None:
+        """
+        Update the product search index with the products in all Streeplijst folders.
+
+        :param lock: Optional lock to release when the refresh is done.
+        """
+        try:
+            for folder in self.tenant.folder_configuration:
+                self._get_products_in_folder(folder_id=folder['id'])
+        finally:
+            if lock is not None:
+                lock.release()
+
+    def _observe_sales(self, stripped_sales: list[dict]) -> None:
+        """
+        Update all local data which is kept up to date from the sales seen in responses from Congressus.
+
+        :param stripped_sales: Stripped sales data, as returned by '_strip_sales_data'.
+        """
+        # Products of a sale are only counted the first time it is seen
+        for sale in aggregates.record_sales(tenant=self.tenant.name, sales=stripped_sales):
+            self._favourite_products.add_sale(sale)
+        self._recent_purchases.record(sales=stripped_sales)
+        self._snapshotter.mark_changed()
+
+    def _sync_sales_aggregates(self, member_id: int):
+        """
+        Fetch the sales of a member which are not yet included in their sales aggregates. The first synchronization
+        fetches the default period of 'get_sales', after that only sales since the last synchronization are fetched.
+        Invoices which were paid in the meantime are reported by the sale invoice webhooks, after which the sales since
+        the oldest unpaid invoice of the member are fetched as well.
+
+        :param member_id: Congressus ID of the member.
+        :return: None if the aggregates are up to date, otherwise the failed Response from Congressus.
+        """
+        now = timezone.now()
+        sync = aggregates.get_sync(tenant=self.tenant.name, member_id=member_id)
+        sales_changed = sync is not None and sync.sales_changed_at is not None
+        if sync is not None and not sales_changed and now - sync.synced_at < self.AGGREGATES_SYNC_INTERVAL:
+            return None  # Recently synchronized and nothing changed since
+
+        period_filter = None  # The first synchronization fetches the default period of get_sales
+        if sync is not None:  # Only fetch sales since the day before the last synchronization to account for time zones
+            since = sync.synced_at.date() - datetime.timedelta(days=1)
+            if sales_changed:  # Invoices which were paid since they were recorded may be older than that
+                unpaid_period = aggregates.get_oldest_unpaid_period(tenant=self.tenant.name, member_id=member_id)
+                if unpaid_period is not None:
+                    since = min(since, datetime.date.fromisoformat(f'{unpaid_period}-01'))
+            period_filter = since.strftime("%Y-%m-%d")
+
+        # Sales fetched by get_sales are recorded in the aggregates automatically. The filters of the original request
+        # are not passed on, since they are meant for the local endpoint and not for the sales of the aggregates.
+        res = self.get_sales(req=None, member_ids=[member_id], period_filter=period_filter)
+        if not status.is_success(res.status_code):  # Response status indicated a failure
+            return res
+        aggregates.mark_synced(tenant=self.tenant.name, member_id=member_id, synced_at=now)
+        return None
+
+    def _congressus_timeout(self, method: str, url_endpoint: str) -> float:
+        """
+        Get the timeout for a call to Congressus. GETs use a timeout based on the recent latency of the endpoint, so a
+        stuck call is retried sooner. Other methods always use self.CONGRESSUS_TIMEOUT, since retrying a POST which was
+        still being processed could create it twice.
+
+        :param method: HTTP method.
+        :param url_endpoint: URL endpoint to call.
+        :return: Timeout in seconds.
+        """
+        if method.lower() != 'get':
+            return self.CONGRESSUS_TIMEOUT
+
+        latency = self._latency_tracker.percentile(endpoint_key(method, url_endpoint), self.TIMEOUT_LATENCY_PERCENTILE)
+        if latency is None:  # Not enough calls to this endpoint yet
+            return self.CONGRESSUS_TIMEOUT
+        return min(self.CONGRESSUS_TIMEOUT, max(self.CONGRESSUS_MIN_TIMEOUT, latency * self.TIMEOUT_LATENCY_FACTOR))
+
+    def _attempt_timeout(self, method: str, timeout: float) -> Optional[float]:
+        """
+        Get the timeout of a single attempt of a call to Congressus. GETs may take at most the time left before the
+        deadline of the local request. Other methods always get the full timeout, since a POST which is cut off may
+        still be processed by Congressus. The time left shrinks while waiting for the rate limiter, so the timeout is
+        computed again right before the request is sent.
+
+        :param method: HTTP method.
+        :param timeout: Timeout of the call in seconds.
+        :return: Timeout in seconds, or None if the deadline of the local request has passed.
+        """
+        if method.lower() != 'get':
+            return timeout
+        return deadline.clamp(timeout)
+
+    def _congressus_request(self, method: str, url_endpoint: str, params: dict, payload: dict,
+                            timeout: float) -> requests.Response:
+        """
+        Make a single request to Congressus, see '_hedged_congressus_request'. The duration and size of the response
+        are added to the timing of the current request.
+        """
+        request_timing = timing.current()
+        if request_timing is None:
+            return self._hedged_congressus_request(method=method, url_endpoint=url_endpoint, params=params,
+                                                   payload=payload, timeout=timeout)
+
+        start_time = time.perf_counter()
+        size = 0
+        try:
+            res = self._hedged_congressus_request(method=method, url_endpoint=url_endpoint, params=params,
+                                                  payload=payload, timeout=timeout)
+            size = len(res.content)
+            return res
+        finally:  # Calls which failed are included with the time spent
+            request_timing.add_call(endpoint=endpoint_key(method, url_endpoint), page=(params or {}).get('page'),
+                                    seconds=time.perf_counter() - start_time, size=size)
+
+    def _hedged_congressus_request(self, method: str, url_endpoint: str, params: dict, payload: dict,
+                                   timeout: float) -> requests.Response:
+        """
+        Make a single request to Congressus and record its latency.
+
+        A GET which takes longer than the usual latency of its endpoint is hedged: the same request is sent again and
+        whichever response arrives first is used. Hedged requests are only sent while the shared rate limiter has room
+        for background calls, so they cannot crowd out other calls. A GET is only sent from the hedge threads when one
+        is free, otherwise it is sent from the calling thread without hedging. Waiting for the responses never takes
+        longer than the timeout or the deadline of the local request.
+
+        :param method: HTTP method.
+        :param url_endpoint: URL endpoint to call.
+        :param params: Optional query parameters.
+        :param payload: Optional data to send with a POST request.
+        :param timeout: Timeout in seconds.
+        :return: The response from Congressus.
+        :raises requests.exceptions.Timeout: If no response was received in time.
+        :raises requests.exceptions.ConnectionError: If no connection could be made.
+        """
+        endpoint = endpoint_key(method, url_endpoint)
+        params = None if params is None else dict(params)  # Hedged requests may outlive changes by the caller
+
+        def send() -> requests.Response:
+            start_time = time.monotonic()
+            try:
+                return self._session.request(method=method,
+                                             url=self._congressus_url_base + url_endpoint,
+                                             headers=self._congressus_headers,
+                                             params=params,
+                                             json=payload,
+                                             timeout=timeout)
+            finally:  # Timed out calls are recorded with the time spent, so the estimate grows when calls hang
+                self._latency_tracker.record(endpoint, time.monotonic() - start_time)
+                self._snapshotter.mark_changed()
+
+        hedge_delay = None
+        if method.lower() == 'get':
+            hedge_delay = self._latency_tracker.percentile(endpoint, self.HEDGE_LATENCY_PERCENTILE)
+        if hedge_delay is None or hedge_delay >= timeout:  # Request may not be hedged
+            return send()
+        first = self._submit_hedged(send)
+        if first is None:  # All hedge threads are busy
+            return send()
+
+        wait_until = time.monotonic() + (deadline.clamp(timeout) or 0)
+        done, _ = wait([first], timeout=hedge_delay)
+        second = None
+        if not done and self._rate_limiter.acquire(priority=Priority.BACKGROUND, max_wait=0):
+            second = self._submit_hedged(send)  # Not fast enough, send another request if there is room
+        pending = {first} if second is None else {first, second}
+
+        error = None
+        while pending:  # Use the first successful response, only raise an error if all requests failed
+            done, pending = wait(pending, timeout=max(0.0, wait_until - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:  # Requests are still running, they finish in the background
+                raise requests.exceptions.Timeout(f"No response from {endpoint} within {timeout:.2f}s")
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _submit_hedged(self, send: Callable[[], requests.Response]) -> Optional[Future]:
+        """
+        Send a request from a hedge thread.
+
+        :param send: Function which sends the request.
+        :return: Future of the response, or None if all hedge threads are busy.
+        """
+        if not self._hedge_slots.acquire(blocking=False):
+            return None
+        try:
+            future = self._hedge_executor.submit(send)
+        except RuntimeError:  # Executor is shut down
+            self._hedge_slots.release()
+            return None
+        future.add_done_callback(lambda _: self._hedge_slots.release())
+        return future
+
+    def _cached_call(self, cache_key: str, ttl: float, call: Callable[[], Response]) -> Response:
+        """
+        Get the data of a successful response from the shared cache, or make the call and cache its data if it was
+        successful. Failed responses are never cached.
+
+        When the call fails because Congressus is unavailable, overloaded or timed out, expired data which is still in
+        the cache is returned instead, with a Warning header to mark it as stale.
+
+        :param cache_key: Key of the data in the shared cache.
+        :param ttl: Time to live of the cached data in seconds.
+        :param call: Function which makes the call(s) to Congressus and returns the (stripped) response.
+        :return: A Response object.
+        """
+        failed_res = None  # Failed response of the call, if the call was made and failed
+
+        def fill() -> Tuple[object, bool]:
+            nonlocal failed_res
+            res = call()
+            if status.is_success(res.status_code):  # Only store successful responses
+                return res.data, True
+            failed_res = res
+            return None, False
+
+        # Do not wait for another process longer than the deadline of the local request allows
+        fill_timeout = deadline.clamp(self.CONGRESSUS_TIMEOUT) or 0
+        data = self._cache.get_or_fill(key=cache_key, ttl=ttl, fill=fill, fill_timeout=fill_timeout)
+        if failed_res is not None:  # The call was made by this process and failed
+            return self._stale_response(cache_key=cache_key, failed_res=failed_res)
+        return Response(data=data, status=status.HTTP_200_OK)
+
+    def _stale_response(self, cache_key: str, failed_res: Response) -> Response:
+        """
+        Get the expired data of a failed call from the cache, if the call failed because Congressus is unavailable,
+        overloaded or timed out. Other failures, like a member which does not exist, are returned as they are.
+
+        :param cache_key: Key of the data in the shared cache.
+        :param failed_res: Response of the failed call.
+        :return: A Response object with the stale data, or the failed response if no stale data is available.
+        """
+        if not (status.is_server_error(failed_res.status_code)
+                or failed_res.status_code == status.HTTP_408_REQUEST_TIMEOUT):
+            return failed_res
+        entry = self._cache.get_entry(cache_key, allow_stale=True)
+        if entry is None:
+            return failed_res
+        return Response(data=entry.value, status=status.HTTP_200_OK, headers={'Warning': '110 - "Response is Stale"'})
+
+    def _rate_limited_response(self, method: str, url_endpoint: str, params: dict = None,
+                               payload: dict = None) -> UnsentResponse:
+        """
+        Log and create the response for a call to Congressus which was not made because the shared rate limit was
+        reached.
+
+        :param method: HTTP method of the call which was not made.
+        :param url_endpoint: URL endpoint of the call which was not made.
+        :param params: Optional query parameters of the call which was not made.
+        :param payload: Optional request body of the call which was not made.
+        :return: An UnsentResponse object with error code HTTP_503_SERVICE_UNAVAILABLE.
+        """
+        log_congressus_request_response(res_status=status.HTTP_503_SERVICE_UNAVAILABLE, method=method,
+                                        url=self._congressus_url_base + url_endpoint, params=params, payload=payload)
+        retry_after = max(1, round(1 / self.CONGRESSUS_RATE_LIMIT))  # Seconds before a new token is available
+        return UnsentResponse(data={"error": "Rate limit exceeded"}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                              headers={'Retry-After': str(retry_after)})
+
+    def _overloaded_response(self, method: str, url_endpoint: str, params: dict = None,
+                             payload: dict = None) -> UnsentResponse:
+        """
+        Log and create the response for a call to Congressus which was not made because too many calls of its priority
+        class were already in flight, see ADMISSION_LIMITS.
+
+        :param method: HTTP method of the call which was not made.
+        :param url_endpoint: URL endpoint of the call which was not made.
+        :param params: Optional query parameters of the call which was not made.
+        :param payload: Optional request body of the call which was not made.
+        :return: An UnsentResponse object with error code HTTP_503_SERVICE_UNAVAILABLE.
+        """
+        log_congressus_request_response(res_status=status.HTTP_503_SERVICE_UNAVAILABLE, method=method,
+                                        url=self._congressus_url_base + url_endpoint, params=params, payload=payload)
+        return UnsentResponse(data={"error": "Congressus is overloaded"}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                              headers={'Retry-After': str(self.ADMISSION_RETRY_AFTER)})
 
     def _member_username_to_id(self, username: str) -> Tuple[int, Response]:
-        # Make API call with pagination as we have to perform a search
+        # The member ID belonging to a username never changes, so check if another request already looked it up
+        cache_key = f'member_id:{username.lower()}'
+        cached_member_id = self._cache.get(cache_key)
+        if cached_member_id is not None:
+            return cached_member_id, Response(data={'id': cached_member_id}, status=status.HTTP_200_OK)
+
+        # The member may have been found while their username was autocompleted
+        if len(username) >= self.MEMBER_AUTOCOMPLETE_MIN_LENGTH:
+            cached_members = self._cached_member_search(term=username.lower()) or []
+            cached_member = next((member for member in cached_members
+                                  if member['username'].lower() == username.lower()), None)
+            if cached_member:
+                self._cache.set(cache_key, value=cached_member['id'], ttl=self.MEMBER_ID_CACHE_TTL)
+                return cached_member['id'], Response(data={'id': cached_member['id']}, status=status.HTTP_200_OK)
+
+        def is_exact_match(member: dict) -> bool:
+            return member['username'].lower() == username.lower()
+
+        # Make API call with pagination as we have to perform a search, stop at the page with the exact match
         res = self._congressus_api_call_pagination(method='get',
                                                    url_endpoint='/members/search',
-                                                   query_params={'term': username})  # Add a search term
+                                                   query_params={'term': username},  # Add a search term
+                                                   priority=Priority.MEMBER,
+                                                   stop_predicate=is_exact_match)
         if status.is_success(res.status_code):  # Request is ok
             # /search likely returns more than one member, select only the member with the correct username. We convert
             # username to lowercase first to make sure the case does not matter
             # Source: https://stackoverflow.com/a/7079297
-            correct_member = next((member for member in res.data if member['username'].lower() == username.lower()),
-                                  None)
+            correct_member = next((member for member in res.data if is_exact_match(member)), None)
             if correct_member:  # An exact match for the username was found
+                self._cache.set(cache_key, value=correct_member['id'], ttl=self.MEMBER_ID_CACHE_TTL)
                 # A call to /search gives a simplified user overview, we need to request all user data and return that
                 return correct_member['id'], res
 
@@ -350,61 +1412,92 @@ class ApiV30(ApiBase):
                 error_data = {'message': f"No user found for {username}"}
                 return 0, Response(data=error_data, status=status.HTTP_404_NOT_FOUND)
 
-        # Response status indicated a failure
+        # Response status indicated a failure, an expired member ID is still correct since it never changes
+        stale_res = self._stale_response(cache_key=cache_key, failed_res=res)
+        if stale_res is not res:
+            return stale_res.data, Response(data={'id': stale_res.data}, status=status.HTTP_200_OK)
         return 0, res  # Return result with failure information
 
-    def _strip_member_data(self, raw_member_data: dict) -> dict:
+    def _search_members_by_username_prefix(self, term: str) -> Tuple[list[dict], Response]:
+        """
+        Get the members whose username starts with a search term. Results for a shorter term are narrowed down locally
+        when possible, so typing a username only searches Congressus when the results of the shorter term were
+        incomplete or have expired.
+
+        :param term: Lowercase search term.
+        :return: The stripped members (or None if the search failed) and the raw Response (None if it was cached).
+        """
+        cached_members = self._cached_member_search(term=term)
+        if cached_members is not None:
+            return cached_members, None
+
+        # Only request the first page, a longer term is needed if there are more matches
+        res = self._congressus_api_call_single(method='get',
+                                               url_endpoint='/members/search',
+                                               query_params={'term': term, 'page': 1,
+                                                             'page_size': self.MEMBER_AUTOCOMPLETE_PAGE_SIZE},
+                                               priority=Priority.MEMBER)
+        if not status.is_success(res.status_code):  # Response status indicated a failure
+            return None, res
+
+        # /search also matches names, only keep the members whose username starts with the term
+        with timing.measure('strip'):
+            members = [self._strip_member_search_data(raw_member_data=member) for member in res.data.get('data', [])
+                       if member['username'].lower().startswith(term)]
+        self._cache.set(f'member_search:{term}', ttl=self.MEMBER_SEARCH_CACHE_TTL,
+                        value={'members': members, 'truncated': bool(res.data.get('has_next'))})
+        return members, res
+
+    def _cached_member_search(self, term: str) -> Optional[list[dict]]:
+        """
+        Get the members whose username starts with a search term from the cached results of the term or a shorter
+        term. Results of a shorter term can only be used if they were complete.
+
+        :param term: Lowercase search term.
+        :return: List of stripped members, or None if no usable cached results exist.
+        """
+        for length in range(len(term), self.MEMBER_AUTOCOMPLETE_MIN_LENGTH - 1, -1):  # Try the longest term first
+            cached_search = self._cache.get(f'member_search:{term[:length]}')
+            if cached_search is None or (cached_search['truncated'] and length < len(term)):
+                continue
+            return [member for member in cached_search['members'] if member['username'].lower().startswith(term)]
+        return None
+
+    def _strip_member_search_data(self, raw_member_data: dict) -> dict:
+        """
+        Strips data from a member search result to only include the details needed to recognize a member.
+
+        :param raw_member_data: Raw member from a Congressus search response.
+        :return: A stripped dict only including the ID, username and name of a member.
+        """
         keys_to_transfer = [
             'id',  # Internal congressus ID
             'username',  # Username (student number)
             'first_name',  # First name (or names, in case someone has multiple first names)
             'last_name',  # Last name (or names, in case someone has multiple last names)
-            'prefix',  # Name prefix (e.g. "Prof. dr.")
-            'suffix',  # Name suffix (e.g. "MSc.")
-            'date_of_birth',  # Date of birth for 18+ checking
-            'show_almanac',  # Whether this user wants to show their information on the website
-            'status',  # Current membership status TODO: Check if user has valid status
-            'bank_account'  # All banking information TODO: Remove this and only extract sdd mandate, if necessary
-        ]
-        stripped_data = extract_keys(raw_member_data, keys_to_transfer)
-        return stripped_data
-
-    def _strip_product_data(self, raw_product_data: dict) -> dict:
-        keys_to_transfer = [
-            'id',  # Internal congressus ID
-            'product_offer_id',  # ID for the product offer (variant)
-            'name',  # Product name
-            'description',  # Product description
-            'published',  # Whether this product is published
-            'price',  # Price of product in euros
-            'media',  # Media object
         ]
-        stripped_data = extract_keys(from_dict=raw_product_data, keys=keys_to_transfer, default=None)
+        return extract_keys(from_dict=raw_member_data, keys=keys_to_transfer, default=None)
 
-        # media is an array of nested dicts, strip them to only leave the url to the image file
-        if stripped_data['media']:  # If the media is not an empty array
-            stripped_data['media'] = stripped_data['media'][0]['url']  # Get a URL to the image for this product
-        else:  # If the media is an empty array, set it to None (because this will serialize to null in javascript)
-            stripped_data['media'] = None
+    def _strip_member_data(self, raw_member_data: dict) -> dict:
+        """
+        Strips data from a member API response to only include data that is relevant and not unnecessary personal
+        details. See 'MemberRecord' for the details which are kept.
+        """
+        return MemberRecord.strip(raw_member_data)
 
-        return stripped_data
+    def _strip_product_data(self, raw_product_data: dict) -> dict:
+        """
+        Strips data from a product API response, replacing the array of media objects with the URL of the first image.
+        See 'ProductRecord' for the details which are kept.
+        """
+        return ProductRecord.strip(raw_product_data)
 
     def _strip_sales_data(self, raw_sales_data: dict) -> dict:
-        keys_to_transfer = [
-            'id',  # ID of this invoice
-            'member_id',  # Member ID this invoice is related to
-            'items',  # Array of items in this invoice
-            'price_paid',  # Paid amount in euros
-            'price_unpaid',  # Unpaid amount in euros
-            'invoice_date',  # Date on which invoice was issued to the user
-            'invoice_source',  # Invoice source, usually "api"
-            'invoice_status',  # Invoice status
-            'invoice_type',  # Invoice type, usually "webshop"
-            'created',  # Datetime on which invoice was created
-            'modified',  # Datetime on which invoice was modified
-        ]
-        stripped_data = extract_keys(from_dict=raw_sales_data, keys=keys_to_transfer, default=None)
-        return stripped_data
+        """
+        Strips data from a sale invoice API response, including each of its items. See 'SaleInvoiceRecord' and
+        'SaleItemRecord' for the details which are kept.
+        """
+        return SaleInvoiceRecord.strip(raw_sales_data)
 
 
 @deprecated(reason="Congressus API v20 is not supported from July 17th, 2022.")
@@ -452,7 +1545,7 @@ class ApiV20(ApiBase):
         else:  # Response status indicated a failure
             return res
 
-    def get_member_by_username(self, req: Request, username: str) -> Response:
+    def get_member_by_username(self, req: Request, username: str, prefetch: list[str] = None) -> Response:
         res = self.list_members(req=req, extra_params={'username': username})
 
         if status.is_success(res.status_code):  # Request is ok
@@ -471,6 +1564,27 @@ class ApiV20(ApiBase):
         else:  # Response status indicated a failure
             return res
 
+    def handle_webhook(self, req: Request, changes: WebhookChanges) -> Response:
+        message_data = {
+            'message': f"This action is not supported in Congressus API {self.version}, "
+                       f"use local API {ApiV30.API_VERSION} instead."
+        }
+        return Response(data=message_data, status=status.HTTP_403_FORBIDDEN)
+
+    def get_members_by_usernames(self, req: Request, usernames: list[str]) -> Response:
+        message_data = {
+            'message': f"This action is not supported in Congressus API {self.version}, "
+                       f"use local API {ApiV30.API_VERSION} instead."
+        }
+        return Response(data=message_data, status=status.HTTP_403_FORBIDDEN)
+
+    def autocomplete_members(self, req: Request, term: str) -> Response:
+        message_data = {
+            'message': f"This action is not supported in Congressus API {self.version}, "
+                       f"use local API {ApiV30.API_VERSION} instead."
+        }
+        return Response(data=message_data, status=status.HTTP_403_FORBIDDEN)
+
     def list_products(self, req: Request, extra_params: dict = None) -> Response:
         params = dict()
         # Alter params according to the input parameters
@@ -501,9 +1615,16 @@ class ApiV20(ApiBase):
         # Return a set of products with the specified folder id
         return self.list_products(req=req, extra_params={'folder_id': folder_id})
 
+    def search_products(self, req: Request, query: str, limit: int = None) -> Response:
+        message_data = {
+            'message': f"This action is not supported in Congressus API {self.version}, "
+                       f"use local API {ApiV30.API_VERSION} instead."
+        }
+        return Response(data=message_data, status=status.HTTP_403_FORBIDDEN)
+
     def get_sales_by_username(self, req: Request, username: str, invoice_status: str = None, invoice_type: str = None,
                               period_filter: str = None, product_offer_id: list[str] = None,
-                              order: str = None) -> Response:
+                              order: str = None, limit: int = None, cursor: str = None) -> Response:
         # Getting sales using the API v20 is not supported (it gives unexpected results and queries don't work)
         message_data = {
             'message': f"This action is not supported in Congressus API {self.version}, "
@@ -527,10 +1648,34 @@ class ApiV20(ApiBase):
         # else:  # Status indicated a failure
         #     return res
 
+    def get_recent_purchases_by_username(self, req: Request, username: str) -> Response:
+        # Getting sales using the API v20 is not supported (it gives unexpected results and queries don't work)
+        message_data = {
+            'message': f"This action is not supported in Congressus API {self.version}, "
+                       f"use local API {ApiV30.API_VERSION} instead."
+        }
+        return Response(data=message_data, status=status.HTTP_403_FORBIDDEN)
+
+    def get_favourite_products_by_username(self, req: Request, username: str) -> Response:
+        # Getting sales using the API v20 is not supported (it gives unexpected results and queries don't work)
+        message_data = {
+            'message': f"This action is not supported in Congressus API {self.version}, "
+                       f"use local API {ApiV30.API_VERSION} instead."
+        }
+        return Response(data=message_data, status=status.HTTP_403_FORBIDDEN)
+
+    def get_sales_aggregates_by_username(self, req: Request, username: str) -> Response:
+        # Getting sales using the API v20 is not supported (it gives unexpected results and queries don't work)
+        message_data = {
+            'message': f"This action is not supported in Congressus API {self.version}, "
+                       f"use local API {ApiV30.API_VERSION} instead."
+        }
+        return Response(data=message_data, status=status.HTTP_403_FORBIDDEN)
+
     def get_sales(self, req: Request, usernames: list[str] = None, member_ids: list[int] = None,
                   invoice_status: str = None,
                   invoice_type: str = None, period_filter: str = None, product_offer_id: list[str] = None,
-                  order: str = None) -> Response:
+                  order: str = None, limit: int = None, cursor: str = None) -> Response:
         # Getting sales using the API v20 is not supported (it gives unexpected results and queries don't work)
         message_data = {
             'message': f"This action is not supported in Congressus API {self.version}, "
@@ -538,7 +1683,17 @@ class ApiV20(ApiBase):
         }
         return Response(data=message_data, status=status.HTTP_403_FORBIDDEN)
 
-    def post_sale(self, req: Request, member_id: int, items):
+    def post_sale(self, req: Request, member_id: int, items, idempotency_key: str = None):
+        """
+        Deprecated for v20, use v30 instead.
+        """
+        message_data = {
+            'message': f"It is not allowed to post sales in local API {self.version}, "
+                       f"use local API {ApiV30.API_VERSION} instead"
+        }
+        return Response(data=message_data, status=status.HTTP_403_FORBIDDEN)
+
+    def post_sales_bulk(self, req: Request, sales: list[dict[str, ...]]) -> Response:
         """
         Deprecated for v20, use v30 instead.
         """
@@ -1,18 +1,24 @@
 import abc  # Abstract Base Class package
+import os
 from typing import Tuple
 
 from rest_framework.request import Request
 from rest_framework.response import Response
 
+from streeplijst.congressus.webhooks import WebhookChanges
+
 
 class ApiBase:
     CONGRESSUS_MAX_RETRIES: int = 2  # Max number of retries for any call to Congressus API
     CONGRESSUS_TIMEOUT: int = 10  # Seconds before a request to Congressus API times out
+    CONGRESSUS_MIN_TIMEOUT: float = 2  # Lower limit in seconds of timeouts based on the latency of an endpoint
+    CONGRESSUS_RATE_LIMIT: float = 10  # Max number of calls per second to Congressus API, shared by all workers
+    CONGRESSUS_RATE_LIMIT_BURST: int = 20  # Max number of calls to Congressus API in a single burst
 
     @property
     def _congressus_url_base(self) -> str:
-        """Returns the base URL for making calls to Congressus API"""
-        return f"https://api.congressus.nl/{self.version}"
+        """Returns the base URL for making calls to Congressus API, which can be changed to test with a fake server"""
+        return f"{os.environ.get('CONGRESSUS_API_URL', 'https://api.congressus.nl')}/{self.version}"
 
     @property
     @abc.abstractmethod
@@ -51,11 +57,34 @@ class ApiBase:
         pass
 
     @abc.abstractmethod
-    def get_member_by_username(self, req: Request, username: str) -> Response:
+    def get_member_by_username(self, req: Request, username: str, prefetch: list[str] = None) -> Response:
         """
         Get a member by their username.
         :param req: Original request.
         :param username:
+        :param prefetch: Optional data of the member to fetch in the background once the member is found, so it is
+            ready when it is requested next: 'sales' (their most recent sales) and/or 'favourites'.
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_members_by_usernames(self, req: Request, usernames: list[str]) -> Response:
+        """
+        Get multiple members by their usernames at once. Members are looked up concurrently and the result of every
+        unique username is returned.
+
+        :param req: Original request.
+        :param usernames: List of usernames, duplicates are looked up once.
+        """
+        pass
+
+    @abc.abstractmethod
+    def autocomplete_members(self, req: Request, term: str) -> Response:
+        """
+        Get the members whose username starts with a search term, to autocomplete a username while it is typed.
+
+        :param req: Original request.
+        :param term: Start of a username.
         """
         pass
 
@@ -86,49 +115,124 @@ class ApiBase:
         :param folder_id:
         """
 
+    @abc.abstractmethod
+    def search_products(self, req: Request, query: str, limit: int = None) -> Response:
+        """
+        Search the products in all Streeplijst folders by name and description. Every word of the query may be
+        incomplete, so it can be used to search while typing.
+
+        :param req: Original request.
+        :param query: Search query.
+        :param limit: Optional max number of results.
+        """
+        pass
+
     @abc.abstractmethod
     def get_sales_by_username(self, req: Request, username: str, invoice_status: str = None, invoice_type: str = None,
                               period_filter: str = None, product_offer_id: list[str] = None,
-                              order: str = None) -> Response:
+                              order: str = None, limit: int = None, cursor: str = None) -> Response:
         """
-        Get sales for a specific user.
+        Get sales for a specific user, either all sales or a single page of sales, see get_sales.
 
         :param username: Username to filter by user
         :param invoice_status: Filter by invoice status string
         :param invoice_type: Filter by invoice type, defaults to "webshop"
         :param product_offer_id: Filter by product based on product_offer_id
         :param period_filter: Filter by period, defaults to 1 year back
-        :param order: Optional order string
+        :param order: Optional order string, defaults to newest first for a page of sales
+        :param limit: Optional max number of sales in a page of sales
+        :param cursor: Optional cursor to the next page of sales, returned with the previous page
         :param req: Original request (not used currently)
         """
         pass
 
+    @abc.abstractmethod
+    def get_recent_purchases_by_username(self, req: Request, username: str) -> Response:
+        """
+        Get the most recent sales of a specific user. The most recent sales are kept in memory, so they are only fetched
+        from Congressus when the user is not known yet.
+
+        :param req: Original request.
+        :param username: Username to filter by user
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_favourite_products_by_username(self, req: Request, username: str) -> Response:
+        """
+        Get the products a specific user bought most often. The counts are kept in memory and updated with every new
+        sale, so they are only read from the sales aggregates when the user is not known yet.
+
+        :param req: Original request.
+        :param username: Username to filter by user
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_sales_aggregates_by_username(self, req: Request, username: str) -> Response:
+        """
+        Get the total spending of a specific user per month and the number of times they bought each product. The totals
+        are kept up to date locally, so only new sales are fetched from Congressus.
+
+        :param req: Original request.
+        :param username: Username to filter by user
+        """
+        pass
+
     @abc.abstractmethod
     def get_sales(self, req: Request, usernames: list[str] = None, member_ids: list[int] = None,
                   invoice_status: str = None,
                   invoice_type: str = None, period_filter: str = None, product_offer_id: list[str] = None,
-                  order: str = None) -> Response:
+                  order: str = None, limit: int = None, cursor: str = None) -> Response:
         """
         Get sales with some parameters. If a user is searched by username but is not found, sales will not be obtained
         for that user.
 
+        By default, all sales are returned as one list. When a limit or cursor is given, a single page of sales is
+        returned instead, as a dict with the sales in 'data' and a cursor to the next page in 'next_cursor'.
+
         :param usernames: List of usernames to filter by user
         :param member_ids: List of member IDs to filter by user
         :param invoice_status: Filter by invoice status string
         :param invoice_type: Filter by invoice type, defaults to "webshop"
         :param product_offer_id: Filter by product based on product_offer_id
         :param period_filter: Filter by period, defaults to 1 year back
-        :param order: Optional order string
+        :param order: Optional order string, defaults to newest first for a page of sales
+        :param limit: Optional max number of sales in a page of sales
+        :param cursor: Optional cursor to the next page of sales, returned with the previous page
         :param req: Original request (not used currently)
         """
         pass
 
     @abc.abstractmethod
-    def post_sale(self, member_id: int, items, req: Request):
+    def post_sale(self, member_id: int, items, req: Request, idempotency_key: str = None):
         """
         :param req: Original request.
         :param member_id:
         :param items:
+        :param idempotency_key: Optional key supplied by the client. A sale posted again with the same key returns the
+            result of the first sale instead of charging the member twice.
+        """
+        pass
+
+    @abc.abstractmethod
+    def post_sales_bulk(self, req: Request, sales: list[dict[str, ...]]) -> Response:
+        """
+        Post multiple sales at once, e.g. for a round of drinks. Sales are posted concurrently and the result of every
+        sale is returned.
+
+        :param req: Original request.
+        :param sales: List of sales, each containing a member_id, items and optionally an idempotency_key
+        """
+        pass
+
+    @abc.abstractmethod
+    def handle_webhook(self, req: Request, changes: WebhookChanges) -> Response:
+        """
+        Invalidate the cached data of products, product folders and members which changed in Congressus.
+
+        :param req: Original request.
+        :param changes: Changed objects, see webhooks.parse_changes.
         """
         pass
 
@@ -0,0 +1,287 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, NamedTuple, Optional, Tuple, Union
+
+cache_logger = logging.getLogger('api.congressus')  # Cache problems are logged together with Congressus calls
+
+
+class CacheEntry(NamedTuple):
+    """A single value stored in the shared cache."""
+    value: Any  # The cached value, converted back from JSON
+    version: int  # Version of the entry, incremented on every write. Used for compare and set.
+    expires: float  # Unix timestamp after which the entry is stale
+
+
+class SharedCache:
+    """
+    Cache which is shared between all worker processes on a host.
+
+    Entries are stored as JSON in a SQLite database in WAL mode, so readers in one process do not block writers in
+    another. Every entry has a time to live and a version which allows atomic compare and set. When the cache grows
+    beyond its maximum number of entries or bytes, stale entries are removed first, followed by the entries which
+    expire soonest.
+
+    Stale entries are kept until they are evicted so they can still be served when Congressus is unavailable.
+    """
+    BUSY_TIMEOUT: float = 5.0  # Seconds to wait for the database lock held by another process
+    EVICTION_INTERVAL: int = 32  # Number of writes between checks of the cache size
+    FILL_POLL_INTERVAL: float = 0.05  # Seconds between checks whether another process has filled an entry
+
+    def __init__(self, db_path: Union[str, Path], namespace: str, max_entries: int = 10000,
+                 max_bytes: int = 64 * 1024 * 1024):
+        """
+        :param db_path: Path to the SQLite database file which holds the cache.
+        :param namespace: Prefix for all keys, so multiple caches can share the same database file.
+        :param max_entries: Maximum number of entries in the whole database file.
+        :param max_bytes: Maximum size in bytes of all values in the whole database file.
+        """
+        self.db_path = Path(db_path)
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._local = threading.local()  # SQLite connections cannot be shared between threads
+        self._writes = 0  # Number of writes since the last eviction check in this process
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        """Returns a SQLite connection for the current thread, creating the database if needed."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            # isolation_level None allows us to control transactions ourselves with BEGIN IMMEDIATE
+            conn = sqlite3.connect(str(self.db_path), timeout=self.BUSY_TIMEOUT, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # A lost cache entry after a power failure is acceptable
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, version INTEGER, "
+                         "expires REAL, size INTEGER)")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)")
+            self._local.conn = conn
+        return conn
+
+    def _key(self, key: str) -> str:
+        """Returns the key as it is stored in the database."""
+        return f'{self.namespace}:{key}'
+
+    def get_entry(self, key: str, allow_stale: bool = False) -> Optional[CacheEntry]:
+        """
+        Get an entry from the cache.
+
+        :param key: Key of the entry.
+        :param allow_stale: Whether to return the entry if it is expired but not yet evicted.
+        :return: The entry, or None if it does not exist, is expired or the cache is unavailable.
+        """
+        try:
+            row = self._connection.execute("SELECT value, version, expires FROM cache WHERE key = ?",
+                                           (self._key(key),)).fetchone()
+        except sqlite3.Error as e:
+            cache_logger.warning(msg=f"Shared cache unavailable: {e}")
+            return None
+
+        if row is None:  # Entry does not exist
+            return None
+        entry = CacheEntry(value=json.loads(row[0]), version=row[1], expires=row[2])
+        if not allow_stale and entry.expires <= time.time():  # Entry is expired
+            return None
+        return entry
+
+    def get(self, key: str, default: Any = None, allow_stale: bool = False) -> Any:
+        """
+        Get a value from the cache.
+
+        :param key: Key of the entry.
+        :param default: Value to return if the entry does not exist or is expired.
+        :param allow_stale: Whether to return the value if it is expired but not yet evicted.
+        """
+        entry = self.get_entry(key, allow_stale=allow_stale)
+        return default if entry is None else entry.value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        """
+        Store a value in the cache, overwriting any existing value.
+
+        :param key: Key of the entry.
+        :param value: Value to store, must be serializable to JSON.
+        :param ttl: Time to live in seconds.
+        """
+        self._write(key=key, value=value, ttl=ttl, expected_version=None, overwrite=True)
+
+    def compare_and_set(self, key: str, value: Any, ttl: float, expected_version: Optional[int]) -> bool:
+        """
+        Atomically store a value in the cache, but only if the entry was not changed by anyone else.
+
+        :param key: Key of the entry.
+        :param value: Value to store, must be serializable to JSON.
+        :param ttl: Time to live in seconds.
+        :param expected_version: Version of the entry as read by the caller. Use None to only store the value if the
+            entry does not exist or is expired.
+        :return: True if the value was stored, False if the entry was changed in the meantime.
+        """
+        return self._write(key=key, value=value, ttl=ttl, expected_version=expected_version, overwrite=False)
+
+    def add(self, key: str, value: Any, ttl: float) -> bool:
+        """
+        Atomically store a value in the cache, but only if the entry does not exist or is expired.
+
+        :param key: Key of the entry.
+        :param value: Value to store, must be serializable to JSON.
+        :param ttl: Time to live in seconds.
+        :return: True if the value was stored, False if a valid entry already existed.
+        """
+        return self.compare_and_set(key=key, value=value, ttl=ttl, expected_version=None)
+
+    def delete(self, key: str) -> None:
+        """
+        Remove an entry from the cache.
+
+        :param key: Key of the entry.
+        """
+        try:
+            self._connection.execute("DELETE FROM cache WHERE key = ?", (self._key(key),))
+        except sqlite3.Error as e:
+            cache_logger.warning(msg=f"Shared cache unavailable: {e}")
+
+    def delete_prefix(self, prefix: str) -> int:
+        """
+        Remove all entries whose key starts with a prefix.
+
+        :param prefix: Prefix of the keys, must not be empty.
+        :return: Number of entries removed, 0 if the cache is unavailable.
+        """
+        # A range on the primary key uses its index, unlike LIKE, and needs no escaping of wildcards in the prefix
+        db_prefix = self._key(prefix)
+        db_prefix_end = db_prefix[:-1] + chr(ord(db_prefix[-1]) + 1)  # First key after all keys with the prefix
+        try:
+            cursor = self._connection.execute("DELETE FROM cache WHERE key >= ? AND key < ?",
+                                              (db_prefix, db_prefix_end))
+        except sqlite3.Error as e:
+            cache_logger.warning(msg=f"Shared cache unavailable: {e}")
+            return 0
+        return cursor.rowcount
+
+    def compare_and_delete(self, key: str, expected_value: Any) -> bool:
+        """
+        Atomically remove an entry from the cache, but only if it still has the expected value.
+
+        :param key: Key of the entry.
+        :param expected_value: Value the entry must have, must be serializable to JSON.
+        :return: True if the entry was removed, False if it has another value, does not exist or the cache is
+            unavailable.
+        """
+        value_json = json.dumps(expected_value, separators=(',', ':'))
+        try:
+            cursor = self._connection.execute("DELETE FROM cache WHERE key = ? AND value = ?",
+                                              (self._key(key), value_json))
+        except sqlite3.Error as e:
+            cache_logger.warning(msg=f"Shared cache unavailable: {e}")
+            return False
+        return cursor.rowcount > 0
+
+    def get_or_fill(self, key: str, ttl: float, fill: Callable[[], Tuple[Any, bool]], fill_timeout: float) -> Any:
+        """
+        Get a value from the cache, or compute and store it if it is missing. Only one process on the host computes a
+        missing value at a time, the others wait for that value to appear in the cache.
+
+        :param key: Key of the entry.
+        :param ttl: Time to live in seconds of a computed value.
+        :param fill: Function which computes the value. Returns the value and whether it may be stored.
+        :param fill_timeout: Maximum number of seconds to wait for another process to compute the value, after which
+            the value is computed anyway.
+        :return: The cached or computed value.
+        """
+        entry = self.get_entry(key)
+        if entry is not None:  # Cache hit
+            return entry.value
+
+        # The lock holds a token of its owner, so a process whose lock expired cannot release the lock of another
+        lock_key = f'{key}:filling'
+        lock_token = uuid.uuid4().hex
+        owns_lock = self.add(lock_key, value=lock_token, ttl=fill_timeout)
+        if not owns_lock:  # Another process is already computing this value
+            wait_until = time.monotonic() + fill_timeout
+            while time.monotonic() < wait_until:
+                time.sleep(self.FILL_POLL_INTERVAL)
+                entry = self.get_entry(key)
+                if entry is not None:  # The other process stored the value
+                    return entry.value
+
+        try:
+            value, store = fill()
+            if store:
+                self.set(key, value=value, ttl=ttl)
+            return value
+        finally:
+            if owns_lock:
+                self.compare_and_delete(lock_key, expected_value=lock_token)
+
+    def _write(self, key: str, value: Any, ttl: float, expected_version: Optional[int], overwrite: bool) -> bool:
+        """
+        Store a value in the cache in a single transaction.
+
+        :param key: Key of the entry.
+        :param value: Value to store, must be serializable to JSON.
+        :param ttl: Time to live in seconds.
+        :param expected_version: Version the existing entry must have, None if it must not exist or be expired.
+        :param overwrite: Whether to ignore expected_version and always store the value.
+        :return: True if the value was stored.
+        """
+        value_json = json.dumps(value, separators=(',', ':'))
+        db_key = self._key(key)
+        try:
+            conn = self._connection
+            conn.execute("BEGIN IMMEDIATE")  # Lock the database for writing so the check and write are atomic
+            try:
+                now = time.time()
+                row = conn.execute("SELECT version, expires FROM cache WHERE key = ?", (db_key,)).fetchone()
+                curr_version = 0 if row is None else row[0]
+                if not overwrite:
+                    if expected_version is None:  # The entry must not exist or be expired
+                        stored = row is None or row[1] <= now
+                    else:  # The entry must not have changed since it was read
+                        stored = row is not None and row[0] == expected_version
+                    if not stored:
+                        conn.execute("ROLLBACK")
+                        return False
+
+                conn.execute("INSERT OR REPLACE INTO cache (key, value, version, expires, size) VALUES (?, ?, ?, ?, ?)",
+                             (db_key, value_json, curr_version + 1, now + ttl, len(value_json)))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            cache_logger.warning(msg=f"Shared cache unavailable: {e}")
+            return False
+
+        self._writes += 1
+        if self._writes >= self.EVICTION_INTERVAL:
+            self._writes = 0
+            self._evict()
+        return True
+
+    def _evict(self) -> None:
+        """Remove entries until the cache is within its size limits, starting with the entries which expire first."""
+        try:
+            conn = self._connection
+            count, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+            if count <= self.max_entries and total_bytes <= self.max_bytes:
+                return
+
+            # Remove the entries which expire soonest, stale entries are always the first to go
+            excess_entries = max(0, count - self.max_entries)
+            excess_bytes = max(0, total_bytes - self.max_bytes)
+            removed_entries = removed_bytes = 0
+            to_remove = []
+            for key, size in conn.execute("SELECT key, size FROM cache ORDER BY expires"):
+                if removed_entries >= excess_entries and removed_bytes >= excess_bytes:
+                    break
+                to_remove.append((key,))
+                removed_entries += 1
+                removed_bytes += size
+            conn.executemany("DELETE FROM cache WHERE key = ?", to_remove)
+        except sqlite3.Error as e:
+            cache_logger.warning(msg=f"Shared cache eviction failed: {e}")
@@ -0,0 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, TypeVar
+
+from django.db import connections
+
+from streeplijst.congressus import deadline, profiling, timing
+from streeplijst.congressus.logging import threading_local
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+def run_concurrently(func: Callable[[T], R], items: Iterable[T], max_workers: int) -> list[R]:
+    """
+    Call a function for every item using a bounded number of threads, and return the results in the order of the
+    items.
+
+    The request ID of the calling thread is passed on to the worker threads, so their logs can be related to the
+    original request. If the original request is being profiled or timed, the worker threads are included. Calls made
+    by the worker threads share the deadline of the original request.
+
+    :param func: Function to call for every item.
+    :param items: Items to call the function with.
+    :param max_workers: Maximum number of threads to use at the same time.
+    :return: List of results, in the same order as the items.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    request_id = getattr(threading_local, 'request_id', None)
+    depth = getattr(threading_local, 'depth', 0)
+    profile = profiling.current_profile()
+    request_timing = timing.current()
+    request_deadline = deadline.current()
+
+    def run(item: T) -> R:
+        if request_id is not None:
+            threading_local.request_id = request_id
+        threading_local.depth = depth  # Decorated functions called by the worker do not start a new request
+        profiling.join_profile(profile)  # Worker threads are profiled together with the original request
+        timing.join(request_timing)  # Calls made by worker threads are part of the timing of the original request
+        deadline.join(request_deadline)
+        try:
+            return func(item)
+        finally:
+            profiling.leave_profile()
+            timing.stop()
+            deadline.stop()
+            threading_local.depth = 0
+            connections.close_all()  # Worker threads do not close their database connections by themselves
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(run, items))
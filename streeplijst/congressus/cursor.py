@@ -0,0 +1,53 @@
+import base64
+import binascii
+import hashlib
+import json
+from typing import Any, NamedTuple
+
+
+class PageCursor(NamedTuple):
+    """
+    Position in a paginated list of Congressus results, handed to the frontend as an opaque string to get the next
+    page of results.
+    """
+    page: int  # Congressus page which contains the next result
+    offset: int  # Index of the next result within that page
+    page_size: int  # Page size used for the Congressus calls, the page and offset are only valid for this page size
+    filter_hash: str  # Hash of the filters of the list, see 'filter_hash'
+
+
+def filter_hash(**filters: Any) -> str:
+    """
+    Returns a short hash of the filters of a list, so a cursor cannot be used with other filters than it was created
+    for (e.g. for the sales of another member).
+
+    :param filters: Filters of the list, must be JSON serializable.
+    """
+    filters_json = json.dumps(filters, sort_keys=True, default=str)
+    return hashlib.sha256(filters_json.encode()).hexdigest()[:16]
+
+
+def encode_cursor(cursor: PageCursor) -> str:
+    """Returns the opaque string of a cursor."""
+    return base64.urlsafe_b64encode(json.dumps(list(cursor)).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, expected_filter_hash: str) -> PageCursor:
+    """
+    Returns the cursor of an opaque string created by 'encode_cursor'.
+
+    :param cursor: Opaque string of the cursor.
+    :param expected_filter_hash: Hash of the filters of the list the cursor is used for.
+    :raises ValueError: If the cursor is invalid or was created for a list with other filters.
+    """
+    try:
+        padded_cursor = cursor + '=' * (-len(cursor) % 4)
+        page, offset, page_size, cursor_filter_hash = json.loads(base64.urlsafe_b64decode(padded_cursor))
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):  # JSON errors are ValueErrors
+        raise ValueError("Invalid cursor")
+    if not all(isinstance(value, int) for value in (page, offset, page_size)) or page < 1 or offset < 0 \
+            or page_size < 1:
+        raise ValueError("Invalid cursor")
+    if cursor_filter_hash != expected_filter_hash:
+        raise ValueError("Cursor does not belong to these filters")
+    return PageCursor(page=page, offset=offset, page_size=page_size, filter_hash=cursor_filter_hash)
@@ -0,0 +1,53 @@
+import threading
+import time
+from typing import Optional
+
+_deadline_local = threading.local()  # Deadline of the request handled by the current thread, if any
+
+
+def start(seconds: float) -> float:
+    """
+    Start a deadline for the request handled by the current thread.
+
+    :param seconds: Number of seconds the request may take.
+    :return: The deadline, as a time.monotonic() value.
+    """
+    deadline = time.monotonic() + seconds
+    _deadline_local.deadline = deadline
+    return deadline
+
+
+def current() -> Optional[float]:
+    """Returns the deadline of the request handled by the current thread, if it has one."""
+    return getattr(_deadline_local, 'deadline', None)
+
+
+def join(deadline: Optional[float]) -> None:
+    """Use the deadline of a request in the current thread, e.g. when it handles part of that request."""
+    _deadline_local.deadline = deadline
+
+
+def stop() -> None:
+    """Remove the deadline of the request handled by the current thread."""
+    _deadline_local.deadline = None
+
+
+def remaining() -> Optional[float]:
+    """Returns the number of seconds left before the deadline of the current request, or None if it has none."""
+    deadline = current()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def clamp(timeout: float) -> Optional[float]:
+    """
+    Shrink a timeout to the time left before the deadline of the current request.
+
+    :param timeout: Timeout in seconds.
+    :return: The shrunk timeout, or None if the deadline has passed.
+    """
+    seconds_left = remaining()
+    if seconds_left is None:
+        return timeout
+    if seconds_left <= 0:
+        return None
+    return min(timeout, seconds_left)
@@ -0,0 +1,160 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+
+class SpaceSavingCounter:
+    """
+    Approximate counts of the most frequent keys using a fixed number of counters (the space-saving algorithm).
+
+    Every key which is counted gets a counter. When all counters are in use, the key with the lowest count is replaced
+    and the new key takes over its count, so counts are never underestimated. Any key which makes up more than
+    1/capacity of the total count is guaranteed to have a counter.
+    """
+    __slots__ = ('capacity', '_counters')
+
+    def __init__(self, capacity: int):
+        """
+        :param capacity: Max number of counters.
+        """
+        self.capacity = capacity
+        self._counters: dict[Any, list] = dict()  # Count, overestimation and label of every counted key
+
+    def add(self, key: Any, amount: int = 1, label: Any = None) -> None:
+        """
+        Count a key.
+
+        :param key: Key to count.
+        :param amount: Amount to add to the count of the key.
+        :param label: Optional label of the key, e.g. its name, the most recent label is kept.
+        """
+        counter = self._counters.get(key)
+        if counter is not None:
+            counter[0] += amount
+            counter[2] = label
+            return
+        if len(self._counters) < self.capacity:
+            self._counters[key] = [amount, 0, label]
+            return
+        min_key = min(self._counters, key=lambda counted_key: self._counters[counted_key][0])
+        min_count = self._counters.pop(min_key)[0]
+        self._counters[key] = [min_count + amount, min_count, label]
+
+    def top(self, limit: int) -> list[Tuple[Any, int, int, Any]]:
+        """
+        Returns the most frequent keys, with their count, overestimation and label, most frequent first.
+
+        :param limit: Max number of keys to return.
+        """
+        return sorted(((key, count, error, label) for key, (count, error, label) in self._counters.items()),
+                      key=lambda item: item[1], reverse=True)[:limit]
+
+
+class _MemberProducts:
+    """Counted products of a single member."""
+    __slots__ = ('counter', 'seeded', 'updated')
+
+    def __init__(self, counter: SpaceSavingCounter):
+        self.counter = counter
+        self.seeded = time.time()  # Time at which the counter was seeded with the product counts of the member
+        self.updated = self.seeded  # Time at which a sale was last counted
+
+
+class FavouriteProducts:
+    """
+    In-memory top products of every member who bought something recently, with a space-saving counter per member.
+
+    The counter of a member is seeded with their exact product counts from the sales aggregates, and every new sale
+    of the member is added to it. Only the members who were used most recently are kept.
+    """
+
+    def __init__(self, max_members: int, capacity: int, max_age: float):
+        """
+        :param max_members: Max number of members to keep the top products of.
+        :param capacity: Number of products counted per member.
+        :param max_age: Seconds after which the counter of a member is seeded again, to include sales which were
+            counted by other workers.
+        """
+        self.max_members = max_members
+        self.capacity = capacity
+        self.max_age = max_age
+        self._members: OrderedDict[int, _MemberProducts] = OrderedDict()  # Least recently used member first
+        self._lock = threading.Lock()
+
+    def get(self, member_id: int, limit: int, changed: Optional[float] = None) -> Optional[list[dict[str, Any]]]:
+        """
+        Get the top products of a member.
+
+        :param member_id: ID of the member.
+        :param limit: Max number of products to return.
+        :param changed: Optional time at which the member last bought something, possibly in another worker.
+        :return: Product offer ID, name and (approximate) quantity of the top products, or None if the member is not
+            known here.
+        """
+        with self._lock:
+            member = self._members.get(member_id)
+            if member is None or time.time() - member.seeded > self.max_age:
+                return None
+            if changed is not None and member.updated < changed:  # A sale was posted by another worker
+                return None
+            self._members.move_to_end(member_id)
+            return [{'product_offer_id': product_offer_id, 'name': name, 'quantity': quantity}
+                    for product_offer_id, quantity, _, name in member.counter.top(limit)]
+
+    def fill(self, member_id: int, products: list[dict[str, Any]]) -> None:
+        """
+        Seed the counter of a member with their product counts.
+
+        :param member_id: ID of the member.
+        :param products: Product offer ID, name and quantity of the most bought products of the member, most bought
+            first.
+        """
+        counter = SpaceSavingCounter(capacity=self.capacity)
+        for product in products[:self.capacity]:
+            counter.add(product['product_offer_id'], amount=product['quantity'], label=product['name'])
+        with self._lock:
+            self._store(member_id, _MemberProducts(counter=counter))
+
+    def add_sale(self, sale: dict[str, Any]) -> None:
+        """
+        Count the products of a new sale, if the counter of its member is kept. A sale must only be added once.
+
+        :param sale: Stripped sale data, as returned by '_strip_sales_data'.
+        """
+        with self._lock:
+            member = self._members.get(sale.get('member_id'))
+            if member is None:  # The counter is seeded with this sale when the member is used
+                return
+            for item in sale.get('items') or []:
+                if item.get('product_offer_id') is not None:
+                    member.counter.add(item['product_offer_id'], amount=item.get('quantity') or 0,
+                                       label=item.get('name'))
+            member.updated = time.time()
+
+    def get_state(self) -> list[Tuple[int, SpaceSavingCounter, float, float]]:
+        """Returns the counter, seed time and update time of every member, least recently used member first."""
+        with self._lock:
+            return [(member_id, member.counter, member.seeded, member.updated)
+                    for member_id, member in self._members.items()]
+
+    def restore_state(self, state: list[Tuple[int, SpaceSavingCounter, float, float]], age: float) -> None:
+        """
+        Restore the counters from a state returned by 'get_state'.
+
+        :param state: State returned by 'get_state'.
+        :param age: Number of seconds since the state was created, unused since members keep their seed time.
+        """
+        with self._lock:
+            for member_id, counter, seeded, updated in state:
+                member = _MemberProducts(counter=counter)
+                member.seeded = seeded
+                member.updated = updated
+                self._store(member_id, member)
+
+    def _store(self, member_id: int, member: _MemberProducts) -> None:
+        """Store the counter of a member as most recently used, must be called while holding the lock."""
+        self._members[member_id] = member
+        self._members.move_to_end(member_id)
+        while len(self._members) > self.max_members:
+            self._members.popitem(last=False)
@@ -0,0 +1,163 @@
+import datetime
+import hashlib
+import json
+import uuid
+from typing import Any, NamedTuple, Optional
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from streeplijst.models import IdempotencyKey
+
+# Outcomes of starting a request with an idempotency key
+NEW = 'new'  # The key was not used before, the request should be handled
+CREATED = 'created'  # The invoice was created by an earlier request but not sent, only sending should be retried
+UNKNOWN = 'unknown'  # An earlier request may have created the invoice, it should be looked up before creating it
+REPLAY = 'replay'  # The request was already handled, the stored result should be returned
+IN_PROGRESS = 'in_progress'  # Another request with the same key is being handled right now
+MISMATCH = 'mismatch'  # The key was already used for a request with different data
+
+
+class Claim(NamedTuple):
+    """Outcome of starting a request with an idempotency key, with the stored data the outcome needs."""
+    outcome: str  # One of the outcomes above
+    token: Optional[str] = None  # Proves this request holds the key, for NEW, CREATED and UNKNOWN
+    first_used: Optional[datetime.datetime] = None  # When the key was first used, for UNKNOWN
+    invoice: Optional[dict[str, Any]] = None  # Raw invoice data from Congressus, for CREATED
+    res_status: Optional[int] = None  # Status code of the stored result, for REPLAY
+    res_data: Any = None  # Data of the stored result, for REPLAY
+
+
+def fingerprint(data: Any) -> str:
+    """
+    Create a fingerprint of request data, so reuse of an idempotency key for different data can be detected.
+
+    :param data: Request data, must be serializable to JSON.
+    :return: Hex digest of the data.
+    """
+    return hashlib.sha256(json.dumps(data, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Store of recently used idempotency keys and the result of the request made with each key, kept in the database so
+    it is shared by all workers, survives restarts and never drops a key before it expires. Database errors are raised,
+    so a sale is never posted without its key being checked.
+
+    A key goes through the states 'pending' (a request holds the key), 'created' (the invoice exists at Congressus but
+    was not sent), 'unknown' (creating the invoice failed in a way which does not tell whether it exists) and 'done'
+    (the result is stored). A request holds a pending key until its claim expires, so a worker which crashed does not
+    block the key forever. All keys are kept for the full TTL after they were last used.
+    """
+
+    def __init__(self, tenant: str, ttl: float, claim_ttl: float):
+        """
+        :param tenant: Name of the tenant the keys belong to.
+        :param ttl: Seconds to remember a key after it was last used.
+        :param claim_ttl: Seconds after which a key which is still pending may be claimed by another request. Must be
+            longer than the longest time a request can take, or both requests may create an invoice.
+        """
+        self.tenant = tenant
+        self.ttl = datetime.timedelta(seconds=ttl)
+        self.claim_ttl = datetime.timedelta(seconds=claim_ttl)
+
+    def _keys(self, key: str):
+        return IdempotencyKey.objects.filter(tenant=self.tenant, key=key)
+
+    def begin(self, key: str, data_fingerprint: str) -> Claim:
+        """
+        Claim an idempotency key before handling a request.
+
+        :param key: Idempotency key supplied by the client.
+        :param data_fingerprint: Fingerprint of the request data.
+        :return: The outcome with the data it needs, see 'Claim'.
+        """
+        now = timezone.now()
+        token = uuid.uuid4().hex
+        self._keys(key).filter(expires_at__lte=now).delete()  # An expired key may be used for a new sale
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(tenant=self.tenant, key=key, fingerprint=data_fingerprint,
+                                              state=IdempotencyKey.PENDING, token=token, first_used=now,
+                                              claimed_until=now + self.claim_ttl, expires_at=now + self.ttl)
+            return Claim(outcome=NEW, token=token)
+        except IntegrityError:  # The key was used before
+            pass
+
+        record = self._keys(key).first()
+        if record is None:  # Expired and deleted by another request in the meantime, it will be free on a retry
+            return Claim(outcome=IN_PROGRESS)
+        if record.fingerprint != data_fingerprint:
+            return Claim(outcome=MISMATCH)
+        if record.state == IdempotencyKey.DONE:
+            return Claim(outcome=REPLAY, res_status=record.res_status, res_data=record.res_data)
+        if record.state == IdempotencyKey.PENDING and record.claimed_until > now:
+            return Claim(outcome=IN_PROGRESS)
+
+        # The invoice was created but not sent, or it is unknown whether it was created, or the request which held
+        # the key crashed. Claim the key, unless another request just did.
+        claimed = self._keys(key).filter(token=record.token, state=record.state).update(
+            state=IdempotencyKey.PENDING, token=token, claimed_until=now + self.claim_ttl)
+        if not claimed:
+            return Claim(outcome=IN_PROGRESS)
+        if record.invoice is not None:
+            return Claim(outcome=CREATED, token=token, invoice=record.invoice)
+        return Claim(outcome=UNKNOWN, token=token, first_used=record.first_used)
+
+    def claimed_invoice_ids(self, invoice_ids: list[int]) -> set[int]:
+        """
+        Find which invoices belong to a key, so they are not mistaken for the invoice of another key.
+
+        :param invoice_ids: Congressus IDs of invoices.
+        :return: The IDs of the invoices which belong to any key.
+        """
+        return set(IdempotencyKey.objects.filter(tenant=self.tenant, invoice_id__in=invoice_ids)
+                   .values_list('invoice_id', flat=True))
+
+    def mark_created(self, key: str, token: str, invoice: dict[str, Any]) -> bool:
+        """
+        Store that the invoice was created at Congressus but not sent yet, so a retry only sends it.
+
+        :param key: Idempotency key supplied by the client.
+        :param token: Token of the claim on the key.
+        :param invoice: Raw invoice data returned by Congressus.
+        :return: Whether the invoice was stored, which fails if another key already refers to the same invoice.
+        """
+        try:
+            with transaction.atomic():
+                self._keys(key).filter(token=token).update(state=IdempotencyKey.CREATED, invoice=invoice,
+                                                           invoice_id=invoice['id'],
+                                                           expires_at=timezone.now() + self.ttl)
+            return True
+        except IntegrityError:
+            return False
+
+    def mark_unknown(self, key: str, token: str) -> None:
+        """
+        Store that the invoice may or may not have been created, so a retry looks it up before creating it.
+
+        :param key: Idempotency key supplied by the client.
+        :param token: Token of the claim on the key.
+        """
+        self._keys(key).filter(token=token).update(state=IdempotencyKey.UNKNOWN, expires_at=timezone.now() + self.ttl)
+
+    def complete(self, key: str, token: str, res_status: int, res_data: Any) -> None:
+        """
+        Store the final result of the request made with this key.
+
+        :param key: Idempotency key supplied by the client.
+        :param token: Token of the claim on the key.
+        :param res_status: Status code of the response.
+        :param res_data: Data of the response, must be serializable to JSON.
+        """
+        self._keys(key).filter(token=token).update(state=IdempotencyKey.DONE, res_status=res_status,
+                                                   res_data=res_data, expires_at=timezone.now() + self.ttl)
+
+    def release(self, key: str, token: str) -> None:
+        """
+        Forget a key, because nothing was created at Congressus, so the sale may be posted again with the same key.
+
+        :param key: Idempotency key supplied by the client.
+        :param token: Token of the claim on the key.
+        """
+        self._keys(key).filter(token=token, invoice__isnull=True).delete()
@@ -0,0 +1,82 @@
+import re
+import threading
+from collections import deque
+from typing import Optional
+
+_ID_IN_URL_PATTERN = re.compile(r'/\d+(?=/|$)')  # Numeric path segments, e.g. the 123 in /members/123
+
+
+def endpoint_key(method: str, url_endpoint: str) -> str:
+    """
+    Create a key which groups calls to the same endpoint, replacing IDs in the URL by a placeholder.
+
+    :param method: HTTP method.
+    :param url_endpoint: URL endpoint, e.g. '/members/123'.
+    :return: Key of the endpoint, e.g. 'GET /members/{id}'.
+    """
+    return f"{method.upper()} {_ID_IN_URL_PATTERN.sub('/{id}', url_endpoint)}"
+
+
+class LatencyTracker:
+    """
+    Keeps a running latency estimate per endpoint, based on a sliding window of the most recent calls.
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        """
+        :param window: Number of recent calls per endpoint to base the estimate on.
+        :param min_samples: Minimum number of calls to an endpoint before an estimate is given.
+        """
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: dict[str, deque] = dict()
+        self._sorted: dict[str, list[float]] = dict()  # Sorted copy of the samples, removed when samples change
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float) -> None:
+        """
+        Record the duration of a call. Calls which timed out should be recorded with their timeout.
+
+        :param endpoint: Key of the endpoint, see 'endpoint_key'.
+        :param seconds: Duration of the call in seconds.
+        """
+        with self._lock:
+            samples = self._samples.get(endpoint)
+            if samples is None:
+                samples = self._samples[endpoint] = deque(maxlen=self.window)
+            samples.append(seconds)
+            self._sorted.pop(endpoint, None)
+
+    def get_state(self) -> dict[str, list[float]]:
+        """Returns the recent call durations of every endpoint."""
+        with self._lock:
+            return {endpoint: list(samples) for endpoint, samples in self._samples.items()}
+
+    def restore_state(self, state: dict[str, list[float]], age: float) -> None:
+        """
+        Restore the call durations from a state returned by 'get_state'.
+
+        :param state: State returned by 'get_state'.
+        :param age: Number of seconds since the state was created, not used since latencies do not expire.
+        """
+        with self._lock:
+            for endpoint, samples in state.items():
+                self._samples[endpoint] = deque(samples, maxlen=self.window)
+                self._sorted.pop(endpoint, None)
+
+    def percentile(self, endpoint: str, fraction: float) -> Optional[float]:
+        """
+        Get a latency percentile of an endpoint.
+
+        :param endpoint: Key of the endpoint, see 'endpoint_key'.
+        :param fraction: Percentile as a fraction, e.g. 0.95 for the 95th percentile.
+        :return: Latency in seconds, or None if there are not enough calls to the endpoint yet.
+        """
+        with self._lock:
+            sorted_samples = self._sorted.get(endpoint)
+            if sorted_samples is None:
+                samples = self._samples.get(endpoint)
+                if samples is None or len(samples) < self.min_samples:
+                    return None
+                sorted_samples = self._sorted[endpoint] = sorted(samples)
+        return sorted_samples[min(len(sorted_samples) - 1, int(fraction * len(sorted_samples)))]
@@ -9,6 +9,7 @@ import threading
 from rest_framework.response import Response
 from rest_framework.request import Request
 
+from streeplijst.congressus import profiling, timing
 from streeplijst.congressus.api_base import ApiBase
 
 api_local_logger = logging.getLogger('api.local')  # Local API call logs
@@ -76,16 +77,17 @@ def log_congressus_request_response(res_status: int, method: str, url: str, para
     :param params: Optional dictionary containing URL query (everything after question mark)
     :param payload: Optional dictionary containing the request body
     """
-    log_str = f"{_response_str(status_code=res_status, elapsed_time=elapsed_time)} | " \
-              f"{_congressus_request_str(method=method, url_endpoint=url, payload=payload, params=params)}"
+    with timing.measure('log'):
+        log_str = f"{_response_str(status_code=res_status, elapsed_time=elapsed_time)} | " \
+                  f"{_congressus_request_str(method=method, url_endpoint=url, payload=payload, params=params)}"
 
-    # Log message based on status code
-    if res_status >= 500:  # Status is server error
-        api_congressus_logger.error(msg=log_str)
-    elif res_status >= 400:  # Status is client error
-        api_congressus_logger.warning(msg=log_str)
-    else:  # Status is OK
-        api_congressus_logger.info(msg=log_str)
+        # Log message based on status code
+        if res_status >= 500:  # Status is server error
+            api_congressus_logger.error(msg=log_str)
+        elif res_status >= 400:  # Status is client error
+            api_congressus_logger.warning(msg=log_str)
+        else:  # Status is OK
+            api_congressus_logger.info(msg=log_str)
 
 
 def log_local_request_response(func: Callable[..., Response]) \
@@ -98,36 +100,52 @@ def log_local_request_response(func: Callable[..., Response]) \
 
     @wraps(func)
     def wrapper(self: ApiBase, req: Request, *args, **kwargs) -> Response:
-        threading_local.request_id = str(uuid.uuid4())[:8]  # Set an 8 char request ID to access it from other loggers
+        depth = getattr(threading_local, 'depth', 0)  # Number of decorated functions this call is nested in
+        profile = None
+        if depth == 0:  # Calls nested in another decorated function belong to the same request
+            threading_local.request_id = str(uuid.uuid4())[:8]  # Set an 8 char request ID for other loggers
+            if profiling.should_profile(req):
+                profile = profiling.start_profile(request_id=threading_local.request_id, name=func.__name__)
 
         start_time = DateTime.now()
-        res = func(self, req, *args, **kwargs)
-        log_str = _response_str(status_code=res.status_code, elapsed_time=DateTime.now() - start_time)
-        log_str += " | "
-        log_str += f"Request: \'{req.method} {req.get_full_path()}\'"
-
-        # Iterate over all args, convert them to str, and join them
-        args_str = ','.join(map(str, args))
-        args_str = args_str.replace("'", '"')  # Replace any single quotes by double quotes
-
-        # Iterator over all kwargs, convert them into k=v and join them
-        kwargs_str = ','.join(f'{k}={v}' for k, v in kwargs.items())
-        kwargs_str = kwargs_str.replace("'", '"')  # Replace any single quotes by double quotes
-
-        # If both args and kwarts exist, add a comma between them
-        if args_str and kwargs_str:
-            args_str += ','
-
-        # Form the final representation by adding func name and print everything
-        log_str += f" function: {func.__name__}({args_str}{kwargs_str})"
-
-        # Log message based on status code
-        if res.status_code >= 500:  # Status is server error
-            api_local_logger.error(msg=log_str)
-        elif res.status_code >= 400:  # Status is client error
-            api_local_logger.warning(msg=log_str)
-        else:  # Status is OK
-            api_local_logger.info(msg=log_str)
+        threading_local.depth = depth + 1
+        try:
+            res = func(self, req, *args, **kwargs)
+        finally:
+            threading_local.depth = depth
+            if profile is not None:
+                profiling.finish_profile(profile, path=req.get_full_path() if req is not None else None,
+                                         elapsed=(DateTime.now() - start_time).total_seconds())
+        with timing.measure('log'):
+            log_str = _response_str(status_code=res.status_code, elapsed_time=DateTime.now() - start_time)
+            log_str += " | "
+            if req is not None:  # Internal calls, like prefetches, are not made for a request
+                log_str += f"Request: \'{req.method} {req.get_full_path()}\'"
+            else:
+                log_str += "Request: None"
+
+            # Iterate over all args, convert them to str, and join them
+            args_str = ','.join(map(str, args))
+            args_str = args_str.replace("'", '"')  # Replace any single quotes by double quotes
+
+            # Iterator over all kwargs, convert them into k=v and join them
+            kwargs_str = ','.join(f'{k}={v}' for k, v in kwargs.items())
+            kwargs_str = kwargs_str.replace("'", '"')  # Replace any single quotes by double quotes
+
+            # If both args and kwarts exist, add a comma between them
+            if args_str and kwargs_str:
+                args_str += ','
+
+            # Form the final representation by adding func name and print everything
+            log_str += f" function: {func.__name__}({args_str}{kwargs_str})"
+
+            # Log message based on status code
+            if res.status_code >= 500:  # Status is server error
+                api_local_logger.error(msg=log_str)
+            elif res.status_code >= 400:  # Status is client error
+                api_local_logger.warning(msg=log_str)
+            else:  # Status is OK
+                api_local_logger.info(msg=log_str)
 
         return res
 
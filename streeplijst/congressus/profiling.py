@@ -0,0 +1,191 @@
+import hmac
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from types import FrameType
+from typing import Any, Optional
+
+from django.conf import settings
+
+profiling_logger = logging.getLogger('api.local')  # Profiling problems are logged together with local requests
+
+PROFILE_HEADER = 'X-Streeplijst-Profile'  # Requests with this header set to the profile secret are always profiled
+
+
+class Profile:
+    """
+    Sampled call stacks of the threads handling a single request.
+
+    Stacks are stored as tuples of frame labels from the outermost to the innermost call, with the number of times
+    each stack was sampled.
+    """
+
+    def __init__(self, request_id: str, name: str):
+        """
+        :param request_id: ID of the request, also used as the file name of the profile.
+        :param name: Name of the profiled function.
+        """
+        self.request_id = request_id
+        self.name = name
+        self.stacks: Counter = Counter()
+        self.started = time.time()
+
+    def to_dict(self, **metadata: Any) -> dict[str, Any]:
+        return {
+            'request_id': self.request_id,
+            'name': self.name,
+            'started': self.started,
+            'interval': SamplingProfiler.interval,
+            'samples': sum(self.stacks.values()),
+            **metadata,
+            'stacks': {';'.join(stack): count for stack, count in self.stacks.items()},  # Folded stack format
+        }
+
+
+# Paths to strip from file names in frame labels, longest first
+_PATH_PREFIXES = sorted({str(Path(path)) + os.sep for path in [settings.BASE_DIR, *sys.path] if path},
+                        key=len, reverse=True)
+
+
+def _frame_label(frame: FrameType) -> str:
+    """Returns a label of the function of a frame which is the same for all calls to that function."""
+    code = frame.f_code
+    filename = code.co_filename
+    for prefix in _PATH_PREFIXES:  # Shorten paths to the project or to installed packages
+        if filename.startswith(prefix):
+            filename = filename[len(prefix):]
+            break
+    return f'{filename}:{code.co_firstlineno}({code.co_name})'
+
+
+class SamplingProfiler:
+    """
+    Profiler which samples the call stacks of the threads of all profiled requests at a fixed interval.
+
+    A single background thread takes the samples, and only while a request is being profiled. Requests which are
+    not profiled have no overhead at all. The stacks of all threads are sampled whether they are running or waiting,
+    so time spent waiting for Congressus shows up as well as time spent decoding, stripping or logging.
+    """
+    interval: float = 0.005  # Seconds between two samples
+
+    _profiles: dict[int, Profile] = dict()  # Profile of each thread which is being profiled, by thread ID
+    _lock = threading.Lock()
+    _active = threading.Event()  # Set while any thread is being profiled
+    _thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def add_thread(cls, profile: Profile) -> None:
+        """Start sampling the current thread into a profile."""
+        thread_id = threading.get_ident()
+        with cls._lock:
+            cls._profiles[thread_id] = profile
+            if cls._thread is None:
+                cls._thread = threading.Thread(target=cls._run, name='streeplijst_profiler', daemon=True)
+                cls._thread.start()
+            cls._active.set()
+
+    @classmethod
+    def remove_thread(cls) -> None:
+        """Stop sampling the current thread."""
+        with cls._lock:
+            cls._profiles.pop(threading.get_ident(), None)
+            if not cls._profiles:
+                cls._active.clear()
+
+    @classmethod
+    def _run(cls) -> None:
+        own_thread_id = threading.get_ident()
+        while True:
+            cls._active.wait()
+            time.sleep(cls.interval)
+            with cls._lock:  # A thread which is removed is not sampled anymore once removing it returns
+                frames = sys._current_frames()
+                for thread_id, profile in cls._profiles.items():
+                    frame = frames.get(thread_id)
+                    if frame is None or thread_id == own_thread_id:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(_frame_label(frame))
+                        frame = frame.f_back
+                    stack.reverse()
+                    profile.stacks[tuple(stack)] += 1
+                frames = frame = None  # Frames keep all their local variables alive
+
+
+threading_local_profile = threading.local()  # Profile of the request handled by the current thread, if any
+
+
+def _profile_requested(req) -> bool:
+    """
+    Returns whether a request was flagged with the profile header. Profiles are written to disk, so the header must
+    contain settings.PROFILE_SECRET, or may be set to 1 when DEBUG is on.
+    """
+    value = req.headers.get(PROFILE_HEADER) if req is not None else None
+    if not value:
+        return False
+    if settings.DEBUG and value == '1':
+        return True
+    secret = settings.PROFILE_SECRET
+    return secret is not None and hmac.compare_digest(value.encode(), secret.encode())
+
+
+def should_profile(req) -> bool:
+    """
+    Returns whether a request should be profiled: either it was flagged with the profile header, or it was picked
+    at random with the configured sample rate.
+    """
+    if _profile_requested(req):
+        return True
+    sample_rate = settings.PROFILE_SAMPLE_RATE
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+def start_profile(request_id: str, name: str) -> Profile:
+    """Start profiling the current thread for a request."""
+    profile = Profile(request_id=request_id, name=name)
+    threading_local_profile.profile = profile
+    SamplingProfiler.add_thread(profile)
+    return profile
+
+
+def current_profile() -> Optional[Profile]:
+    """Returns the profile of the request handled by the current thread, if it is being profiled."""
+    return getattr(threading_local_profile, 'profile', None)
+
+
+def join_profile(profile: Optional[Profile]) -> None:
+    """Add the current thread to the profile of a request, e.g. when it handles part of that request."""
+    threading_local_profile.profile = profile
+    if profile is not None:
+        SamplingProfiler.add_thread(profile)
+
+
+def leave_profile() -> None:
+    """Stop adding the current thread to the profile of a request, see 'join_profile'."""
+    if current_profile() is not None:
+        SamplingProfiler.remove_thread()
+    threading_local_profile.profile = None
+
+
+def finish_profile(profile: Profile, **metadata: Any) -> None:
+    """
+    Stop profiling the current thread and write the profile to PROFILE_FOLDER, named after its request ID.
+
+    :param profile: Profile to finish.
+    :param metadata: Additional information about the request to store with the profile.
+    """
+    leave_profile()
+    folder = Path(settings.PROFILE_FOLDER)
+    try:
+        folder.mkdir(parents=True, exist_ok=True)
+        with open(folder / f'{profile.request_id}.json', 'w') as file:
+            json.dump(profile.to_dict(**metadata), file)
+    except OSError as e:  # Profiling must never break a request
+        profiling_logger.warning(msg=f"Could not write profile {profile.request_id}: {e}")
@@ -0,0 +1,120 @@
+import enum
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Union
+
+rate_limit_logger = logging.getLogger('api.congressus')  # Rate limiting is logged together with Congressus calls
+
+
+class Priority(enum.IntEnum):
+    """
+    Priority class of a call to Congressus. A lower value means a higher priority.
+    """
+    SALE = 0  # Posting and sending sales, a member is waiting at the checkout
+    MEMBER = 1  # Member lookups, a member is logging in
+    BACKGROUND = 2  # Catalog and sales history fetches, which may be delayed if needed
+
+
+class SharedRateLimiter:
+    """
+    Token bucket rate limiter which is shared between all worker processes on a host.
+
+    The bucket state is stored in a SQLite database so every process draws tokens from the same bucket. To give
+    priority to important calls, each priority class may only take a token if the bucket keeps at least a reserved
+    fraction of its capacity for the higher priority classes. Sales can therefore always drain the bucket completely,
+    while background calls leave room for sales and member lookups.
+    """
+    # Fraction of the bucket capacity which a priority class has to leave for higher priority classes
+    RESERVED_FRACTION: dict[Priority, float] = {
+        Priority.SALE: 0.0,
+        Priority.MEMBER: 0.2,
+        Priority.BACKGROUND: 0.5,
+    }
+    BUSY_TIMEOUT: float = 5.0  # Seconds to wait for the database lock held by another process
+
+    def __init__(self, db_path: Union[str, Path], name: str, rate: float, capacity: int):
+        """
+        :param db_path: Path to the SQLite database file which holds the bucket state.
+        :param name: Name of the bucket, so multiple buckets can share the same database file.
+        :param rate: Number of tokens added to the bucket per second.
+        :param capacity: Maximum number of tokens in the bucket (maximum burst size).
+        """
+        self.db_path = Path(db_path)
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self._local = threading.local()  # SQLite connections cannot be shared between threads
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        """Returns a SQLite connection for the current thread, creating the database if needed."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            # isolation_level None allows us to control transactions ourselves with BEGIN IMMEDIATE
+            conn = sqlite3.connect(str(self.db_path), timeout=self.BUSY_TIMEOUT, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+            self._local.conn = conn
+        return conn
+
+    def _try_take(self, priority: Priority) -> float:
+        """
+        Attempt to take a single token from the bucket.
+
+        :param priority: Priority class of the call.
+        :return: 0 if a token was taken, otherwise the number of seconds until a token is expected to be available.
+        """
+        reserved = self.RESERVED_FRACTION[priority] * self.capacity
+        conn = self._connection
+        conn.execute("BEGIN IMMEDIATE")  # Lock the database for writing so no other process changes the bucket
+        try:
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (self.name,)).fetchone()
+            if row is None:  # First use of this bucket, start with a full bucket
+                tokens = float(self.capacity)
+            else:  # Refill the bucket with the tokens added since the last update
+                tokens = min(float(self.capacity), row[0] + max(0.0, now - row[1]) * self.rate)
+
+            wait_time = 0.0
+            if tokens - 1 >= reserved:  # Enough tokens are left for the higher priority classes
+                tokens -= 1
+            else:  # Calculate how long it takes before enough tokens have been added
+                wait_time = (reserved + 1 - tokens) / self.rate
+
+            conn.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                         (self.name, tokens, now))
+            conn.execute("COMMIT")
+            return wait_time
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def acquire(self, priority: Priority, max_wait: float) -> bool:
+        """
+        Take a token from the bucket, waiting until one becomes available for this priority class.
+
+        If the shared state cannot be accessed, the call is allowed so a broken state file never blocks sales.
+
+        :param priority: Priority class of the call.
+        :param max_wait: Maximum number of seconds to wait for a token.
+        :return: True if a token was taken, False if no token became available within max_wait seconds.
+        """
+        deadline = time.monotonic() + max_wait
+        while True:
+            try:
+                wait_time = self._try_take(priority)
+            except sqlite3.Error as e:
+                rate_limit_logger.warning(msg=f"Rate limiter unavailable, allowing call: {e}")
+                return True
+
+            if wait_time == 0:  # A token was taken
+                return True
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:  # Waited for too long
+                return False
+            time.sleep(min(wait_time, remaining))
@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Optional, Tuple
+
+from streeplijst.congressus.records import SaleInvoiceRecord
+
+
+def _oldest_first(sale: SaleInvoiceRecord) -> Tuple[str, int]:
+    """Sort key of sales, oldest first."""
+    return sale.created or sale.invoice_date or '', sale.id if isinstance(sale.id, int) else 0
+
+
+class _MemberPurchases:
+    """Most recent sales of a single member."""
+    __slots__ = ('sales', 'complete', 'updated')
+
+    def __init__(self, max_sales: int):
+        self.sales: deque[SaleInvoiceRecord] = deque(maxlen=max_sales)  # Sales of the member, the oldest drops out
+        self.complete = False  # Whether these are the most recent sales of the member, or just some recent sales
+        self.updated = time.time()  # Time at which sales were last added
+
+
+class RecentPurchases:
+    """
+    In-memory ring buffer of the most recent sales of every member who bought something recently.
+
+    The buffer of a member is complete once it was filled with their most recent sales from Congressus. Sales which
+    are posted or seen later are added to it, and the oldest sales drop out. Only the members who were used most
+    recently are kept.
+    """
+
+    def __init__(self, max_members: int, max_sales: int, max_age: float):
+        """
+        :param max_members: Max number of members to keep sales of.
+        :param max_sales: Max number of sales to keep per member.
+        :param max_age: Seconds after which the sales of a member are fetched again, even if no sales were added.
+        """
+        self.max_members = max_members
+        self.max_sales = max_sales
+        self.max_age = max_age
+        self._members: OrderedDict[int, _MemberPurchases] = OrderedDict()  # Least recently used member first
+        self._lock = threading.Lock()
+
+    def get(self, member_id: int, changed: Optional[float] = None) -> Optional[list[dict[str, Any]]]:
+        """
+        Get the most recent sales of a member.
+
+        :param member_id: ID of the member.
+        :param changed: Optional time at which the member last bought something, possibly in another worker.
+        :return: Stripped sales of the member, newest first, or None if they are not known here.
+        """
+        with self._lock:
+            purchases = self._members.get(member_id)
+            if purchases is None or not purchases.complete or time.time() - purchases.updated > self.max_age:
+                return None
+            if changed is not None and purchases.updated < changed:  # A sale was posted by another worker
+                return None
+            self._members.move_to_end(member_id)
+            return [sale.to_dict() for sale in reversed(purchases.sales)]
+
+    def fill(self, member_id: int, sales: list[dict[str, Any]]) -> None:
+        """
+        Replace the sales of a member with their most recent sales from Congressus.
+
+        :param member_id: ID of the member.
+        :param sales: Stripped most recent sales of the member.
+        """
+        with self._lock:
+            purchases = _MemberPurchases(max_sales=self.max_sales)
+            purchases.sales.extend(sorted(map(SaleInvoiceRecord.from_raw, sales), key=_oldest_first))
+            purchases.complete = True
+            self._store(member_id, purchases)
+
+    def record(self, sales: list[dict[str, Any]]) -> None:
+        """
+        Add new or changed sales of any members.
+
+        :param sales: Stripped sales.
+        """
+        with self._lock:
+            for sale in map(SaleInvoiceRecord.from_raw, sales):
+                if not isinstance(sale.member_id, int):  # Cannot be attributed to a member
+                    continue
+                purchases = self._members.get(sale.member_id)
+                if purchases is None:
+                    purchases = _MemberPurchases(max_sales=self.max_sales)
+                merged_sales = {existing.id: existing for existing in purchases.sales}
+                merged_sales[sale.id] = sale  # Replaces an older version of the same sale
+                purchases.sales.clear()
+                purchases.sales.extend(sorted(merged_sales.values(), key=_oldest_first))
+                purchases.updated = time.time()
+                self._store(sale.member_id, purchases)
+
+    def get_state(self) -> list[Tuple[int, Tuple[SaleInvoiceRecord, ...], bool, float]]:
+        """Returns the sales of every member, least recently used member first."""
+        with self._lock:
+            return [(member_id, tuple(purchases.sales), purchases.complete, purchases.updated)
+                    for member_id, purchases in self._members.items()]
+
+    def restore_state(self, state: list[Tuple[int, Tuple[SaleInvoiceRecord, ...], bool, float]], age: float) -> None:
+        """
+        Restore the sales from a state returned by 'get_state'.
+
+        :param state: State returned by 'get_state'.
+        :param age: Number of seconds since the state was created, unused since members keep their update time.
+        """
+        with self._lock:
+            for member_id, sales, complete, updated in state:
+                purchases = _MemberPurchases(max_sales=self.max_sales)
+                purchases.sales.extend(sales)
+                purchases.complete = complete
+                purchases.updated = updated
+                self._store(member_id, purchases)
+
+    def _store(self, member_id: int, purchases: _MemberPurchases) -> None:
+        """Store the sales of a member as most recently used, must be called while holding the lock."""
+        self._members[member_id] = purchases
+        self._members.move_to_end(member_id)
+        while len(self._members) > self.max_members:
+            self._members.popitem(last=False)
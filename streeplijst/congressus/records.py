@@ -0,0 +1,159 @@
+import sys
+from typing import Any, Callable, Optional
+
+
+def _intern(value: Any) -> Any:
+    """Intern strings which are repeated in many records (like statuses), so all records share a single copy."""
+    return sys.intern(value) if type(value) is str else value
+
+
+def _media_url(media: Any) -> Optional[str]:
+    """Returns the URL of the first media object, or the media itself if it was already stripped to a URL."""
+    if isinstance(media, list):  # Raw media is an array of nested dicts
+        return media[0]['url'] if media else None  # None will serialize to null in javascript
+    return media
+
+
+class Record:
+    """
+    Base class of compact records for stripped Congressus data.
+
+    A record only has a slot for every field in '__slots__', so it does not carry a dict per instance like the raw
+    JSON data does, and strings which are repeated in many records are shared. Subclasses only list their fields, how
+    each field is converted is collected in '_fields' once per class when the class is created.
+
+    Subclasses may set:
+    - '_default': Value of fields which are missing in the raw data.
+    - '_converters': Functions per field which convert the raw value to the stripped value.
+    - '_interned': Fields with strings which are repeated in many records.
+    - '_nested': Fields with an array of nested records, mapped to the record class of the array items.
+    """
+    __slots__ = ()
+
+    _default: Any = None
+    _converters: dict[str, Callable[[Any], Any]] = {}
+    _interned: tuple[str, ...] = ()
+    _nested: dict[str, type['Record']] = {}
+    # Name, converter (or None), whether it is interned and nested record class (or None) of every field
+    _fields: tuple[tuple[str, Optional[Callable[[Any], Any]], bool, Optional[type['Record']]], ...] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = tuple((field, cls._converters.get(field), field in cls._interned, cls._nested.get(field))
+                            for field in cls.__slots__)
+
+    @classmethod
+    def from_raw(cls, raw: dict[str, Any]) -> 'Record':
+        """Create a record from raw (or already stripped) JSON data, ignoring all fields which are not needed."""
+        record = object.__new__(cls)
+        for field, converter, interned, nested in cls._fields:
+            value = raw.get(field, cls._default)
+            if converter is not None:
+                value = converter(value)
+            if nested is not None:
+                value = None if value is None else tuple(map(nested.from_raw, value))
+            elif interned:
+                value = _intern(value)
+            setattr(record, field, value)
+        return record
+
+    @classmethod
+    def strip(cls, raw: dict[str, Any]) -> dict[str, Any]:
+        """Strip raw JSON data to a dict with the same contents as 'from_raw(raw).to_dict()', without a record."""
+        stripped = dict()
+        for field, converter, _, nested in cls._fields:
+            value = raw.get(field, cls._default)
+            if converter is not None:
+                value = converter(value)
+            if nested is not None:
+                value = None if value is None else list(map(nested.strip, value))
+            stripped[field] = value
+        return stripped
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert the record to a dict which can be serialized to JSON."""
+        result = dict()
+        for field, _, _, nested in self._fields:
+            value = getattr(self, field)
+            if nested is not None:
+                value = None if value is None else list(map(nested.to_dict, value))
+            result[field] = value
+        return result
+
+    def __eq__(self, other: object) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __getstate__(self) -> tuple:
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __setstate__(self, state: tuple) -> None:
+        for field, value in zip(self.__slots__, state):
+            setattr(self, field, value)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({', '.join(f'{field}={getattr(self, field)!r}' for field in self.__slots__)})"
+
+
+class MemberRecord(Record):
+    """Member details which are relevant, without unnecessary personal details."""
+    __slots__ = (
+        'id',  # Internal congressus ID
+        'username',  # Username (student number)
+        'first_name',  # First name (or names, in case someone has multiple first names)
+        'last_name',  # Last name (or names, in case someone has multiple last names)
+        'prefix',  # Name prefix (e.g. "Prof. dr.")
+        'suffix',  # Name suffix (e.g. "MSc.")
+        'date_of_birth',  # Date of birth for 18+ checking
+        'show_almanac',  # Whether this user wants to show their information on the website
+        'status',  # Current membership status TODO: Check if user has valid status
+        'bank_account',  # All banking information TODO: Remove this and only extract sdd mandate, if necessary
+    )
+    _default = 'error'
+    _interned = ('status',)
+
+
+class ProductRecord(Record):
+    """Product details, with the array of media objects replaced by the URL of the first image."""
+    __slots__ = (
+        'id',  # Internal congressus ID
+        'product_offer_id',  # ID for the product offer (variant)
+        'name',  # Product name
+        'description',  # Product description
+        'published',  # Whether this product is published
+        'price',  # Price of product in euros
+        'media',  # URL to the image of this product, or None
+    )
+    _converters = {'media': _media_url}
+
+
+class SaleItemRecord(Record):
+    """A single product line of a sale invoice."""
+    __slots__ = (
+        'name',  # Product name at the time of the sale
+        'price',  # Price per item in euros
+        'product_offer_id',  # ID for the product offer (variant)
+        'quantity',  # Number of items bought
+        'sale_invoice_id',  # ID of the invoice this item belongs to
+    )
+    _interned = ('name',)
+
+
+class SaleInvoiceRecord(Record):
+    """Sale invoice details, including the details of each item."""
+    __slots__ = (
+        'id',  # ID of this invoice
+        'member_id',  # Member ID this invoice is related to
+        'items',  # Tuple of SaleItemRecords in this invoice
+        'price_paid',  # Paid amount in euros
+        'price_unpaid',  # Unpaid amount in euros
+        'invoice_date',  # Date on which invoice was issued to the user
+        'invoice_source',  # Invoice source, usually "api"
+        'invoice_status',  # Invoice status
+        'invoice_type',  # Invoice type, usually "webshop"
+        'created',  # Datetime on which invoice was created
+        'modified',  # Datetime on which invoice was modified
+    )
+    _interned = ('invoice_date', 'invoice_source', 'invoice_status', 'invoice_type')
+    _nested = {'items': SaleItemRecord}
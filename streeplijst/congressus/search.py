@@ -0,0 +1,175 @@
+import re
+import threading
+import time
+import unicodedata
+from typing import Any, Optional, Tuple
+
+from streeplijst.congressus.records import ProductRecord
+
+_TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text: Optional[str]) -> list[str]:
+    """
+    Split text into lowercase tokens without accents, so 'Crème brûlée' becomes ['creme', 'brulee'].
+
+    :param text: Text to split, may be None.
+    :return: List of tokens.
+    """
+    if not text:
+        return []
+    normalized = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii').lower()
+    return _TOKEN_PATTERN.findall(normalized)
+
+
+class _IndexedProduct:
+    """A product in the search index together with the tokens it was indexed with."""
+    __slots__ = ('product', 'folder_id', 'name_tokens', 'description_tokens', 'prefixes')
+
+    def __init__(self, product: ProductRecord, folder_id: int):
+        self.product = product
+        self.folder_id = folder_id
+        self.name_tokens = set(tokenize(product.name))
+        self.description_tokens = set(tokenize(product.description))
+        self.prefixes = {token[:length] for token in self.name_tokens | self.description_tokens
+                         for length in range(1, len(token) + 1)}
+
+
+class ProductSearchIndex:
+    """
+    In-memory search index over the name and description of all products in the Streeplijst folders.
+
+    The index is an inverted index from every prefix of every token (including the whole token) to the products
+    containing a token with that prefix, so a partially typed word is answered with a single dictionary lookup.
+    Folders are updated incrementally: only products which were added, changed or removed since the last update of
+    their folder are re-indexed.
+    """
+
+    # Score of a query term matching a token of a product, higher scores are listed first
+    SCORE_NAME_TOKEN: int = 4  # Term is a whole word in the product name
+    SCORE_NAME_PREFIX: int = 2  # Term is the start of a word in the product name
+    SCORE_DESCRIPTION: int = 1  # Term is (the start of) a word in the product description
+
+    def __init__(self):
+        self._products: dict[int, _IndexedProduct] = dict()  # Indexed products by product ID
+        self._folder_products: dict[int, set[int]] = dict()  # Product IDs per folder ID
+        self._folder_updated: dict[int, float] = dict()  # Time of the last update per folder ID
+        self._prefixes: dict[str, set[int]] = dict()  # Inverted index, product IDs per token prefix
+        self._lock = threading.Lock()
+
+    def folder_age(self, folder_id: int) -> Optional[float]:
+        """Returns the number of seconds since a folder was last updated, or None if it was never indexed."""
+        updated = self._folder_updated.get(folder_id)
+        return None if updated is None else time.monotonic() - updated
+
+    def folder_of(self, product_id: int) -> Optional[int]:
+        """Returns the ID of the folder containing a product, or None if the product is not indexed."""
+        indexed = self._products.get(product_id)
+        return None if indexed is None else indexed.folder_id
+
+    def update_folder(self, folder_id: int, products: list[dict[str, Any]]) -> None:
+        """
+        Update the products of a folder in the index.
+
+        :param folder_id: ID of the folder.
+        :param products: All stripped products currently in the folder.
+        """
+        with self._lock:
+            new_ids = {product['id'] for product in products}
+            for product_id in self._folder_products.get(folder_id, set()) - new_ids:  # Removed from the folder
+                self._remove(product_id)
+
+            for product in map(ProductRecord.from_raw, products):
+                indexed = self._products.get(product.id)
+                if indexed is not None and indexed.product == product and indexed.folder_id == folder_id:
+                    continue  # Product did not change
+                if indexed is not None:
+                    self._remove(product.id)
+                self._add(_IndexedProduct(product=product, folder_id=folder_id))
+
+            self._folder_products[folder_id] = new_ids
+            self._folder_updated[folder_id] = time.monotonic()
+
+    def get_state(self) -> dict[int, Tuple[float, list[ProductRecord]]]:
+        """Returns the products of every folder and the number of seconds since the folder was updated."""
+        with self._lock:
+            now = time.monotonic()
+            state = dict()
+            for folder_id, product_ids in self._folder_products.items():
+                indexed_products = [self._products.get(product_id) for product_id in product_ids]
+                state[folder_id] = (now - self._folder_updated[folder_id],
+                                    [indexed.product for indexed in indexed_products
+                                     if indexed is not None and indexed.folder_id == folder_id])
+            return state
+
+    def restore_state(self, state: dict[int, Tuple[float, list[ProductRecord]]], age: float) -> None:
+        """
+        Restore the index from a state returned by 'get_state'. Folders keep their age, so they are refreshed as soon
+        as they would have been without a restart.
+
+        :param state: State returned by 'get_state'.
+        :param age: Number of seconds since the state was created.
+        """
+        for folder_id, (folder_age, products) in state.items():
+            self.update_folder(folder_id=folder_id, products=[product.to_dict() for product in products])
+            with self._lock:
+                self._folder_updated[folder_id] = time.monotonic() - folder_age - age
+
+    def search(self, query: str, limit: int) -> list[dict[str, Any]]:
+        """
+        Search for products which match every term of the query. Each term may be the start of a word, so results can
+        be shown while typing.
+
+        :param query: Search query.
+        :param limit: Maximum number of results.
+        :return: Stripped products with their folder_id, best matches first.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            # Only products which contain a token starting with every term match
+            candidates = None
+            for term in sorted(terms, key=lambda t: len(self._prefixes.get(t, ()))):  # Smallest set first
+                matches = self._prefixes.get(term)
+                if not matches:
+                    return []
+                candidates = set(matches) if candidates is None else candidates & matches
+                if not candidates:
+                    return []
+
+            scored = []
+            for product_id in candidates:
+                indexed = self._products[product_id]
+                score = 0
+                for term in terms:
+                    if term in indexed.name_tokens:
+                        score += self.SCORE_NAME_TOKEN
+                    elif any(token.startswith(term) for token in indexed.name_tokens):
+                        score += self.SCORE_NAME_PREFIX
+                    else:
+                        score += self.SCORE_DESCRIPTION
+                scored.append((-score, indexed.product.name or '', indexed))
+
+        scored.sort(key=lambda result: result[:2])
+        return [dict(indexed.product.to_dict(), folder_id=indexed.folder_id) for _, _, indexed in scored[:limit]]
+
+    def _add(self, indexed: _IndexedProduct) -> None:
+        """Add a product to the index, must be called while holding the lock."""
+        product_id = indexed.product.id
+        self._products[product_id] = indexed
+        for prefix in indexed.prefixes:
+            self._prefixes.setdefault(prefix, set()).add(product_id)
+
+    def _remove(self, product_id: int) -> None:
+        """Remove a product from the index, must be called while holding the lock."""
+        indexed = self._products.pop(product_id, None)
+        if indexed is None:
+            return
+        for prefix in indexed.prefixes:
+            product_ids = self._prefixes.get(prefix)
+            if product_ids is not None:
+                product_ids.discard(product_id)
+                if not product_ids:
+                    del self._prefixes[prefix]
@@ -0,0 +1,150 @@
+import atexit
+import logging
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional, Tuple
+
+snapshot_logger = logging.getLogger('api.local')  # Snapshot problems are logged together with local requests
+
+_MAGIC = b'STRPSNAP'  # Start of every snapshot file
+_FORMAT_VERSION = 1  # Version of the file layout, increase when the header or payload encoding changes
+_HEADER = struct.Struct('<8sHHd')  # Magic, format version, data version, creation time (seconds since epoch)
+
+
+def write_snapshot(path: Path, data_version: int, data: Any) -> None:
+    """
+    Write a snapshot file. The file is replaced atomically, so a snapshot which is being read is never half written.
+
+    :param path: Path of the snapshot file.
+    :param data_version: Version of the structure of the data, see 'read_snapshot'.
+    :param data: Data to store, must be picklable.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    with open(temp_path, 'wb') as file:
+        file.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION, data_version, time.time()))
+        pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+
+def read_snapshot(path: Path, data_version: int, max_age: float) -> Optional[Tuple[float, Any]]:
+    """
+    Read a snapshot file. The file is memory mapped, so the data is unpickled straight from the page cache.
+
+    :param path: Path of the snapshot file.
+    :param data_version: Expected version of the structure of the data. Snapshots of other versions are ignored.
+    :param max_age: Max number of seconds since the snapshot was written. Older snapshots are ignored.
+    :return: The time at which the snapshot was written and its data, or None if there is no usable snapshot.
+    """
+    try:
+        with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if len(mapped) < _HEADER.size:
+                raise ValueError("file is too short")
+            magic, format_version, snapshot_data_version, created = _HEADER.unpack_from(mapped)
+            if magic != _MAGIC or format_version != _FORMAT_VERSION or snapshot_data_version != data_version:
+                snapshot_logger.info(msg=f"Ignored snapshot {path} of another version")
+                return None
+            if time.time() - created > max_age:
+                snapshot_logger.info(msg=f"Ignored snapshot {path} which is too old")
+                return None
+            with memoryview(mapped) as view, view[_HEADER.size:] as payload:
+                return created, pickle.loads(payload)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+        snapshot_logger.warning(msg=f"Could not read snapshot {path}: {e}")
+        return None
+
+
+class Snapshotter:
+    """
+    Periodically writes the state of in-memory structures to a snapshot file, so a restarted worker can continue
+    from that state instead of rebuilding it from Congressus.
+
+    Every structure registers a function to get its state and a function to restore it. Structures call
+    'mark_changed' when their state changed, after which a snapshot is written within 'interval' seconds by a
+    background thread. A last snapshot is written when the worker exits.
+    """
+
+    def __init__(self, path: Path, data_version: int, interval: float, max_age: float):
+        """
+        :param path: Path of the snapshot file.
+        :param data_version: Version of the structure of the state, increase it when any state changes structure.
+        :param interval: Min number of seconds between two snapshots.
+        :param max_age: Max number of seconds since a snapshot was written to still restore it.
+        """
+        self.path = Path(path)
+        self.data_version = data_version
+        self.interval = interval
+        self.max_age = max_age
+        self._sources: dict[str, Tuple[Callable[[], Any], Callable[[Any, float], None]]] = dict()
+        self._changed = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        atexit.register(self.write_if_changed)
+
+    def register(self, name: str, get_state: Callable[[], Any], restore_state: Callable[[Any, float], None]) -> None:
+        """
+        Register a structure to include in the snapshots.
+
+        :param name: Unique name of the structure.
+        :param get_state: Function returning the picklable state of the structure.
+        :param restore_state: Function restoring the structure from a state and the number of seconds since the state
+            was written.
+        """
+        self._sources[name] = (get_state, restore_state)
+
+    def restore(self) -> bool:
+        """
+        Restore all registered structures from the snapshot file, if there is a usable one.
+
+        :return: Whether a snapshot was restored.
+        """
+        snapshot = read_snapshot(self.path, data_version=self.data_version, max_age=self.max_age)
+        if snapshot is None:
+            return False
+
+        created, states = snapshot
+        age = max(0.0, time.time() - created)
+        for name, state in states.items():
+            source = self._sources.get(name)
+            if source is None:  # Structure is not used anymore
+                continue
+            try:
+                source[1](state, age)
+            except Exception as e:  # A broken snapshot must never prevent the worker from starting
+                snapshot_logger.warning(msg=f"Could not restore {name} from snapshot {self.path}: {e}")
+        return True
+
+    def mark_changed(self) -> None:
+        """Note that the state of a structure changed, so a new snapshot is written soon."""
+        self._changed.set()
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='streeplijst_snapshot', daemon=True)
+                    self._thread.start()
+
+    def write_if_changed(self) -> None:
+        """Write a snapshot now if any state changed since the last snapshot."""
+        if not self._changed.is_set():
+            return
+        with self._lock:
+            self._changed.clear()
+            try:
+                states = {name: get_state() for name, (get_state, _) in self._sources.items()}
+                write_snapshot(self.path, data_version=self.data_version, data=states)
+            except Exception as e:  # Snapshots are an optimization, failing to write one must not break anything
+                snapshot_logger.warning(msg=f"Could not write snapshot {self.path}: {e}")
+
+    def _run(self) -> None:
+        while True:
+            self._changed.wait()
+            time.sleep(self.interval)  # Collect all changes in this interval into a single snapshot
+            self.write_if_changed()
@@ -0,0 +1,102 @@
+import json
+import os
+import re
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from streeplijst.congressus.config import STREEPLIJST_PARENT_FOLDER_ID, STREEPLIJST_FOLDER_CONFIGURATION
+
+TENANT_HEADER = 'X-Streeplijst-Tenant'  # Header with the name of the tenant a request is made for
+TENANT_KEY_HEADER = 'X-Streeplijst-Tenant-Key'  # Header with the API key of the tenant a request is made for
+DEFAULT_TENANT_NAME = 'default'  # Tenant used when a request does not name one, configured in config.py
+DEFAULT_API_TOKEN_ENV = 'CONGRESSUS_API_TOKEN'  # Environment variable with the Congressus token of the default tenant
+
+_TENANT_NAME_PATTERN = re.compile(r'^[a-z0-9_-]{1,64}$')  # Names are used in file names and cache namespaces
+
+
+class Tenant(NamedTuple):
+    """An association which uses this backend, with its own Congressus account and Streeplijst folders."""
+    name: str  # Name of the tenant, used in the tenant header
+    api_token_env: str  # Environment variable with the Congressus API token of the tenant
+    parent_folder_id: int  # Congressus ID of the product folder containing all Streeplijst folders
+    folder_configuration: list[dict]  # Streeplijst folders, formatted like STREEPLIJST_FOLDER_CONFIGURATION
+    webhook_secret: Optional[str]  # Secret to authenticate webhooks of the tenant, disabled if not set
+    api_key: Optional[str] = None  # Key which requests for the tenant must send, the tenant cannot be used if not set
+
+    @property
+    def api_token(self) -> Optional[str]:
+        return os.environ.get(self.api_token_env)
+
+
+def _default_tenant() -> Tenant:
+    """Returns the tenant configured in config.py and the environment, used for requests which do not name one."""
+    return Tenant(name=DEFAULT_TENANT_NAME, api_token_env=DEFAULT_API_TOKEN_ENV,
+                  parent_folder_id=STREEPLIJST_PARENT_FOLDER_ID,
+                  folder_configuration=STREEPLIJST_FOLDER_CONFIGURATION,
+                  webhook_secret=settings.WEBHOOK_SECRET)
+
+
+def _parse_tenant(config: dict) -> Tenant:
+    """
+    Create a tenant from an entry in the tenants file.
+
+    :param config: Entry in the tenants file, with the keys 'name', 'api_token_env', 'api_key_env', 'parent_folder_id',
+        'folders' and optionally 'webhook_secret_env'.
+    :raises ImproperlyConfigured: If the entry is incomplete.
+    """
+    try:
+        name = config['name']
+        webhook_secret_env = config.get('webhook_secret_env')
+        tenant = Tenant(name=name, api_token_env=config['api_token_env'],
+                        parent_folder_id=int(config['parent_folder_id']),
+                        folder_configuration=list(config['folders']),
+                        webhook_secret=os.environ.get(webhook_secret_env) if webhook_secret_env else None,
+                        api_key=os.environ.get(config['api_key_env']))
+    except (KeyError, TypeError, ValueError) as e:
+        raise ImproperlyConfigured(f"Invalid tenant in {settings.TENANTS_FILE}: {config!r} ({e!r})")
+    if not isinstance(name, str) or not _TENANT_NAME_PATTERN.match(name):
+        raise ImproperlyConfigured(f"Invalid tenant name in {settings.TENANTS_FILE}: {name!r}, use at most 64 "
+                                   f"lowercase letters, digits, '_' or '-'")
+    if any('id' not in folder for folder in tenant.folder_configuration):
+        raise ImproperlyConfigured(f"Tenant {name} in {settings.TENANTS_FILE} has a folder without an 'id'")
+    return tenant
+
+
+def load_tenants() -> dict[str, Tenant]:
+    """
+    Load all tenants. The default tenant always exists, other tenants are read from the JSON file in
+    settings.TENANTS_FILE if it is set, which contains a list of tenants like:
+
+        [{"name": "other", "api_token_env": "OTHER_CONGRESSUS_API_TOKEN", "api_key_env": "OTHER_STREEPLIJST_API_KEY",
+          "parent_folder_id": 1234, "folders": [{"name": "Chips", "id": 1235, "media": "<url>"}],
+          "webhook_secret_env": "OTHER_WEBHOOK_SECRET"}]
+
+    Tokens, keys and secrets are read from the environment, so they do not need to be stored in the file. Requests for
+    a tenant from the file must send its API key, see streeplijst.middleware.TenantMiddleware.
+
+    :return: All tenants by name.
+    :raises ImproperlyConfigured: If the tenants file cannot be read or contains an invalid tenant.
+    """
+    tenants = {DEFAULT_TENANT_NAME: _default_tenant()}
+    if not settings.TENANTS_FILE:
+        return tenants
+
+    try:
+        with open(settings.TENANTS_FILE) as tenants_file:
+            configs = json.load(tenants_file)
+    except (OSError, ValueError) as e:
+        raise ImproperlyConfigured(f"Could not read tenants file {settings.TENANTS_FILE}: {e}")
+    if not isinstance(configs, list):
+        raise ImproperlyConfigured(f"Tenants file {settings.TENANTS_FILE} must contain a list of tenants")
+
+    for config in configs:
+        tenant = _parse_tenant(config)
+        if tenant.name in tenants:
+            raise ImproperlyConfigured(f"Tenant {tenant.name} is configured more than once")
+        tenants[tenant.name] = tenant
+    return tenants
+
+
+TENANTS: dict[str, Tenant] = load_tenants()  # All tenants by name
@@ -0,0 +1,103 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+_timing_local = threading.local()  # Timing of the request handled by the current thread, if any
+
+
+class RequestTiming:
+    """
+    Breakdown of the time spent handling a single request: every call to Congressus (every page for paginated calls)
+    and the total time spent in each phase, like stripping data or logging.
+    """
+    MAX_LISTED_CALLS: int = 20  # Max number of separate Congressus calls to list in the Server-Timing header
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.phases: dict[str, float] = dict()  # Seconds spent in each phase
+        self.calls: list[tuple[str, Optional[int], float, int]] = []  # Endpoint, page, seconds and bytes of each call
+        self._lock = threading.Lock()  # Worker threads of the same request may add timings at the same time
+
+    def add(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+    def add_call(self, endpoint: str, page: Optional[int], seconds: float, size: int) -> None:
+        with self._lock:
+            self.calls.append((endpoint, page, seconds, size))
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start_time
+
+    def header_value(self, total: float) -> str:
+        """
+        Returns the value of a Server-Timing header with this breakdown.
+
+        :param total: Total number of seconds spent on the request.
+        """
+        calls_seconds = sum(call[2] for call in self.calls)
+        calls_bytes = sum(call[3] for call in self.calls)
+        metrics = [f'congressus;dur={calls_seconds * 1000:.1f};desc="{len(self.calls)} calls, {calls_bytes} bytes"']
+        for index, (endpoint, page, seconds, _) in enumerate(self.calls[:self.MAX_LISTED_CALLS], start=1):
+            page_str = f' page {page}' if page is not None else ''
+            metrics.append(f'congressus-{index};dur={seconds * 1000:.1f};desc="{endpoint}{page_str}"')
+        metrics.extend(f'{phase};dur={seconds * 1000:.1f}' for phase, seconds in self.phases.items())
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+    def log_str(self, total: float) -> str:
+        """
+        Returns a representation of this breakdown for the logs.
+
+        :param total: Total number of seconds spent on the request.
+        """
+        calls_seconds = sum(call[2] for call in self.calls)
+        calls_bytes = sum(call[3] for call in self.calls)
+        calls_str = ' '.join(f"{endpoint}{f' p{page}' if page is not None else ''}={seconds * 1000:.1f}ms"
+                             for endpoint, page, seconds, _ in self.calls)
+        phases_str = ' '.join(f'{phase}={seconds * 1000:.1f}ms' for phase, seconds in self.phases.items())
+        return f"Timing: total={total * 1000:.1f}ms congressus={calls_seconds * 1000:.1f}ms " \
+               f"({len(self.calls)} calls, {calls_bytes} bytes) {phases_str}" \
+               f"{f' | Calls: {calls_str}' if calls_str else ''}"
+
+
+def start() -> RequestTiming:
+    """Start timing the request handled by the current thread."""
+    timing = RequestTiming()
+    _timing_local.timing = timing
+    return timing
+
+
+def current() -> Optional[RequestTiming]:
+    """Returns the timing of the request handled by the current thread, if it is being timed."""
+    return getattr(_timing_local, 'timing', None)
+
+
+def join(timing: Optional[RequestTiming]) -> None:
+    """Add the timings of the current thread to the timing of a request, e.g. when it handles part of that request."""
+    _timing_local.timing = timing
+
+
+def stop() -> None:
+    """Stop timing the request handled by the current thread."""
+    _timing_local.timing = None
+
+
+@contextmanager
+def measure(phase: str) -> Iterator[None]:
+    """
+    Add the time spent in a block of code to a phase of the timing of the current request, if it is being timed.
+
+    :param phase: Name of the phase, e.g. 'strip'.
+    """
+    timing = current()
+    if timing is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(phase, time.perf_counter() - start_time)
@@ -10,10 +10,8 @@ def extract_keys(from_dict: dict[str, Any], keys: list[str], default: Any = 'err
     :param keys: List of keys to transfer
     :param default: Default value to transfer if a key cannot be found in from_dict (defaults to 'error')
     """
-    return_dict = dict()
-    for key in keys:
-        return_dict[key] = from_dict.get(key, default)
-    return return_dict
+    get = from_dict.get
+    return {key: get(key, default) for key in keys}
 
 
 @deprecated(reason="Replaced with specific functions in API base class")
@@ -0,0 +1,82 @@
+import hashlib
+import hmac
+from typing import Any, NamedTuple, Optional
+
+SIGNATURE_HEADER = 'X-Streeplijst-Signature'  # HMAC-SHA256 of the request body with the webhook secret, in hex
+TOKEN_HEADER = 'X-Streeplijst-Webhook-Token'  # The webhook secret itself, for senders which cannot sign requests
+
+# Names of the objects in Congressus events, e.g. 'product.updated'
+_PRODUCT_OBJECTS = {'product', 'product_offer'}
+_FOLDER_OBJECTS = {'product_folder', 'product-folder', 'folder'}
+_MEMBER_OBJECTS = {'member'}
+_SALE_OBJECTS = {'sale_invoice', 'sale-invoice', 'invoice'}
+
+
+class WebhookChanges(NamedTuple):
+    """Objects which changed according to a webhook notification."""
+    products: list[tuple[int, Optional[int]]]  # ID and, if known, folder ID of every changed product
+    folder_ids: list[int]  # IDs of changed product folders
+    members: list[tuple[int, Optional[str]]]  # ID and, if known, username of every changed member
+    sale_member_ids: list[int]  # IDs of the members of changed sale invoices
+
+
+def is_authentic(body: bytes, headers: dict[str, str], secret: Optional[str]) -> bool:
+    """
+    Returns whether a webhook notification was sent by someone who knows the webhook secret, either because it is
+    signed with the secret or because it contains the secret.
+
+    :param body: Raw body of the notification.
+    :param headers: Headers of the notification.
+    :param secret: Webhook secret, notifications are never authentic if it is not configured.
+    """
+    if not secret:
+        return False
+    signature = headers.get(SIGNATURE_HEADER)
+    if signature:
+        expected_signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(signature.removeprefix('sha256='), expected_signature)
+    token = headers.get(TOKEN_HEADER)
+    return token is not None and hmac.compare_digest(token.encode(), secret.encode())
+
+
+def parse_changes(data: Any) -> WebhookChanges:
+    """
+    Get the changed objects from a webhook notification. Two formats are supported:
+
+    - A Congressus event: {"event": "product.updated", "data": {"id": 1, "folder_id": 2, ...}}, where the event
+      starts with 'product', 'product_folder', 'member' or 'sale_invoice'. Other events are ignored. Events of sale
+      invoices must contain the 'member_id' of the invoice.
+    - A local format: {"products": [1], "folders": [2], "members": [3], "sale_members": [3]}, with the IDs of all
+      changed objects and the IDs of the members whose sale invoices changed.
+
+    :param data: Parsed body of the notification.
+    :raises ValueError: If the notification is in neither format.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Notification should be an object")
+
+    try:
+        if 'event' in data:  # Congressus event
+            object_name = str(data['event']).split('.', 1)[0]
+            changed = data.get('data') or {}
+            object_id = int(changed['id'])
+            if object_name in _PRODUCT_OBJECTS:
+                folder_id = changed.get('folder_id')
+                return WebhookChanges(products=[(object_id, int(folder_id) if folder_id is not None else None)],
+                                      folder_ids=[], members=[], sale_member_ids=[])
+            if object_name in _FOLDER_OBJECTS:
+                return WebhookChanges(products=[], folder_ids=[object_id], members=[], sale_member_ids=[])
+            if object_name in _MEMBER_OBJECTS:
+                return WebhookChanges(products=[], folder_ids=[], members=[(object_id, changed.get('username'))],
+                                      sale_member_ids=[])
+            if object_name in _SALE_OBJECTS:
+                return WebhookChanges(products=[], folder_ids=[], members=[],
+                                      sale_member_ids=[int(changed['member_id'])])
+            return WebhookChanges(products=[], folder_ids=[], members=[], sale_member_ids=[])
+
+        return WebhookChanges(products=[(int(product_id), None) for product_id in data.get('products', [])],
+                              folder_ids=[int(folder_id) for folder_id in data.get('folders', [])],
+                              members=[(int(member_id), None) for member_id in data.get('members', [])],
+                              sale_member_ids=[int(member_id) for member_id in data.get('sale_members', [])])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Notification does not contain valid IDs")
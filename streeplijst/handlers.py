@@ -0,0 +1,118 @@
+"""
+Request handlers which give the Streeplijst API its own, lean middleware stack.
+
+The JSON API is stateless, so it does not need the session, authentication, messages, CSRF and clickjacking
+middleware which the admin and frontend use. Requests to paths starting with settings.API_PATH_PREFIX are handled with
+the middleware in settings.API_MIDDLEWARE, all other requests with the full stack in settings.MIDDLEWARE.
+"""
+import logging
+
+import django
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.base import BaseHandler
+from django.core.handlers.exception import convert_exception_to_response
+from django.core.handlers.wsgi import WSGIHandler, get_path_info
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger('django.request')  # Unused middleware is logged like Django does
+
+
+class ApiMiddlewareMixin(BaseHandler):
+    """
+    Handler which loads the middleware in settings.API_MIDDLEWARE instead of settings.MIDDLEWARE. Django only loads
+    settings.MIDDLEWARE, so this is BaseHandler.load_middleware with the list of middleware replaced.
+    """
+
+    def load_middleware(self, is_async: bool = False) -> None:
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._exception_middleware = []
+
+        get_response = self._get_response_async if is_async else self._get_response
+        handler = convert_exception_to_response(get_response)
+        handler_is_async = is_async
+        for middleware_path in reversed(settings.API_MIDDLEWARE):
+            middleware = import_string(middleware_path)
+            middleware_can_sync = getattr(middleware, 'sync_capable', True)
+            middleware_can_async = getattr(middleware, 'async_capable', False)
+            if not middleware_can_sync and not middleware_can_async:
+                raise RuntimeError(f"Middleware {middleware_path} must have at least one of sync_capable/async_capable "
+                                   f"set to True.")
+            elif not handler_is_async and middleware_can_sync:
+                middleware_is_async = False
+            else:
+                middleware_is_async = middleware_can_async
+            try:
+                adapted_handler = self.adapt_method_mode(middleware_is_async, handler, handler_is_async,
+                                                         debug=settings.DEBUG, name=f"middleware {middleware_path}")
+                mw_instance = middleware(adapted_handler)
+            except MiddlewareNotUsed as e:
+                if settings.DEBUG:
+                    logger.debug("MiddlewareNotUsed(%r): %s", middleware_path, e)
+                continue
+            handler = adapted_handler
+
+            if mw_instance is None:
+                raise ImproperlyConfigured(f"Middleware factory {middleware_path} returned None.")
+
+            if hasattr(mw_instance, 'process_view'):
+                self._view_middleware.insert(0, self.adapt_method_mode(is_async, mw_instance.process_view))
+            if hasattr(mw_instance, 'process_template_response'):
+                self._template_response_middleware.append(
+                    self.adapt_method_mode(is_async, mw_instance.process_template_response))
+            if hasattr(mw_instance, 'process_exception'):  # Exception middleware is always synchronous
+                self._exception_middleware.append(self.adapt_method_mode(False, mw_instance.process_exception))
+
+            handler = convert_exception_to_response(mw_instance)
+            handler_is_async = middleware_is_async
+
+        # Assigned last, since Django uses it as a flag that the middleware is loaded
+        self._middleware_chain = self.adapt_method_mode(is_async, handler, handler_is_async)
+
+
+class ApiWSGIHandler(ApiMiddlewareMixin, WSGIHandler):
+    """WSGI handler with the API middleware."""
+
+
+class ApiASGIHandler(ApiMiddlewareMixin, ASGIHandler):
+    """ASGI handler with the API middleware."""
+
+
+class StreeplijstWSGIHandler:
+    """WSGI application which handles requests to the API with the API middleware, and all other requests as usual."""
+
+    def __init__(self):
+        self.api_handler = ApiWSGIHandler()
+        self.default_handler = WSGIHandler()
+
+    def __call__(self, environ, start_response):
+        if get_path_info(environ).startswith(settings.API_PATH_PREFIX):
+            return self.api_handler(environ, start_response)
+        return self.default_handler(environ, start_response)
+
+
+class StreeplijstASGIHandler:
+    """ASGI application which handles requests to the API with the API middleware, and all other requests as usual."""
+
+    def __init__(self):
+        self.api_handler = ApiASGIHandler()
+        self.default_handler = ASGIHandler()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'].startswith(settings.API_PATH_PREFIX):
+            return await self.api_handler(scope, receive, send)
+        return await self.default_handler(scope, receive, send)
+
+
+def get_wsgi_application() -> StreeplijstWSGIHandler:
+    """Set up Django and return the WSGI application, like django.core.wsgi.get_wsgi_application."""
+    django.setup(set_prefix=False)
+    return StreeplijstWSGIHandler()
+
+
+def get_asgi_application() -> StreeplijstASGIHandler:
+    """Set up Django and return the ASGI application, like django.core.asgi.get_asgi_application."""
+    django.setup(set_prefix=False)
+    return StreeplijstASGIHandler()
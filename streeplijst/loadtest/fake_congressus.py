@@ -0,0 +1,260 @@
+"""
+Fake Congressus API server for load tests.
+
+Serves the endpoints of Congressus API v30 which are used by the Streeplijst application, with generated members,
+products and sales and a configurable latency. Every call is counted, the counts are available at '/_stats' so the
+load generator can compute how many calls to Congressus each local request causes.
+
+Start the fake server, and start the Streeplijst application with CONGRESSUS_API_URL pointing to it:
+
+    python -m streeplijst.loadtest.fake_congressus --port 8001
+    CONGRESSUS_API_URL=http://127.0.0.1:8001 CONGRESSUS_API_TOKEN=fake python manage.py runserver 8000
+"""
+import argparse
+import datetime
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from streeplijst.congressus.config import STREEPLIJST_FOLDER_CONFIGURATION, STREEPLIJST_PARENT_FOLDER_ID
+from streeplijst.congressus.latency import endpoint_key
+
+API_PREFIX = '/v30'
+DEFAULT_PAGE_SIZE = 25
+PRODUCTS_PER_FOLDER = 15
+PRODUCT_NAMES = ['Paprika', 'Naturel', 'Cola', 'Tomatensoep', 'Erwtensoep', 'Appel', 'Banaan', 'Pizza', 'Ijsje', 'Drop',
+                 'Winegums', 'Stroopwafel', 'Koekje', 'Mars', 'Snickers', 'Twix', 'Bounty', 'Noten', 'Chocomel', 'Ice tea']
+FIRST_NAMES = ['Anna', 'Bram', 'Chris', 'Daan', 'Eva', 'Fleur', 'Gijs', 'Hanna', 'Ivo', 'Julia', 'Koen', 'Lotte', 'Milan',
+               'Noor', 'Olaf', 'Puck', 'Ruben', 'Sanne', 'Tim', 'Vera']
+LAST_NAMES = ['de Vries', 'Jansen', 'Bakker', 'Visser', 'Smit', 'Meijer', 'de Boer', 'Mulder', 'de Groot', 'Bos']
+
+
+def username_of(index: int) -> str:
+    """Returns the username of the generated member with an index, shared with the load generator."""
+    return f's{2000000 + index}'
+
+
+class FakeCongressusData:
+    """Generated members, products and sales, which can be changed by the requests to the fake server."""
+
+    def __init__(self, members: int, sales_per_member: int, seed: int = 0):
+        rng = random.Random(seed)
+        self.members = [{
+            'id': 10000 + index,
+            'username': username_of(index),
+            'first_name': rng.choice(FIRST_NAMES),
+            'last_name': rng.choice(LAST_NAMES),
+            'prefix': None,
+            'suffix': None,
+            'date_of_birth': '2000-01-01',
+            'show_almanac': True,
+            'status': {'member_from': '2020-09-01', 'member_to': None, 'name': 'Lid'},
+            'bank_account': {'iban': 'NL00FAKE0000000000', 'has_sdd_mandate': True},
+            'email': f'{username_of(index)}@example.com',  # Details which are stripped by the application
+            'address': 'Drienerlolaan 5',
+        } for index in range(members)]
+        self.members_by_id = {member['id']: member for member in self.members}
+
+        self.folders = [{'id': folder['id'], 'name': folder['name'], 'parent_id': STREEPLIJST_PARENT_FOLDER_ID}
+                        for folder in STREEPLIJST_FOLDER_CONFIGURATION]
+        self.products: dict[int, list[dict[str, Any]]] = dict()
+        product_id = 5000
+        for folder in self.folders:
+            self.products[folder['id']] = []
+            for _ in range(PRODUCTS_PER_FOLDER):
+                product_id += 1
+                self.products[folder['id']].append({
+                    'id': product_id,
+                    'product_offer_id': 100000 + product_id,
+                    'folder_id': folder['id'],
+                    'name': f"{rng.choice(PRODUCT_NAMES)} {product_id}",
+                    'description': f"{folder['name']} product",
+                    'published': True,
+                    'price': round(rng.uniform(0.3, 2.5), 2),
+                    'media': [{'url': f'https://example.com/{product_id}.png', 'url_md': ''}],
+                    'offers': [],
+                })
+        self.products_by_offer_id = {product['product_offer_id']: product
+                                     for products in self.products.values() for product in products}
+
+        self.sales: dict[int, list[dict[str, Any]]] = {member['id']: [] for member in self.members}  # Newest first
+        self.next_invoice_id = 1
+        offers = list(self.products_by_offer_id)
+        for member in self.members:
+            for _ in range(sales_per_member):
+                items = [{'product_offer_id': rng.choice(offers), 'quantity': rng.randint(1, 3)}
+                         for _ in range(rng.randint(1, 3))]
+                self.create_sale(member_id=member['id'], items=items,
+                                 date=datetime.date.today() - datetime.timedelta(days=rng.randint(0, 300)))
+        self.lock = threading.Lock()
+
+    def create_sale(self, member_id: int, items: list[dict[str, Any]], date: datetime.date = None) -> dict[str, Any]:
+        date = date or datetime.date.today()
+        invoice_id = self.next_invoice_id
+        self.next_invoice_id += 1
+        invoice_items = []
+        for item in items:
+            product = self.products_by_offer_id.get(item['product_offer_id'])
+            price = product['price'] if product else 1.0
+            invoice_items.append({'name': product['name'] if product else 'Unknown', 'price': price,
+                                  'product_offer_id': item['product_offer_id'], 'quantity': item['quantity'],
+                                  'total_price': price * item['quantity'], 'sale_invoice_id': invoice_id,
+                                  'vat_percentage': 9})
+        total = round(sum(item['total_price'] for item in invoice_items), 2)
+        sale = {'id': invoice_id, 'member_id': member_id, 'items': invoice_items, 'price_paid': 0,
+                'price_unpaid': total, 'invoice_date': date.isoformat(), 'invoice_source': 'api',
+                'invoice_status': 'unpaid', 'invoice_type': 'webshop', 'created': f'{date.isoformat()}T12:00:00',
+                'modified': f'{date.isoformat()}T12:00:00', 'reference': f'F{invoice_id:08d}'}
+        self.sales.setdefault(member_id, []).insert(0, sale)
+        return sale
+
+
+def paginate(items: list, query: dict[str, list[str]]) -> dict[str, Any]:
+    page = int(query.get('page', ['1'])[0])
+    page_size = int(query.get('page_size', [str(DEFAULT_PAGE_SIZE)])[0])
+    return {'data': items[(page - 1) * page_size:page * page_size], 'has_next': page * page_size < len(items),
+            'has_prev': page > 1, 'next_num': page + 1, 'page': page, 'per_page': page_size, 'total': len(items)}
+
+
+class FakeCongressusHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep connections alive like Congressus does
+    server: 'FakeCongressusServer'
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass  # Logging every call would slow down the server more than the load test
+
+    def do_GET(self) -> None:
+        self._handle('GET')
+
+    def do_POST(self) -> None:
+        self._handle('POST')
+
+    def _handle(self, method: str) -> None:
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+
+        if url.path.startswith('/_stats'):  # Statistics of the fake server, not counted and without latency
+            self._send(200, self.server.stats(reset=method == 'POST'))
+            return
+
+        time.sleep(self.server.sample_latency())
+        if not url.path.startswith(API_PREFIX):
+            status, data = 404, {'error': 'Not found'}
+        else:
+            status, data = self._route(method, url.path[len(API_PREFIX):], query, body)
+        self.server.count(endpoint_key(method, url.path[len(API_PREFIX):]), self._send(status, data))
+
+    def _route(self, method: str, path: str, query: dict[str, list[str]], body: Any) -> Tuple[int, Any]:
+        data = self.server.data
+        parts = path.strip('/').split('/')
+        with data.lock:
+            if method == 'GET' and parts == ['members', 'search']:
+                term = query.get('term', [''])[0].lower()
+                members = [member for member in data.members
+                           if term in member['username'] or term in member['first_name'].lower()]
+                return 200, paginate(members, query)
+            if method == 'GET' and len(parts) == 2 and parts[0] == 'members' and parts[1].isdigit():
+                member = data.members_by_id.get(int(parts[1]))
+                return (200, member) if member else (404, {'error': 'Member not found'})
+            if method == 'GET' and parts == ['product-folders']:
+                return 200, paginate(data.folders, query)
+            if method == 'GET' and parts == ['products']:
+                folder_id = int(query.get('folder_id', ['0'])[0])
+                return 200, paginate(data.products.get(folder_id, []), query)
+            if method == 'GET' and parts == ['sale-invoices']:
+                member_ids = [int(member_id) for member_id in query.get('member_id', [])]
+                period_filter = query.get('period_filter', [''])[0]
+                sales = [sale for member_id in member_ids for sale in data.sales.get(member_id, [])
+                         if sale['invoice_date'] >= period_filter]
+                return 200, paginate(sales, query)
+            if method == 'POST' and parts == ['sale-invoices']:
+                if not body or body.get('member_id') not in data.members_by_id:
+                    return 400, {'error': 'Invalid member_id'}
+                return 201, data.create_sale(member_id=body['member_id'], items=body.get('items', []))
+            if method == 'POST' and len(parts) == 3 and parts[0] == 'sale-invoices' and parts[2] == 'send':
+                return 200, {}
+        return 404, {'error': 'Not found'}
+
+    def _send(self, status: int, data: Any) -> int:
+        content = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+        return len(content)
+
+
+class FakeCongressusServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], data: FakeCongressusData, latency: float, jitter: float,
+                 seed: Optional[int] = None):
+        """
+        :param address: Host and port to listen on.
+        :param data: Data to serve.
+        :param latency: Median latency of every call in seconds.
+        :param jitter: Spread of the latency, as the sigma of a log-normal distribution around the median.
+        :param seed: Optional seed for the latency samples.
+        """
+        super().__init__(address, FakeCongressusHandler)
+        self.data = data
+        self.latency = latency
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self._calls: Counter = Counter()
+        self._bytes = 0
+        self._stats_lock = threading.Lock()
+
+    def sample_latency(self) -> float:
+        if self.latency <= 0:
+            return 0
+        with self._stats_lock:
+            return self._rng.lognormvariate(0, self.jitter) * self.latency
+
+    def count(self, endpoint: str, content_length: int) -> None:
+        with self._stats_lock:
+            self._calls[endpoint] += 1
+            self._bytes += content_length
+
+    def stats(self, reset: bool = False) -> dict[str, Any]:
+        with self._stats_lock:
+            stats = {'calls': sum(self._calls.values()), 'bytes': self._bytes, 'endpoints': dict(self._calls)}
+            if reset:
+                self._calls.clear()
+                self._bytes = 0
+        return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a fake Congressus API server for load tests.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--members', type=int, default=2000, help="Number of generated members")
+    parser.add_argument('--sales-per-member', type=int, default=10, help="Number of generated sales per member")
+    parser.add_argument('--latency-ms', type=float, default=80, help="Median latency of every call")
+    parser.add_argument('--jitter', type=float, default=0.5, help="Sigma of the log-normal latency distribution")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    data = FakeCongressusData(members=args.members, sales_per_member=args.sales_per_member, seed=args.seed)
+    server = FakeCongressusServer((args.host, args.port), data=data, latency=args.latency_ms / 1000,
+                                  jitter=args.jitter, seed=args.seed)
+    print(f"Fake Congressus serving {args.members} members on http://{args.host}:{args.port}{API_PREFIX}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
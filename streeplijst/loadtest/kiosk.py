@@ -0,0 +1,365 @@
+"""
+Load generator which models kiosk sessions at the Streeplijst.
+
+Every session is a member at a kiosk: they type their username (autocompleted while typing), log in, browse some
+folders, buy some products and sometimes look at their sales history, with think times in between. Sessions arrive
+following a rush hour curve: arrivals build up to a peak halfway through the test and calm down afterwards.
+
+Run the application against the fake Congressus server (see 'fake_congressus') and start the load generator:
+
+    python -m streeplijst.loadtest.kiosk --url http://127.0.0.1:8000/streeplijst/v30 \
+        --congressus-url http://127.0.0.1:8001 --duration 120 --peak-rate 5
+
+The report contains the throughput, latency percentiles per kind of request and the upstream call amplification:
+the number of calls to Congressus per local request.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from collections import Counter, defaultdict
+from typing import Any, Optional, Tuple
+from urllib.parse import urlencode, urlparse
+
+from streeplijst.congressus.config import STREEPLIJST_FOLDER_CONFIGURATION
+from streeplijst.loadtest.fake_congressus import username_of
+
+
+class HttpConnection:
+    """Minimal HTTP/1.1 client connection with keep-alive, so the load generator needs no extra packages."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, body: Any = None,
+                      headers: dict[str, str] = None) -> Tuple[int, bytes]:
+        """
+        Make a request, opening a new connection if there is none or the previous one was closed.
+
+        :return: The status code and the body of the response.
+        """
+        content = b'' if body is None else json.dumps(body).encode()
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}', f'Content-Length: {len(content)}',
+                 'Connection: keep-alive']
+        if body is not None:
+            lines.append('Content-Type: application/json')
+        lines.extend(f'{name}: {value}' for name, value in (headers or {}).items())
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode() + content
+
+        for attempt in range(2):  # A kept alive connection may have been closed by the server in the meantime
+            if self._writer is None:
+                self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                self._writer.write(request)
+                await self._writer.drain()
+                return await self._read_response()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()
+                if attempt == 1:
+                    raise
+
+    async def _read_response(self) -> Tuple[int, bytes]:
+        status_line = await self._reader.readuntil(b'\r\n')
+        status = int(status_line.split()[1])
+        headers = dict()
+        while True:
+            line = await self._reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if 'content-length' in headers:
+            body = await self._reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                size = int((await self._reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                chunk = await self._reader.readexactly(size + 2)  # Every chunk ends with \r\n
+                if size == 0:
+                    break
+                body += chunk[:-2]
+        else:  # The body ends when the connection is closed
+            body = await self._reader.read()
+            headers['connection'] = 'close'
+
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, body
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+
+class Metrics:
+    """Latencies and status codes of all requests, grouped by the kind of request."""
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, Counter] = defaultdict(Counter)
+        self.errors: Counter = Counter()
+        self.sessions_started = 0
+        self.sessions_completed = 0
+
+    def record(self, kind: str, seconds: float, status: int) -> None:
+        self.latencies[kind].append(seconds)
+        self.statuses[kind][status] += 1
+
+    @property
+    def requests(self) -> int:
+        return sum(len(latencies) for latencies in self.latencies.values())
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return math.nan
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class KioskSession:
+    """A single member using a kiosk, from typing their username to buying their products."""
+
+    def __init__(self, client: 'KioskLoadGenerator', rng: random.Random):
+        self.client = client
+        self.rng = rng
+        self.connection = HttpConnection(client.host, client.port)
+
+    async def think(self, mean: float) -> None:
+        await asyncio.sleep(self.rng.expovariate(1 / mean) * self.client.think_scale if mean > 0 else 0)
+
+    async def get(self, kind: str, path: str, params: dict[str, Any] = None) -> Tuple[int, Any]:
+        return await self.request(kind, 'GET', path + ('?' + urlencode(params) if params else ''))
+
+    async def request(self, kind: str, method: str, path: str, body: Any = None,
+                      headers: dict[str, str] = None) -> Tuple[int, Any]:
+        start_time = time.perf_counter()
+        try:
+            status, content = await self.connection.request(method, self.client.base_path + path, body=body,
+                                                            headers=headers)
+        except (OSError, asyncio.IncompleteReadError) as e:
+            self.client.metrics.errors[f'{kind}: {type(e).__name__}'] += 1
+            self.connection.close()
+            return 0, None
+        self.client.metrics.record(kind, time.perf_counter() - start_time, status)
+        try:
+            return status, json.loads(content) if content else None
+        except ValueError:
+            return status, None
+
+    async def run(self) -> None:
+        metrics = self.client.metrics
+        metrics.sessions_started += 1
+        try:
+            # Type the username, autocompleting while typing
+            username = username_of(self.client.pick_member(self.rng))
+            for length in range(3, len(username) + 1):
+                await self.think(0.25)
+                if self.rng.random() < self.client.autocomplete_probability:
+                    await self.get('members/autocomplete', '/members/autocomplete', {'q': username[:length]})
+
+            # Log in and show the folders
+            status, member = await self.get('members/username', f'/members/username/{username}')
+            if status != 200:
+                return
+            await self.get('folders', '/folders')
+
+            # Browse some folders and pick products
+            cart = Counter()
+            for _ in range(self.rng.randint(1, 3)):
+                await self.think(2)
+                folder = self.rng.choice(STREEPLIJST_FOLDER_CONFIGURATION)
+                status, products = await self.get('products/folder', f"/products/folder/{folder['id']}")
+                if status == 200 and products:
+                    for _ in range(self.rng.randint(0, 2)):
+                        cart[self.rng.choice(products)['product_offer_id']] += 1
+
+            # Buy the products
+            if cart:
+                await self.think(1.5)
+                items = [{'product_offer_id': offer_id, 'quantity': quantity} for offer_id, quantity in cart.items()]
+                await self.request('POST sales', 'POST', '/sales', body={'member_id': member['id'], 'items': items},
+                                   headers={'Idempotency-Key': str(uuid.UUID(int=self.rng.getrandbits(128)))})
+
+            # Sometimes look at the sales history
+            if self.rng.random() < self.client.history_probability:
+                await self.think(3)
+                await self.get('sales', f'/sales/{username}')
+            metrics.sessions_completed += 1
+        finally:
+            self.connection.close()
+
+
+class KioskLoadGenerator:
+    """Starts kiosk sessions following a rush hour arrival curve and collects their metrics."""
+
+    def __init__(self, url: str, congressus_url: Optional[str], duration: float, base_rate: float, peak_rate: float,
+                 members: int, kiosks: int, think_scale: float, autocomplete_probability: float,
+                 history_probability: float, seed: int):
+        parsed_url = urlparse(url)
+        self.host = parsed_url.hostname
+        self.port = parsed_url.port or 80
+        self.base_path = parsed_url.path.rstrip('/')
+        self.congressus_url = congressus_url
+        self.duration = duration
+        self.base_rate = base_rate
+        self.peak_rate = peak_rate
+        self.members = members
+        self.kiosks = kiosks
+        self.think_scale = think_scale
+        self.autocomplete_probability = autocomplete_probability
+        self.history_probability = history_probability
+        self.rng = random.Random(seed)
+        self.metrics = Metrics()
+
+    def arrival_rate(self, t: float) -> float:
+        """Sessions per second at t seconds since the start: a peak halfway through the test on top of a base rate."""
+        peak_time, peak_width = self.duration / 2, self.duration / 6
+        return self.base_rate + (self.peak_rate - self.base_rate) * math.exp(-((t - peak_time) / peak_width) ** 2 / 2)
+
+    def pick_member(self, rng: random.Random) -> int:
+        """Pick a member, some members visit the kiosk much more often than others."""
+        return int(self.members * rng.random() ** 2)
+
+    async def congressus_stats(self, reset: bool = False) -> Optional[dict[str, Any]]:
+        if not self.congressus_url:
+            return None
+        parsed_url = urlparse(self.congressus_url)
+        connection = HttpConnection(parsed_url.hostname, parsed_url.port or 80)
+        try:
+            status, content = await connection.request('POST' if reset else 'GET', '/_stats')
+            return json.loads(content)
+        finally:
+            connection.close()
+
+    async def run(self) -> dict[str, Any]:
+        await self.congressus_stats(reset=True)
+        kiosk_semaphore = asyncio.Semaphore(self.kiosks) if self.kiosks > 0 else None
+
+        async def run_session(session: KioskSession) -> None:
+            if kiosk_semaphore is None:
+                await session.run()
+            else:
+                async with kiosk_semaphore:  # Wait until a kiosk is free
+                    await session.run()
+
+        # Sessions arrive as a Poisson process with a rate changing over time, generated by thinning
+        max_rate = max(self.base_rate, self.peak_rate)
+        sessions = []
+        start_time = time.perf_counter()
+        t = 0.0
+        while max_rate > 0:
+            t += self.rng.expovariate(max_rate)
+            if t >= self.duration:
+                break
+            if self.rng.random() * max_rate > self.arrival_rate(t):
+                continue
+            await asyncio.sleep(max(0.0, start_time + t - time.perf_counter()))
+            session = KioskSession(self, random.Random(self.rng.getrandbits(64)))
+            sessions.append(asyncio.create_task(run_session(session)))
+        await asyncio.gather(*sessions)
+        elapsed = time.perf_counter() - start_time
+
+        return self.report(elapsed=elapsed, congressus=await self.congressus_stats())
+
+    def report(self, elapsed: float, congressus: Optional[dict[str, Any]]) -> dict[str, Any]:
+        return {
+            'sessions_started': self.metrics.sessions_started,
+            'sessions_completed': self.metrics.sessions_completed,
+            **metrics_report(self.metrics, elapsed=elapsed, congressus=congressus),
+        }
+
+
+def metrics_report(metrics: Metrics, elapsed: float, congressus: Optional[dict[str, Any]]) -> dict[str, Any]:
+    """Summarize the metrics of a load test, with the stats of the fake Congressus server if they are given."""
+    report = {
+        'elapsed': elapsed,
+        'requests': metrics.requests,
+        'throughput': metrics.requests / elapsed if elapsed else 0,
+        'errors': dict(metrics.errors),
+        'kinds': dict(),
+    }
+    all_latencies = []
+    for kind, latencies in sorted(metrics.latencies.items()):
+        all_latencies.extend(latencies)
+        latencies = sorted(latencies)
+        report['kinds'][kind] = {
+            'requests': len(latencies),
+            'p50': percentile(latencies, 0.50), 'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99), 'max': latencies[-1],
+            'statuses': dict(metrics.statuses[kind]),
+        }
+    all_latencies.sort()
+    report['p50'], report['p95'], report['p99'] = (percentile(all_latencies, fraction)
+                                                   for fraction in (0.50, 0.95, 0.99))
+    if congressus is not None:
+        report['congressus'] = congressus
+        report['amplification'] = congressus['calls'] / metrics.requests if metrics.requests else 0
+    return report
+
+
+def print_report(report: dict[str, Any]) -> None:
+    if 'sessions_started' in report:
+        print(f"Sessions: {report['sessions_completed']}/{report['sessions_started']} completed "
+              f"in {report['elapsed']:.1f} s")
+    print(f"Requests: {report['requests']} ({report['throughput']:.1f} per second), "
+          f"p50 {report['p50'] * 1000:.0f} ms, p95 {report['p95'] * 1000:.0f} ms, p99 {report['p99'] * 1000:.0f} ms")
+    print()
+    width = max([22] + [len(kind) for kind in report['kinds']])
+    print(f"{'Request':<{width}} {'Count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}  Statuses")
+    for kind, stats in report['kinds'].items():
+        statuses = ', '.join(f'{status}: {count}' for status, count in sorted(stats['statuses'].items()))
+        print(f"{kind:<{width}} {stats['requests']:>7} {stats['p50'] * 1000:>8.0f} {stats['p95'] * 1000:>8.0f} "
+              f"{stats['p99'] * 1000:>8.0f} {stats['max'] * 1000:>8.0f}  {statuses}")
+    if report['errors']:
+        print()
+        for error, count in report['errors'].items():
+            print(f"Error {error}: {count}")
+    if 'congressus' in report:
+        congressus = report['congressus']
+        print()
+        print(f"Congressus calls: {congressus['calls']} ({congressus['bytes'] / 1024:.0f} KB), "
+              f"amplification {report['amplification']:.2f} calls per local request")
+        for endpoint, count in sorted(congressus['endpoints'].items(), key=lambda item: -item[1]):
+            print(f"  {endpoint:<40} {count:>7}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate load on the Streeplijst API modelled on kiosk sessions.")
+    parser.add_argument('--url', default='http://127.0.0.1:8000/streeplijst/v30', help="Base URL of the local API")
+    parser.add_argument('--congressus-url', default='http://127.0.0.1:8001',
+                        help="Base URL of the fake Congressus server, to count upstream calls (empty to skip)")
+    parser.add_argument('--duration', type=float, default=60, help="Seconds during which sessions arrive")
+    parser.add_argument('--base-rate', type=float, default=0.2, help="Sessions per second outside the rush hour")
+    parser.add_argument('--peak-rate', type=float, default=2, help="Sessions per second at the peak of the rush hour")
+    parser.add_argument('--members', type=int, default=2000, help="Number of members of the fake Congressus server")
+    parser.add_argument('--kiosks', type=int, default=0, help="Number of kiosks, 0 for no limit on sessions at once")
+    parser.add_argument('--think-scale', type=float, default=1, help="Factor for all think times, 0 to skip them")
+    parser.add_argument('--autocomplete', type=float, default=0.5,
+                        help="Probability of an autocomplete request per typed character")
+    parser.add_argument('--history', type=float, default=0.3, help="Probability of viewing the sales history")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args()
+
+    generator = KioskLoadGenerator(url=args.url, congressus_url=args.congressus_url or None, duration=args.duration,
+                                   base_rate=args.base_rate, peak_rate=args.peak_rate, members=args.members,
+                                   kiosks=args.kiosks, think_scale=args.think_scale,
+                                   autocomplete_probability=args.autocomplete, history_probability=args.history,
+                                   seed=args.seed)
+    report = asyncio.run(generator.run())
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
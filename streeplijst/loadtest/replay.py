@@ -0,0 +1,314 @@
+"""
+Replays the traffic recorded in the request logs against a test instance of the Streeplijst application.
+
+Every local request is logged in 'logs/requests.log' by all API functions it calls, with the same request ID. The
+lines of a request ID are grouped into a single request, which is sent at the time it arrived (the time of its log
+line minus the time it took), so the replay has the same arrival pattern as the recorded traffic. The bodies of
+posted sales and member batches are rebuilt from the logged function arguments. Webhooks cannot be replayed since
+their signature is not logged.
+
+Run the test instance against the fake Congressus server (see 'fake_congressus'), and replay a rush hour twice as
+fast:
+
+    python -m streeplijst.loadtest.replay logs/requests.log.2026-10-16 --url http://127.0.0.1:8000 \
+        --congressus-url http://127.0.0.1:8001 --start "2026-10-16 15:00" --end "2026-10-16 18:00" --speed 2
+
+The fake Congressus server only knows its own generated members and products, so requests for recorded members and
+products which it does not generate return 404. The report has the same format as the report of the load generator.
+"""
+import argparse
+import ast
+import asyncio
+import json
+import re
+import time
+from datetime import datetime as DateTime, timedelta as TimeDelta
+from typing import Any, Iterable, NamedTuple, Optional, Tuple
+from urllib.parse import urlparse
+
+from streeplijst.loadtest.kiosk import HttpConnection, Metrics, metrics_report, percentile, print_report
+
+# Line of a local request in the request log, see the 'verbose_request' formatter in settings.py and
+# streeplijst.congressus.logging.log_local_request_response. Older logs do not contain milliseconds.
+LOCAL_REQUEST_LINE = re.compile(r"^\w+\s+(?P<time>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})(?:\.(?P<msecs>\d{3}))?\s+"
+                                r"\S+\s+api\.local\s+(?P<request_id>\S+)\s+"
+                                r"Response: (?P<status>\d+)(?: \(elapsed: (?P<elapsed>[^)]+)\))? \| "
+                                r"Request: '(?P<method>[A-Z]+) (?P<path>[^']*)' "
+                                r"function: (?P<function>\w+)\((?P<args>.*)\)$")
+REQUEST_ID_MAX_GAP = TimeDelta(minutes=5)  # Lines with the same request ID further apart belong to different requests
+BODY_FUNCTIONS = ('post_sale', 'post_sales_bulk', 'get_members_by_usernames')  # Functions whose body can be rebuilt
+
+
+class LoggedLine(NamedTuple):
+    """A single line of a local request in the request log."""
+    request_id: str
+    arrival: DateTime  # Time at which the logged function was called
+    elapsed: float  # Seconds the logged function took
+    status: int
+    method: str
+    path: str  # Full path, including the query
+    function: str
+    args: str  # Logged arguments of the function
+
+
+class LoggedRequest(NamedTuple):
+    """A local request rebuilt from all lines with its request ID."""
+    request_id: str
+    arrival: DateTime  # Time at which the request arrived
+    method: str
+    path: str  # Full path, including the query
+    function: str  # Outermost API function called by the request, used to group requests in the report
+    status: int  # Status code of the recorded response
+    body: Any  # Rebuilt JSON body, or None if the request has no body
+    idempotency_key: Optional[str]  # Idempotency key of a posted sale, if it had one
+
+
+def _parse_elapsed(elapsed: Optional[str]) -> float:
+    """Parse an elapsed time logged as 'H:MM:SS.ffffff' into seconds."""
+    if not elapsed:
+        return 0.0
+    hours, minutes, seconds = elapsed.split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def parse_line(line: str) -> Optional[LoggedLine]:
+    """Parse a line of the request log, returns None if it is not the line of a local request."""
+    match = LOCAL_REQUEST_LINE.match(line.rstrip('\n'))
+    if match is None:
+        return None
+    end_time = DateTime.strptime(match['time'], '%Y-%m-%d %H:%M:%S')
+    if match['msecs']:
+        end_time += TimeDelta(milliseconds=int(match['msecs']))
+    elapsed = _parse_elapsed(match['elapsed'])
+    return LoggedLine(request_id=match['request_id'], arrival=end_time - TimeDelta(seconds=elapsed), elapsed=elapsed,
+                      status=int(match['status']), method=match['method'], path=match['path'],
+                      function=match['function'], args=match['args'])
+
+
+def _split_args(args: str) -> list[str]:
+    """Split logged arguments at the commas which are not inside brackets or quotes."""
+    parts = []
+    depth = 0
+    quoted = False
+    start = 0
+    for index, char in enumerate(args):
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char in '([{':
+            depth += 1
+        elif not quoted and char in ')]}':
+            depth -= 1
+        elif not quoted and depth == 0 and char == ',':
+            parts.append(args[start:index])
+            start = index + 1
+    parts.append(args[start:])
+    return [part for part in parts if part]
+
+
+def parse_args(args: str) -> dict[str, Any]:
+    """
+    Parse the logged keyword arguments of a function. Values are logged as their str() with single quotes replaced by
+    double quotes, which are Python literals except for strings, e.g. usernames and idempotency keys.
+
+    :raises ValueError: If the arguments cannot be parsed.
+    """
+    parsed = dict()
+    for part in _split_args(args):
+        name, separator, value = part.partition('=')
+        if not separator or not name.isidentifier():
+            raise ValueError(f"Cannot parse arguments {args!r}")
+        try:
+            parsed[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):  # A string, logged without quotes
+            parsed[name] = value
+    return parsed
+
+
+def _request_body(line: LoggedLine) -> Any:
+    """
+    Rebuild the JSON body of a request from the logged arguments of one of its functions.
+
+    :raises ValueError: If the body cannot be rebuilt.
+    """
+    if line.function not in BODY_FUNCTIONS:
+        raise ValueError(f"Cannot rebuild the body of {line.method} {line.path} from {line.function}")
+    args = parse_args(line.args)
+    if line.function == 'post_sale':
+        return {'member_id': args['member_id'], 'items': args['items']}
+    if line.function == 'post_sales_bulk':
+        return {'sales': args['sales']}
+    return {'usernames': args['usernames']}
+
+
+def group_requests(lines: Iterable[LoggedLine]) -> Tuple[list[LoggedRequest], int]:
+    """
+    Group the logged lines by request ID into requests.
+
+    :param lines: Logged lines, in the order in which they were logged.
+    :return: The requests ordered by arrival, and the number of requests which cannot be replayed.
+    """
+    groups: dict[str, list[LoggedLine]] = dict()  # Lines of the requests whose lines are still being read
+    finished_groups = []
+    for line in lines:
+        group = groups.get(line.request_id)
+        if group is not None and line.arrival - group[-1].arrival > REQUEST_ID_MAX_GAP:  # Request ID was reused
+            finished_groups.append(groups.pop(line.request_id))
+        groups.setdefault(line.request_id, []).append(line)
+    finished_groups.extend(groups.values())
+
+    requests = []
+    skipped = 0
+    for group in finished_groups:
+        outermost = max(group, key=lambda line: line.elapsed)  # Nested functions finish within the outermost one
+        body = None
+        idempotency_key = None
+        if outermost.method != 'GET':  # E.g. a bulk sale also logs every single sale, use the bulk sale itself
+            try:
+                body = _request_body(outermost)
+                if outermost.function == 'post_sale':
+                    idempotency_key = parse_args(outermost.args).get('idempotency_key')
+            except (ValueError, KeyError):
+                skipped += 1
+                continue
+        requests.append(LoggedRequest(request_id=outermost.request_id, arrival=min(line.arrival for line in group),
+                                      method=outermost.method, path=outermost.path, function=outermost.function,
+                                      status=outermost.status, body=body, idempotency_key=idempotency_key))
+    requests.sort(key=lambda request: request.arrival)
+    return requests, skipped
+
+
+def read_requests(paths: list[str], start: Optional[DateTime] = None,
+                  end: Optional[DateTime] = None) -> Tuple[list[LoggedRequest], int]:
+    """
+    Read the requests from request logs.
+
+    :param paths: Paths of the request logs, in chronological order.
+    :param start: Optional time from which requests are read.
+    :param end: Optional time until which requests are read.
+    :return: The requests ordered by arrival, and the number of requests which cannot be replayed.
+    """
+    def read_lines() -> Iterable[LoggedLine]:
+        for path in paths:
+            with open(path, encoding='utf-8', errors='replace') as log_file:
+                for text in log_file:
+                    line = parse_line(text)
+                    if line is not None:
+                        yield line
+
+    requests, skipped = group_requests(read_lines())
+    requests = [request for request in requests
+                if (start is None or request.arrival >= start) and (end is None or request.arrival < end)]
+    return requests, skipped
+
+
+async def congressus_stats(congressus_url: Optional[str], reset: bool = False) -> Optional[dict[str, Any]]:
+    """Get (and optionally reset) the call counts of the fake Congressus server."""
+    if not congressus_url:
+        return None
+    parsed_url = urlparse(congressus_url)
+    connection = HttpConnection(parsed_url.hostname, parsed_url.port or 80)
+    try:
+        status, content = await connection.request('POST' if reset else 'GET', '/_stats')
+        return json.loads(content)
+    finally:
+        connection.close()
+
+
+class TrafficReplay:
+    """Sends logged requests with the same relative timing as they arrived, optionally sped up."""
+
+    def __init__(self, url: str, congressus_url: Optional[str], requests: list[LoggedRequest], speed: float):
+        parsed_url = urlparse(url)
+        self.host = parsed_url.hostname
+        self.port = parsed_url.port or 80
+        self.congressus_url = congressus_url
+        self.requests = requests
+        self.speed = speed
+        self.metrics = Metrics()
+        self.lags: list[float] = []  # Seconds every request was sent later than scheduled
+        self.status_changes = 0  # Number of requests with another status than recorded
+
+    async def send(self, request: LoggedRequest) -> None:
+        connection = HttpConnection(self.host, self.port)
+        kind = f'{request.method} {request.function}'
+        start_time = time.perf_counter()
+        try:
+            headers = {'Idempotency-Key': request.idempotency_key} if request.idempotency_key else None
+            status, _ = await connection.request(request.method, request.path, body=request.body, headers=headers)
+        except (OSError, asyncio.IncompleteReadError) as e:
+            self.metrics.errors[f'{kind}: {type(e).__name__}'] += 1
+            return
+        finally:
+            connection.close()
+        self.metrics.record(kind, time.perf_counter() - start_time, status)
+        if status != request.status:
+            self.status_changes += 1
+
+    async def run(self) -> dict[str, Any]:
+        await congressus_stats(self.congressus_url, reset=True)
+        tasks = []
+        start_time = time.perf_counter()
+        if self.requests:
+            first_arrival = self.requests[0].arrival
+            for request in self.requests:
+                offset = (request.arrival - first_arrival).total_seconds() / self.speed
+                await asyncio.sleep(max(0.0, start_time + offset - time.perf_counter()))
+                self.lags.append(time.perf_counter() - start_time - offset)
+                tasks.append(asyncio.create_task(self.send(request)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start_time
+        return self.report(elapsed=elapsed, congressus=await congressus_stats(self.congressus_url))
+
+    def report(self, elapsed: float, congressus: Optional[dict[str, Any]]) -> dict[str, Any]:
+        recorded = (self.requests[-1].arrival - self.requests[0].arrival).total_seconds() if self.requests else 0
+        lags = sorted(self.lags)
+        return {
+            'recorded_duration': recorded,
+            'speed': self.speed,
+            'replayed': len(self.requests),
+            'status_changes': self.status_changes,
+            'lag_p99': percentile(lags, 0.99) if lags else 0,
+            'lag_max': lags[-1] if lags else 0,
+            **metrics_report(self.metrics, elapsed=elapsed, congressus=congressus),
+        }
+
+
+def _parse_time(value: str) -> DateTime:
+    try:
+        return DateTime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid time {value!r}, use e.g. '2026-10-16 15:00'")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay the requests in request logs against the Streeplijst API.")
+    parser.add_argument('logs', nargs='+', help="Request logs to replay, in chronological order")
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help="Base URL of the test instance")
+    parser.add_argument('--congressus-url', default='http://127.0.0.1:8001',
+                        help="Base URL of the fake Congressus server, to count upstream calls (empty to skip)")
+    parser.add_argument('--start', type=_parse_time, help="Only replay requests which arrived from this time")
+    parser.add_argument('--end', type=_parse_time, help="Only replay requests which arrived before this time")
+    parser.add_argument('--speed', type=float, default=1, help="Factor to speed up the replay, e.g. 2 for 2x as fast")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+
+    requests, skipped = read_requests(args.logs, start=args.start, end=args.end)
+    replay = TrafficReplay(url=args.url, congressus_url=args.congressus_url or None, requests=requests,
+                           speed=args.speed)
+    report = asyncio.run(replay.run())
+    report['skipped'] = skipped
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"Replayed {len(requests)} requests recorded over {report['recorded_duration']:.1f} s "
+              f"at {args.speed:g}x speed, skipped {skipped} requests which cannot be replayed")
+        print(f"Sent late: p99 {report['lag_p99'] * 1000:.0f} ms, max {report['lag_max'] * 1000:.0f} ms, "
+              f"{report['status_changes']} requests returned another status than recorded")
+        print()
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
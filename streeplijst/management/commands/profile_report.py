@@ -0,0 +1,65 @@
+import json
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Aggregate sampled request profiles into a report of the functions in which the most time is spent."
+
+    def add_arguments(self, parser):
+        parser.add_argument('request_ids', nargs='*',
+                            help="Only include the profiles of these request IDs (defaults to all profiles)")
+        parser.add_argument('--folder', default=str(settings.PROFILE_FOLDER), help="Folder containing the profiles")
+        parser.add_argument('--name', help="Only include profiles of this function, e.g. get_member_by_username")
+        parser.add_argument('--limit', type=int, default=25, help="Number of functions to list")
+        parser.add_argument('--folded', help="Also write all stacks combined to this file, e.g. for a flame graph")
+
+    def handle(self, *args, **options):
+        folder = Path(options['folder'])
+        if options['request_ids']:
+            paths = [folder / f'{request_id}.json' for request_id in options['request_ids']]
+        else:
+            paths = sorted(folder.glob('*.json'))
+
+        stacks = Counter()  # Number of samples of every stack in all profiles
+        profiles = 0
+        for path in paths:
+            try:
+                with open(path) as file:
+                    profile = json.load(file)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Could not read profile {path}: {e}")
+            if options['name'] and profile['name'] != options['name']:
+                continue
+            profiles += 1
+            stacks.update(profile['stacks'])
+
+        total = sum(stacks.values())
+        if total == 0:
+            self.stdout.write("No samples found")
+            return
+
+        own = Counter()  # Samples in which a function was running itself
+        cumulative = Counter()  # Samples in which a function was running or waiting for a function it called
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):  # Count recursive functions only once per sample
+                cumulative[frame] += count
+
+        self.stdout.write(f"{total} samples in {profiles} profiles\n")
+        for title, counter in (("Own time", own), ("Cumulative time", cumulative)):
+            self.stdout.write(title)
+            self.stdout.write(f"{'Samples':>8} {'%':>6}  Function")
+            for frame, count in counter.most_common(options['limit']):
+                self.stdout.write(f"{count:>8} {100 * count / total:>6.1f}  {frame}")
+            self.stdout.write("")
+
+        if options['folded']:
+            with open(options['folded'], 'w') as file:
+                for stack, count in stacks.most_common():
+                    file.write(f'{stack} {count}\n')
+            self.stdout.write(f"Folded stacks written to {options['folded']}")
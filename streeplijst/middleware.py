@@ -0,0 +1,99 @@
+import hmac
+import logging
+import time
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse, JsonResponse
+
+from streeplijst.congressus import deadline, timing
+from streeplijst.congressus.tenants import DEFAULT_TENANT_NAME, TENANT_HEADER, TENANT_KEY_HEADER, TENANTS
+
+timing_logger = logging.getLogger('api.local')  # Timings are logged together with local requests
+
+
+class ServerTimingMiddleware:
+    """
+    Adds a Server-Timing header to every response of the Streeplijst API, with the time spent in each call to
+    Congressus, stripping, serialization and logging, and logs the same breakdown.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if not request.path.startswith(settings.API_PATH_PREFIX):
+            return self.get_response(request)
+
+        request_timing = timing.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            timing.stop()
+
+        total = request_timing.elapsed
+        response['Server-Timing'] = request_timing.header_value(total=total)
+        response['Timing-Allow-Origin'] = '*'  # Allow the frontend to read the timings from another origin
+        timing_logger.info(msg=f"{request_timing.log_str(total=total)} | Request: '{request.method} "
+                               f"{request.get_full_path()}'")
+        return response
+
+    def process_template_response(self, request: HttpRequest, response: HttpResponse) -> HttpResponse:
+        """Measure the time spent serializing a response, which happens after this hook and before __call__ returns."""
+        request_timing = timing.current()
+        if request_timing is not None:
+            start_time = time.perf_counter()
+
+            def serialized(_: HttpResponse) -> None:
+                request_timing.add('serialize', time.perf_counter() - start_time)
+
+            response.add_post_render_callback(serialized)
+        return response
+
+
+class DeadlineMiddleware:
+    """
+    Gives every request to the Streeplijst API a deadline. Calls to Congressus made for the request are cut short when
+    the deadline passes, so a request never keeps a kiosk waiting for much longer than the deadline.
+    """
+    DEADLINE: float = 15  # Seconds a request may spend waiting for Congressus
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if not request.path.startswith(settings.API_PATH_PREFIX):
+            return self.get_response(request)
+
+        deadline.start(self.DEADLINE)
+        try:
+            return self.get_response(request)
+        finally:
+            deadline.stop()
+
+
+class TenantMiddleware:
+    """
+    Selects the tenant (association) a request to the Streeplijst API is made for, from the X-Streeplijst-Tenant
+    header. A request for a tenant other than the default tenant must send the API key of that tenant in the
+    X-Streeplijst-Tenant-Key header, so a client cannot use the data and Congressus account of another tenant by
+    naming it. Requests without the header are made for the default tenant, requests for an unknown tenant return 404
+    and requests without the right key return 403.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if not request.path.startswith(settings.API_PATH_PREFIX):
+            return self.get_response(request)
+
+        tenant_name = request.headers.get(TENANT_HEADER) or DEFAULT_TENANT_NAME
+        tenant = TENANTS.get(tenant_name)
+        if tenant is None:
+            return JsonResponse(data={'message': f"Tenant {tenant_name} not recognized"}, status=404)
+        if tenant.name != DEFAULT_TENANT_NAME:
+            key = request.headers.get(TENANT_KEY_HEADER, '')
+            if tenant.api_key is None or not hmac.compare_digest(key.encode(), tenant.api_key.encode()):
+                return JsonResponse(data={'message': f"Invalid or missing key for tenant {tenant_name}"}, status=403)
+        request.tenant = tenant
+        return self.get_response(request)
@@ -0,0 +1,92 @@
+# Generated by Django 3.2.7 on 2026-10-19 11:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MemberSalesSync',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tenant', models.CharField(max_length=64)),
+                ('member_id', models.IntegerField()),
+                ('synced_at', models.DateTimeField()),
+                ('sales_changed_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'unique_together': {('tenant', 'member_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SeenSaleInvoice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tenant', models.CharField(max_length=64)),
+                ('invoice_id', models.IntegerField()),
+                ('member_id', models.IntegerField(db_index=True)),
+                ('period', models.CharField(max_length=7)),
+                ('price_paid', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('price_unpaid', models.DecimalField(decimal_places=2, max_digits=10)),
+            ],
+            options={
+                'unique_together': {('tenant', 'invoice_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MemberPeriodTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tenant', models.CharField(max_length=64)),
+                ('member_id', models.IntegerField()),
+                ('period', models.CharField(max_length=7)),
+                ('price_paid', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('price_unpaid', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('invoice_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('tenant', 'member_id', 'period')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MemberProductCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tenant', models.CharField(max_length=64)),
+                ('member_id', models.IntegerField()),
+                ('product_offer_id', models.IntegerField()),
+                ('name', models.CharField(max_length=255)),
+                ('quantity', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('tenant', 'member_id', 'product_offer_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tenant', models.CharField(max_length=64)),
+                ('key', models.CharField(max_length=255)),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('state', models.CharField(max_length=16)),
+                ('token', models.CharField(max_length=32)),
+                ('invoice_id', models.IntegerField(null=True)),
+                ('invoice', models.JSONField(null=True)),
+                ('res_status', models.IntegerField(null=True)),
+                ('res_data', models.JSONField(null=True)),
+                ('first_used', models.DateTimeField()),
+                ('claimed_until', models.DateTimeField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'unique_together': {('tenant', 'key'), ('tenant', 'invoice_id')},
+            },
+        ),
+    ]
@@ -1,3 +1,75 @@
 from django.db import models
 
-# Create your models here.
+
+class SeenSaleInvoice(models.Model):
+    """A sale invoice which is already counted in the sales aggregates, with the amounts it contributed."""
+    tenant = models.CharField(max_length=64)  # Name of the tenant (association) the invoice belongs to
+    invoice_id = models.IntegerField()  # Congressus ID of the invoice
+    member_id = models.IntegerField(db_index=True)  # Congressus ID of the member the invoice belongs to
+    period = models.CharField(max_length=7)  # Month of the invoice date, formatted as YYYY-MM
+    price_paid = models.DecimalField(max_digits=10, decimal_places=2)  # Paid amount in euros when last seen
+    price_unpaid = models.DecimalField(max_digits=10, decimal_places=2)  # Unpaid amount in euros when last seen
+
+    class Meta:
+        unique_together = [('tenant', 'invoice_id')]
+
+
+class MemberPeriodTotal(models.Model):
+    """Running total of the sales of a member in a single month."""
+    tenant = models.CharField(max_length=64)  # Name of the tenant (association) the member belongs to
+    member_id = models.IntegerField()  # Congressus ID of the member
+    period = models.CharField(max_length=7)  # Month, formatted as YYYY-MM
+    price_paid = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # Paid amount in euros
+    price_unpaid = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # Unpaid amount in euros
+    invoice_count = models.IntegerField(default=0)  # Number of invoices
+
+    class Meta:
+        unique_together = [('tenant', 'member_id', 'period')]
+
+
+class MemberProductCount(models.Model):
+    """Running count of how often a member bought a product."""
+    tenant = models.CharField(max_length=64)  # Name of the tenant (association) the member belongs to
+    member_id = models.IntegerField()  # Congressus ID of the member
+    product_offer_id = models.IntegerField()  # Congressus ID of the product offer
+    name = models.CharField(max_length=255)  # Product name as it appeared on the most recent invoice
+    quantity = models.IntegerField(default=0)  # Total quantity bought
+
+    class Meta:
+        unique_together = [('tenant', 'member_id', 'product_offer_id')]
+
+
+class MemberSalesSync(models.Model):
+    """When the sales aggregates of a member were last synchronized with Congressus."""
+    tenant = models.CharField(max_length=64)  # Name of the tenant (association) the member belongs to
+    member_id = models.IntegerField()  # Congressus ID of the member
+    synced_at = models.DateTimeField()  # Time of the last synchronization
+    # Time a webhook reported a changed sale invoice of the member which was not synchronized yet, if any
+    sales_changed_at = models.DateTimeField(null=True)
+
+    class Meta:
+        unique_together = [('tenant', 'member_id')]
+
+
+class IdempotencyKey(models.Model):
+    """An idempotency key with which a sale was posted, and what is known about the invoice created for it."""
+    PENDING = 'pending'  # A request holds the key and may be creating or sending the invoice
+    CREATED = 'created'  # The invoice was created but not sent
+    UNKNOWN = 'unknown'  # Creating the invoice failed in a way which does not tell whether it was created
+    DONE = 'done'  # The invoice was created and sent, the result is stored
+
+    tenant = models.CharField(max_length=64)  # Name of the tenant (association) the sale belongs to
+    key = models.CharField(max_length=255)  # Idempotency key supplied by the client
+    fingerprint = models.CharField(max_length=64)  # Fingerprint of the sale data, to detect reuse for another sale
+    state = models.CharField(max_length=16)  # One of the states above
+    token = models.CharField(max_length=32)  # Random token of the request which last claimed the key
+    invoice_id = models.IntegerField(null=True)  # Congressus ID of the invoice, once known
+    invoice = models.JSONField(null=True)  # Raw invoice data returned by Congressus, once known
+    res_status = models.IntegerField(null=True)  # Status code of the final result
+    res_data = models.JSONField(null=True)  # Data of the final result
+    first_used = models.DateTimeField()  # When the key was first used
+    claimed_until = models.DateTimeField()  # When a pending key may be claimed by another request
+    expires_at = models.DateTimeField(db_index=True)  # When the key is forgotten
+
+    class Meta:
+        unique_together = [('tenant', 'key'), ('tenant', 'invoice_id')]
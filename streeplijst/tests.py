@@ -1,3 +1,1050 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import time
+import wsgiref.util
+from pathlib import Path
+from typing import Optional
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.response import Response
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from streeplijst import aggregates, handlers, views
+from streeplijst.congressus import deadline, idempotency, tenants
+from streeplijst.congressus.admission import AdmissionController
+from streeplijst.congressus.api import ApiV30
+from streeplijst.congressus.cache import SharedCache
+from streeplijst.congressus.cursor import PageCursor, decode_cursor, encode_cursor, filter_hash
+from streeplijst.congressus.favourites import FavouriteProducts, SpaceSavingCounter
+from streeplijst.congressus.rate_limit import Priority, SharedRateLimiter
+from streeplijst.congressus.recent import RecentPurchases
+from streeplijst.congressus.search import ProductSearchIndex
+from streeplijst.congressus.snapshot import Snapshotter, read_snapshot, write_snapshot
+from streeplijst.congressus.tenants import Tenant
+from streeplijst.congressus.webhooks import SIGNATURE_HEADER, TOKEN_HEADER, WebhookChanges, is_authentic
+from streeplijst.middleware import TenantMiddleware
+from streeplijst.models import MemberPeriodTotal, MemberProductCount, MemberSalesSync, SeenSaleInvoice
+
+
+class TemporaryStateMixin:
+    """Gives every test an empty folder for the state shared by workers, like the shared cache."""
+
+    def setUp(self):
+        super().setUp()
+        state_folder = tempfile.TemporaryDirectory()
+        self.addCleanup(state_folder.cleanup)
+        self.state_folder = Path(state_folder.name)
+
+
+class FakeCongressusResponse:
+    """Response of the requests library, with only the attributes used by the API."""
+
+    def __init__(self, data: dict, status_code: int = 200):
+        self.status_code = status_code
+        self.content = json.dumps(data).encode()
+        self.elapsed = datetime.timedelta(milliseconds=5)
+        self._data = data
+
+    def json(self) -> dict:
+        return self._data
+
+
+class ApiTestMixin(TemporaryStateMixin):
+    """
+    Gives every test an API of a test tenant whose requests to Congressus are answered by 'congressus_request', which
+    test cases implement.
+    """
+    folder_configuration: list[dict] = []  # Streeplijst folders of the test tenant
+
+    def setUp(self):
+        super().setUp()
+        settings_override = override_settings(SHARED_STATE_FOLDER=self.state_folder)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        environ_patch = mock.patch.dict(os.environ, {'STREEPLIJST_TEST_API_TOKEN': 'token'})
+        environ_patch.start()
+        self.addCleanup(environ_patch.stop)
+        self.congressus_requests = []  # Method and URL of every request to Congressus
+        # Patched before the API is created, since it may start fetching in the background right away
+        request_patch = mock.patch.object(requests.Session, 'request', side_effect=self.record_congressus_request)
+        request_patch.start()
+        self.addCleanup(request_patch.stop)
+        self.api = ApiV30(tenant=Tenant(name='test', api_token_env='STREEPLIJST_TEST_API_TOKEN', parent_folder_id=1,
+                                        folder_configuration=self.folder_configuration, webhook_secret=None))
+
+    def record_congressus_request(self, method: str, url: str, **kwargs) -> FakeCongressusResponse:
+        self.congressus_requests.append((method, url.split(f'/{ApiV30.API_VERSION}', 1)[1]))
+        return self.congressus_request(method, url, **kwargs)
+
+    def congressus_request(self, method: str, url: str, params: dict = None, json: dict = None,
+                           **kwargs) -> FakeCongressusResponse:
+        raise NotImplementedError
+
+
+class SharedCacheTests(TemporaryStateMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = SharedCache(db_path=self.state_folder / 'cache.sqlite3', namespace='test')
+
+    def test_compare_and_set_only_stores_unchanged_entry(self):
+        self.assertTrue(self.cache.compare_and_set('key', value=1, ttl=60, expected_version=None))
+        self.assertFalse(self.cache.compare_and_set('key', value=2, ttl=60, expected_version=None))  # Exists already
+        version = self.cache.get_entry('key').version
+        self.cache.set('key', value=3, ttl=60)  # Changed by someone else
+        self.assertFalse(self.cache.compare_and_set('key', value=4, ttl=60, expected_version=version))
+        self.assertTrue(self.cache.compare_and_set('key', value=5, ttl=60,
+                                                   expected_version=self.cache.get_entry('key').version))
+        self.assertEqual(self.cache.get('key'), 5)
+
+    def test_compare_and_set_replaces_expired_entry(self):
+        self.cache.set('key', value=1, ttl=-1)
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(self.cache.get('key', allow_stale=True), 1)
+        self.assertTrue(self.cache.add('key', value=2, ttl=60))
+        self.assertEqual(self.cache.get('key'), 2)
+
+    def test_get_or_fill_stores_value_and_releases_lock(self):
+        self.assertEqual(self.cache.get_or_fill('key', ttl=60, fill=lambda: (1, True), fill_timeout=5), 1)
+        self.assertEqual(self.cache.get_or_fill('key', ttl=60, fill=lambda: (2, True), fill_timeout=5), 1)
+        self.assertIsNone(self.cache.get('key:filling'))
+
+    def test_get_or_fill_does_not_store_value_which_may_not_be_stored(self):
+        self.assertEqual(self.cache.get_or_fill('key', ttl=60, fill=lambda: (1, False), fill_timeout=5), 1)
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_get_or_fill_keeps_lock_taken_over_by_other_process(self):
+        def fill():
+            # The lock of this process expired while filling and another process took it
+            self.cache.set('key:filling', value='other-token', ttl=60)
+            return 1, True
+
+        self.cache.get_or_fill('key', ttl=60, fill=fill, fill_timeout=5)
+        self.assertEqual(self.cache.get('key:filling'), 'other-token')
+
+    def test_get_or_fill_waits_for_other_process(self):
+        self.cache.add('key:filling', value='other-token', ttl=5)
+        fill = mock.Mock(return_value=(2, True))
+
+        def store_while_waiting(seconds):  # The other process stores its value while this process waits
+            self.cache.set('key', value=1, ttl=60)
+
+        with mock.patch('streeplijst.congressus.cache.time.sleep', side_effect=store_while_waiting):
+            self.assertEqual(self.cache.get_or_fill('key', ttl=60, fill=fill, fill_timeout=5), 1)
+        fill.assert_not_called()
+        self.assertEqual(self.cache.get('key:filling'), 'other-token')  # The lock of the other process is kept
+
+    def test_get_or_fill_fills_after_waiting_too_long(self):
+        self.cache.add('key:filling', value='other-token', ttl=5)
+        self.assertEqual(self.cache.get_or_fill('key', ttl=60, fill=lambda: (1, True), fill_timeout=0.1), 1)
+        self.assertEqual(self.cache.get('key:filling'), 'other-token')
+
+
+class SharedRateLimiterTests(TemporaryStateMixin, SimpleTestCase):
+    def rate_limiter(self, rate: float, capacity: int) -> SharedRateLimiter:
+        return SharedRateLimiter(db_path=self.state_folder / 'rate_limit.sqlite3', name='test', rate=rate,
+                                 capacity=capacity)
+
+    @staticmethod
+    def take_all(rate_limiter: SharedRateLimiter, priority: Priority) -> int:
+        """Returns the number of tokens a priority class can take without waiting."""
+        taken = 0
+        while rate_limiter.acquire(priority=priority, max_wait=0):
+            taken += 1
+        return taken
+
+    def test_priority_classes_leave_room_for_higher_classes(self):
+        rate_limiter = self.rate_limiter(rate=0.001, capacity=10)
+        self.assertEqual(self.take_all(rate_limiter, Priority.BACKGROUND), 5)  # Half is reserved for members and sales
+        self.assertEqual(self.take_all(rate_limiter, Priority.MEMBER), 3)  # A fifth is reserved for sales
+        self.assertEqual(self.take_all(rate_limiter, Priority.SALE), 2)  # Sales may drain the bucket
+        self.assertFalse(rate_limiter.acquire(priority=Priority.SALE, max_wait=0))
+
+    def test_buckets_are_shared_by_instances(self):
+        self.take_all(self.rate_limiter(rate=0.001, capacity=10), Priority.SALE)
+        self.assertFalse(self.rate_limiter(rate=0.001, capacity=10).acquire(priority=Priority.SALE, max_wait=0))
+
+    def test_waits_for_a_token_up_to_max_wait(self):
+        rate_limiter = self.rate_limiter(rate=20, capacity=1)
+        self.take_all(rate_limiter, Priority.SALE)
+
+        start_time = time.monotonic()
+        self.assertTrue(rate_limiter.acquire(priority=Priority.SALE, max_wait=1))
+        self.assertGreater(time.monotonic() - start_time, 0.02)  # A token is added every 0.05s
+
+    def test_gives_up_after_max_wait(self):
+        rate_limiter = self.rate_limiter(rate=0.1, capacity=1)
+        self.take_all(rate_limiter, Priority.SALE)
+
+        start_time = time.monotonic()
+        self.assertFalse(rate_limiter.acquire(priority=Priority.SALE, max_wait=0.1))
+        self.assertLess(time.monotonic() - start_time, 1)  # The next token is only added after 10s
+
+    def test_tokens_are_refilled_at_rate(self):
+        rate_limiter = self.rate_limiter(rate=20, capacity=4)
+        self.take_all(rate_limiter, Priority.SALE)
+        time.sleep(0.3)  # Adds 6 tokens, but the bucket holds at most 4
+        self.assertEqual(self.take_all(rate_limiter, Priority.SALE), 4)
+
+
+class IdempotencyStoreTests(TestCase):
+    def setUp(self):
+        self.store = idempotency.IdempotencyStore(tenant='test', ttl=60, claim_ttl=5)
+
+    def test_new_key_is_claimed_once(self):
+        self.assertEqual(self.store.begin(key='key', data_fingerprint='a').outcome, idempotency.NEW)
+        self.assertEqual(self.store.begin(key='key', data_fingerprint='a').outcome, idempotency.IN_PROGRESS)
+
+    def test_keys_of_other_tenants_are_separate(self):
+        self.store.begin(key='key', data_fingerprint='a')
+        other_store = idempotency.IdempotencyStore(tenant='other', ttl=60, claim_ttl=5)
+        self.assertEqual(other_store.begin(key='key', data_fingerprint='a').outcome, idempotency.NEW)
+
+    def test_other_data_with_same_key_is_a_mismatch(self):
+        self.store.begin(key='key', data_fingerprint='a')
+        self.assertEqual(self.store.begin(key='key', data_fingerprint='b').outcome, idempotency.MISMATCH)
+
+    def test_completed_request_is_replayed(self):
+        claim = self.store.begin(key='key', data_fingerprint='a')
+        self.store.complete(key='key', token=claim.token, res_status=201, res_data={'id': 1})
+
+        replay = self.store.begin(key='key', data_fingerprint='a')
+        self.assertEqual((replay.outcome, replay.res_status, replay.res_data), (idempotency.REPLAY, 201, {'id': 1}))
+
+    def test_created_invoice_is_claimed_once(self):
+        claim = self.store.begin(key='key', data_fingerprint='a')
+        self.store.mark_created(key='key', token=claim.token, invoice={'id': 1})
+
+        retry = self.store.begin(key='key', data_fingerprint='a')
+        self.assertEqual((retry.outcome, retry.invoice), (idempotency.CREATED, {'id': 1}))
+        self.assertEqual(self.store.begin(key='key', data_fingerprint='a').outcome, idempotency.IN_PROGRESS)
+
+    def test_unknown_outcome_is_kept_and_claimed_once(self):
+        claim = self.store.begin(key='key', data_fingerprint='a')
+        self.store.mark_unknown(key='key', token=claim.token)
+
+        retry = self.store.begin(key='key', data_fingerprint='a')
+        self.assertEqual(retry.outcome, idempotency.UNKNOWN)
+        self.assertIsNotNone(retry.first_used)
+        self.assertEqual(self.store.begin(key='key', data_fingerprint='a').outcome, idempotency.IN_PROGRESS)
+
+    def test_expired_claim_is_taken_over(self):
+        store = idempotency.IdempotencyStore(tenant='test', ttl=60, claim_ttl=0)
+        first_claim = store.begin(key='key', data_fingerprint='a')
+        self.assertEqual(store.begin(key='key', data_fingerprint='a').outcome, idempotency.UNKNOWN)
+
+        store.complete(key='key', token=first_claim.token, res_status=201, res_data={})  # Lost its claim
+        self.assertEqual(store.begin(key='key', data_fingerprint='a').outcome, idempotency.UNKNOWN)
+
+    def test_invoice_belongs_to_one_key(self):
+        self.assertTrue(self.store.mark_created(key='first', token=self.store.begin('first', 'a').token,
+                                                invoice={'id': 1}))
+        self.assertFalse(self.store.mark_created(key='second', token=self.store.begin('second', 'a').token,
+                                                 invoice={'id': 1}))
+        self.assertEqual(self.store.claimed_invoice_ids([1, 2]), {1})
+
+    def test_released_key_can_be_used_again(self):
+        claim = self.store.begin(key='key', data_fingerprint='a')
+        self.store.release(key='key', token=claim.token)
+        self.assertEqual(self.store.begin(key='key', data_fingerprint='b').outcome, idempotency.NEW)
+
+
+class PostSaleTests(ApiTestMixin, TestCase):
+    items = [{'product_offer_id': 7, 'quantity': 2}]
+
+    def setUp(self):
+        super().setUp()
+        self.invoices = []  # Invoices created at Congressus
+        self.create_failure = None  # Exception raised when the next invoice is created, after or before creating it
+        self.create_failure_after_creating = True
+
+    def congressus_request(self, method, url, params=None, json=None, **kwargs):
+        url_endpoint = url.removeprefix(self.api._congressus_url_base)
+        if method == 'post' and url_endpoint == '/sale-invoices':
+            failure, self.create_failure = self.create_failure, None
+            if failure is not None and not self.create_failure_after_creating:
+                raise failure
+            invoice = {'id': len(self.invoices) + 1, 'member_id': json['member_id'], 'items': json['items']}
+            self.invoices.append(invoice)
+            if failure is not None:
+                raise failure
+            return FakeCongressusResponse(invoice, status_code=201)
+        if method == 'post' and url_endpoint.endswith('/send'):
+            return FakeCongressusResponse({})
+        if method == 'get' and url_endpoint == '/sale-invoices':
+            return FakeCongressusResponse({'data': list(reversed(self.invoices)), 'has_next': False})
+        raise AssertionError(f"Unexpected request {method} {url_endpoint}")
+
+    def post_sale(self, idempotency_key: str = 'key'):
+        return self.api.post_sale(req=None, member_id=1, items=self.items, idempotency_key=idempotency_key)
+
+    def test_sale_is_replayed(self):
+        self.assertEqual(self.post_sale().status_code, 201)
+        res = self.post_sale()
+        self.assertEqual((res.status_code, res.data['id'], res['Idempotent-Replayed']), (201, 1, 'true'))
+        self.assertEqual(len(self.invoices), 1)
+
+    def test_timed_out_invoice_is_created_once(self):
+        self.create_failure = requests.exceptions.ReadTimeout()
+        self.assertEqual(self.post_sale().status_code, 408)
+        self.assertEqual(self.congressus_requests, [('post', '/sale-invoices')])  # Creating is not retried
+
+        res = self.post_sale()  # The invoice is found instead of created again
+        self.assertEqual((res.status_code, res.data['id']), (201, 1))
+        self.assertEqual(len(self.invoices), 1)
+
+    def test_invoice_of_another_key_is_not_taken(self):
+        self.assertEqual(self.post_sale(idempotency_key='other').status_code, 201)
+        self.create_failure = requests.exceptions.ReadTimeout()
+        self.create_failure_after_creating = False  # Congressus never received the request
+        self.assertEqual(self.post_sale().status_code, 408)
+
+        res = self.post_sale()
+        self.assertEqual((res.status_code, res.data['id']), (201, 2))
+        self.assertEqual(len(self.invoices), 2)
+
+    def test_refused_connection_releases_key(self):
+        self.create_failure = requests.exceptions.ConnectionError(
+            MaxRetryError(pool=None, url='/sale-invoices', reason=NewConnectionError(None, "Connection refused")))
+        self.create_failure_after_creating = False
+        res = self.post_sale()
+        self.assertEqual((res.status_code, res.data['error']), (503, "Could not connect to Congressus"))
+
+        self.assertEqual(self.post_sale().status_code, 201)
+        self.assertNotIn(('get', '/sale-invoices'), self.congressus_requests)  # Nothing to look up
+
+
+class TenantMiddlewareTests(SimpleTestCase):
+    other_tenant = Tenant(name='other', api_token_env='OTHER_TOKEN', parent_folder_id=1, folder_configuration=[],
+                          webhook_secret=None, api_key='other-key')
+
+    def setUp(self):
+        tenants_patch = mock.patch.dict(tenants.TENANTS, {'other': self.other_tenant})
+        tenants_patch.start()
+        self.addCleanup(tenants_patch.stop)
+        self.middleware = TenantMiddleware(get_response=lambda request: HttpResponse(request.tenant.name))
+
+    def get(self, **headers) -> HttpResponse:
+        return self.middleware(RequestFactory().get('/streeplijst/v30/ping', headers=headers))
+
+    def test_default_tenant_without_header(self):
+        self.assertEqual(self.get().content, b'default')
+
+    def test_tenant_with_its_key(self):
+        res = self.get(**{tenants.TENANT_HEADER: 'other', tenants.TENANT_KEY_HEADER: 'other-key'})
+        self.assertEqual(res.content, b'other')
+
+    def test_tenant_without_its_key_is_forbidden(self):
+        for key in [None, 'wrong-key']:
+            headers = {tenants.TENANT_HEADER: 'other'} | ({tenants.TENANT_KEY_HEADER: key} if key else {})
+            with self.subTest(key=key):
+                self.assertEqual(self.get(**headers).status_code, 403)
+
+    def test_tenant_without_configured_key_is_forbidden(self):
+        with mock.patch.dict(tenants.TENANTS, {'other': self.other_tenant._replace(api_key=None)}):
+            self.assertEqual(self.get(**{tenants.TENANT_HEADER: 'other', tenants.TENANT_KEY_HEADER: ''}).status_code,
+                             403)
+
+    def test_unknown_tenant_is_not_found(self):
+        self.assertEqual(self.get(**{tenants.TENANT_HEADER: 'unknown'}).status_code, 404)
+
+
+class TenantApiTests(TemporaryStateMixin, SimpleTestCase):
+    def test_api_is_created_once_on_first_use(self):
+        tenant = Tenant(name='lazy', api_token_env='LAZY_TOKEN', parent_folder_id=1, folder_configuration=[],
+                        webhook_secret=None)
+        with override_settings(SHARED_STATE_FOLDER=self.state_folder), \
+                mock.patch.dict(views._api_v30_objs, clear=True):
+            api = views._api_v30_of(tenant)
+            self.assertIs(views._api_v30_of(tenant), api)
+            self.assertEqual(api.tenant, tenant)
+
+
+class RecordSalesTests(TestCase):
+    @staticmethod
+    def sale(invoice_id: int, price_paid: float = 1.5) -> dict:
+        return {'id': invoice_id, 'member_id': 1, 'price_paid': price_paid, 'price_unpaid': 0,
+                'invoice_date': '2026-10-01', 'items': [{'name': 'Chips', 'product_offer_id': 10, 'quantity': 2}]}
+
+    def test_sale_is_counted_once(self):
+        new_sales = aggregates.record_sales(tenant='test', sales=[self.sale(1), self.sale(1), self.sale(2)])
+        self.assertEqual([sale['id'] for sale in new_sales], [1, 2])
+        self.assertEqual(aggregates.record_sales(tenant='test', sales=[self.sale(1)]), [])
+
+        self.assertEqual(SeenSaleInvoice.objects.count(), 2)
+        total = MemberPeriodTotal.objects.get(tenant='test', member_id=1, period='2026-10')
+        self.assertEqual((total.invoice_count, float(total.price_paid)), (2, 3.0))
+        self.assertEqual(MemberProductCount.objects.get(tenant='test', member_id=1, product_offer_id=10).quantity, 4)
+
+    def test_changed_amounts_are_updated(self):
+        aggregates.record_sales(tenant='test', sales=[self.sale(1, price_paid=0)])
+        aggregates.record_sales(tenant='test', sales=[self.sale(1, price_paid=1.5)])
+
+        total = MemberPeriodTotal.objects.get(tenant='test', member_id=1, period='2026-10')
+        self.assertEqual((total.invoice_count, float(total.price_paid)), (1, 1.5))
+        self.assertEqual(MemberProductCount.objects.get(tenant='test', member_id=1, product_offer_id=10).quantity, 2)
+
+    def test_tenants_are_counted_separately(self):
+        aggregates.record_sales(tenant='test', sales=[self.sale(1)])
+        self.assertEqual(len(aggregates.record_sales(tenant='other', sales=[self.sale(1)])), 1)
+
+    def test_incomplete_sales_are_skipped(self):
+        self.assertEqual(aggregates.record_sales(tenant='test', sales=[{'id': 1}, {'member_id': 1}]), [])
+        self.assertFalse(SeenSaleInvoice.objects.exists())
+
+
+class SyncSalesAggregatesTests(ApiTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.period_filters = []  # Period filter of every request for sales
+
+    def congressus_request(self, method, url, params=None, **kwargs):
+        self.period_filters.append(params['period_filter'])
+        sales = [{'id': 1, 'member_id': 1, 'price_paid': 0, 'price_unpaid': 2, 'invoice_date': '2026-03-14'},
+                 {'id': 2, 'member_id': 1, 'price_paid': 0, 'price_unpaid': 1}]  # Without a date
+        return FakeCongressusResponse({'data': sales, 'has_next': False})
+
+    def sync(self) -> None:
+        self.assertIsNone(self.api._sync_sales_aggregates(member_id=1))
+
+    def test_first_sync_fetches_default_period(self):
+        self.sync()
+        default_since = datetime.date.today() - self.api.DEFAULT_INVOICE_PERIOD_FILTER
+        self.assertEqual(self.period_filters, [default_since.strftime("%Y-%m-%d")])
+
+    def test_later_syncs_only_fetch_new_sales(self):
+        self.sync()
+        self.sync()  # Synchronized too recently to fetch anything
+        MemberSalesSync.objects.update(synced_at=timezone.now() - datetime.timedelta(days=2))
+        self.sync()
+
+        since = timezone.now().date() - datetime.timedelta(days=3)
+        self.assertEqual(self.period_filters[1:], [since.strftime("%Y-%m-%d")])
+
+    def test_changed_sales_are_fetched_since_oldest_unpaid_invoice(self):
+        self.sync()
+        aggregates.mark_sales_changed(tenant='test', member_ids=[1], changed_at=timezone.now())
+        self.sync()  # Fetched right away, even though the last synchronization was recent
+        self.sync()  # The change was synchronized
+
+        self.assertEqual(self.period_filters[1:], ['2026-03-01'])
+        self.assertIsNone(aggregates.get_sync(tenant='test', member_id=1).sales_changed_at)
+
+
+class PostSalesBulkTests(ApiTestMixin, TransactionTestCase):
+    """Sales are posted by worker threads, which record them in the database through their own connections."""
+
+    def congressus_request(self, method, url, params=None, json=None, **kwargs):
+        if url.endswith('/send'):
+            return FakeCongressusResponse({})
+        return FakeCongressusResponse({'id': json['member_id'], 'member_id': json['member_id'], 'items': json['items']},
+                                      status_code=201)
+
+    def test_malformed_sales_fail_in_their_own_place(self):
+        items = [{'product_offer_id': 7, 'quantity': 1}]
+        sales = [{'member_id': 1, 'items': items}, 1, {'member_id': 'one', 'items': items}, {'member_id': 2},
+                 {'member_id': 3, 'items': [1]}, {'member_id': 4, 'items': items, 'idempotency_key': 4}]
+        res = self.api.post_sales_bulk(req=None, sales=sales)
+
+        self.assertEqual(res.status_code, 207)
+        self.assertEqual([result['status'] for result in res.data], [201, 400, 400, 400, 400, 400])
+        self.assertEqual([result['member_id'] for result in res.data], [1, None, 'one', 2, 3, 4])
+        self.assertEqual(self.congressus_requests, [('post', '/sale-invoices'), ('post', '/sale-invoices/1/send')])
+
+    def test_too_many_sales_are_rejected(self):
+        sales = [{'member_id': 1, 'items': [{'product_offer_id': 7, 'quantity': 1}]}] * (ApiV30.BULK_SALE_MAX_SIZE + 1)
+        self.assertEqual(self.api.post_sales_bulk(req=None, sales=sales).status_code, 400)
+        self.assertEqual(self.congressus_requests, [])
+
+
+class HandlerTests(TemporaryStateMixin, SimpleTestCase):
+    """
+    The test client does not use the handlers of the WSGI and ASGI applications, so these tests call the applications
+    to check that requests to the API get the API middleware and other requests get the full middleware stack.
+    """
+
+    def setUp(self):
+        super().setUp()
+        settings_override = override_settings(SHARED_STATE_FOLDER=self.state_folder)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # The APIs created by the requests use the temporary state folder, so they are dropped after the test
+        apis_patch = mock.patch.dict(views._api_v30_objs, clear=True)
+        apis_patch.start()
+        self.addCleanup(apis_patch.stop)
+
+    @staticmethod
+    def wsgi_get(path: str, headers: dict[str, str] = None) -> tuple[int, dict[str, str]]:
+        """Returns the status code and headers of a GET request to the WSGI application."""
+        environ = {'PATH_INFO': path, 'REQUEST_METHOD': 'GET', 'SERVER_NAME': 'testserver'}
+        environ.update({f"HTTP_{name.upper().replace('-', '_')}": value for name, value in (headers or {}).items()})
+        wsgiref.util.setup_testing_defaults(environ)
+        started = {}
+
+        def start_response(status_line, response_headers, exc_info=None):
+            started.update(status=int(status_line.split()[0]), headers=dict(response_headers))
+
+        b''.join(handlers.StreeplijstWSGIHandler()(environ, start_response))
+        return started['status'], started['headers']
+
+    @staticmethod
+    def asgi_get(path: str, headers: dict[str, str] = None) -> tuple[int, dict[str, str]]:
+        """Returns the status code and headers of a GET request to the ASGI application."""
+        scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+                 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+                 'headers': [(b'host', b'testserver')] + [(name.lower().encode(), value.encode())
+                                                          for name, value in (headers or {}).items()],
+                 'client': ('127.0.0.1', 1234), 'server': ('testserver', 80)}
+
+        async def get():
+            communicator = ApplicationCommunicator(handlers.StreeplijstASGIHandler(), scope)
+            await communicator.send_input({'type': 'http.request', 'body': b''})
+            start = await communicator.receive_output(timeout=5)
+            while (await communicator.receive_output(timeout=5)).get('more_body'):  # Read the whole body
+                pass
+            await communicator.wait()
+            return start['status'], {name.decode(): value.decode() for name, value in start['headers']}
+
+        return async_to_sync(get)()
+
+    def test_api_requests_get_api_middleware(self):
+        for get in [self.wsgi_get, self.asgi_get]:
+            with self.subTest(handler=get.__name__):
+                status_code, headers = get('/streeplijst/v30/ping')
+                self.assertEqual(status_code, 200)
+                self.assertIn('Server-Timing', headers)
+                self.assertNotIn('X-Frame-Options', headers)  # Clickjacking middleware is not used by the API
+
+                with self.assertLogs('django.request', level='WARNING'):
+                    status_code, _ = get('/streeplijst/v30/ping', headers={tenants.TENANT_HEADER: 'unknown'})
+                self.assertEqual(status_code, 404)  # Rejected by the tenant middleware
+
+    def test_other_requests_get_full_middleware(self):
+        for get in [self.wsgi_get, self.asgi_get]:
+            with self.subTest(handler=get.__name__):
+                with self.assertLogs('django.request', level='WARNING'):
+                    status_code, headers = get('/not-the-api')
+                self.assertEqual(status_code, 404)
+                self.assertEqual(headers.get('X-Frame-Options'), 'DENY')
+
+
+class ProductSearchIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = ProductSearchIndex()
+        self.index.update_folder(folder_id=1, products=[
+            {'id': 1, 'name': 'Crème brûlée', 'description': 'Dessert'},
+            {'id': 2, 'name': 'Chips paprika', 'description': 'Crispy'},
+            {'id': 3, 'name': 'Paprika', 'description': None},
+        ])
+
+    def search(self, query: str) -> list[int]:
+        return [product['id'] for product in self.index.search(query=query, limit=10)]
+
+    def test_every_term_may_be_the_start_of_a_word(self):
+        self.assertEqual(self.search('chi pap'), [2])
+        self.assertEqual(self.search('creme bru'), [1])  # Accents are ignored
+        self.assertEqual(self.search('chips cola'), [])
+
+    def test_whole_words_in_the_name_are_listed_first(self):
+        self.assertEqual(self.search('paprika'), [2, 3])  # Equal scores are ordered by name
+        self.assertEqual(self.search('c'), [2, 1])  # Name before description
+
+    def test_folder_update_removes_products(self):
+        self.index.update_folder(folder_id=1, products=[{'id': 3, 'name': 'Paprika', 'description': None}])
+        self.assertEqual(self.search('paprika'), [3])
+        self.assertIsNone(self.index.folder_of(2))
+        self.assertEqual(self.index.folder_of(3), 1)
+
+    def test_state_round_trip(self):
+        restored = ProductSearchIndex()
+        restored.restore_state(self.index.get_state(), age=10)
+        self.assertEqual(restored.search(query='pap', limit=10), self.index.search(query='pap', limit=10))
+        self.assertGreaterEqual(restored.folder_age(1), 10)
+
+
+class SearchProductsTests(ApiTestMixin, SimpleTestCase):
+    folder_configuration = [{'name': 'Chips', 'id': 5}]
+
+    def setUp(self):
+        self.products_available = True
+        super().setUp()
+
+    def congressus_request(self, method, url, params=None, **kwargs):
+        if not self.products_available:
+            return FakeCongressusResponse({'error': 'Unavailable'}, status_code=503)
+        return FakeCongressusResponse({'data': [{'id': 1, 'name': 'Chips paprika'}], 'has_next': False})
+
+    def wait_for_background(self) -> None:
+        self.api._background_executor.submit(lambda: None).result(timeout=5)  # Runs after all earlier tasks
+
+    def test_index_is_filled_in_background_on_start(self):
+        self.wait_for_background()
+        self.assertEqual(self.congressus_requests, [('get', '/products')])
+
+        res = self.api.search_products(req=None, query='pap')
+        self.assertEqual([product['id'] for product in res.data], [1])
+        self.assertEqual(len(self.congressus_requests), 1)  # Searching does not call Congressus
+
+    def test_search_before_index_is_filled_is_unavailable(self):
+        self.products_available = False
+        self.wait_for_background()
+        self.assertEqual(self.api.search_products(req=None, query='pap').status_code, 503)
+
+        self.products_available = True  # The search started a new refresh in the background
+        self.wait_for_background()
+        self.assertEqual(self.api.search_products(req=None, query='pap').status_code, 200)
+
+    def test_invalidation_is_checked_once_per_interval(self):
+        self.wait_for_background()
+        with mock.patch.object(self.api._cache, 'get', wraps=self.api._cache.get) as cache_get:
+            for _ in range(3):
+                self.api.search_products(req=None, query='pap')
+        self.assertEqual(cache_get.call_count, 1)
+
+
+class CursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        cursor = PageCursor(page=3, offset=7, page_size=25, filter_hash=filter_hash(member_ids=[1]))
+        self.assertEqual(decode_cursor(encode_cursor(cursor), expected_filter_hash=cursor.filter_hash), cursor)
+
+    def test_cursor_of_other_filters_is_rejected(self):
+        cursor = encode_cursor(PageCursor(page=1, offset=0, page_size=25, filter_hash=filter_hash(member_ids=[1])))
+        with self.assertRaisesMessage(ValueError, "Cursor does not belong to these filters"):
+            decode_cursor(cursor, expected_filter_hash=filter_hash(member_ids=[2]))
+
+    def test_invalid_cursor_is_rejected(self):
+        for cursor in ['not a cursor', encode_cursor(PageCursor(page=0, offset=0, page_size=25, filter_hash='x'))]:
+            with self.subTest(cursor=cursor), self.assertRaisesMessage(ValueError, "Invalid cursor"):
+                decode_cursor(cursor, expected_filter_hash='x')
+
+
+class WebhookSignatureTests(SimpleTestCase):
+    body = b'{"members": [1]}'
+
+    def test_valid_signature(self):
+        signature = hmac.new(b'secret', self.body, hashlib.sha256).hexdigest()
+        self.assertTrue(is_authentic(body=self.body, headers={SIGNATURE_HEADER: f'sha256={signature}'},
+                                     secret='secret'))
+
+    def test_signature_of_other_body_is_rejected(self):
+        signature = hmac.new(b'secret', b'{"members": [2]}', hashlib.sha256).hexdigest()
+        self.assertFalse(is_authentic(body=self.body, headers={SIGNATURE_HEADER: f'sha256={signature}'},
+                                      secret='secret'))
+
+    def test_token(self):
+        self.assertTrue(is_authentic(body=self.body, headers={TOKEN_HEADER: 'secret'}, secret='secret'))
+        self.assertFalse(is_authentic(body=self.body, headers={TOKEN_HEADER: 'guess'}, secret='secret'))
+
+    def test_without_secret_nothing_is_authentic(self):
+        self.assertFalse(is_authentic(body=self.body, headers={TOKEN_HEADER: ''}, secret=None))
+        self.assertFalse(is_authentic(body=self.body, headers={}, secret='secret'))
+
+
+class WebhookViewTests(SimpleTestCase):
+    other_tenant = Tenant(name='other', api_token_env='OTHER_TOKEN', parent_folder_id=1, folder_configuration=[],
+                          webhook_secret='other-secret', api_key='other-key')
+
+    def setUp(self):
+        tenants_patch = mock.patch.dict(tenants.TENANTS, {'other': self.other_tenant})
+        tenants_patch.start()
+        self.addCleanup(tenants_patch.stop)
+        self.api = mock.Mock()
+        self.api.handle_webhook.return_value = Response(status=204)
+        api_patch = mock.patch.object(views, '_api_v30_of', return_value=self.api)
+        self.api_of = api_patch.start()
+        self.addCleanup(api_patch.stop)
+
+    def post(self, path: str, token: str) -> Response:
+        req = RequestFactory().post(path, data={'folders': [2]}, content_type='application/json',
+                                    headers={TOKEN_HEADER: token})
+        return views.webhook(req, version=ApiV30.API_VERSION)
+
+    def test_tenant_from_query_parameter(self):
+        self.assertEqual(self.post('/streeplijst/v30/webhook?tenant=other', token='other-secret').status_code, 204)
+        self.api_of.assert_called_once_with(self.other_tenant)
+        self.assertEqual(self.api.handle_webhook.call_args.kwargs['changes'],
+                         WebhookChanges(products=[], folder_ids=[2], members=[], sale_member_ids=[]))
+
+    def test_secret_of_other_tenant_is_rejected(self):
+        res = self.post('/streeplijst/v30/webhook?tenant=other', token='default-secret')
+        self.assertEqual(res.status_code, 403)
+        self.api.handle_webhook.assert_not_called()
+
+    def test_unknown_tenant_is_not_found(self):
+        res = self.post('/streeplijst/v30/webhook?tenant=unknown', token='other-secret')
+        self.assertEqual(res.status_code, 404)
+
+
+class PaginationTests(ApiTestMixin, SimpleTestCase):
+    def setUp(self):
+        self.items = [{'id': item_id} for item_id in range(1, 101)]
+        self.requested_pages = []
+        super().setUp()
+
+    def congressus_request(self, method, url, params=None, **kwargs) -> FakeCongressusResponse:
+        page, page_size = params['page'], params['page_size']
+        self.requested_pages.append((page, page_size))
+        page_items = self.items[(page - 1) * page_size:page * page_size]
+        return FakeCongressusResponse({'data': page_items, 'has_next': page * page_size < len(self.items)})
+
+    def test_all_pages_are_combined(self):
+        res = self.api._congressus_api_call_pagination(method='get', url_endpoint='/items', page_size=25)
+        self.assertEqual(res.data, self.items)
+        self.assertEqual(len(self.requested_pages), 4)
+
+    def test_limit_stops_early(self):
+        res = self.api._congressus_api_call_pagination(method='get', url_endpoint='/items', page_size=25, limit=30)
+        self.assertEqual(res.data, self.items[:30])
+        self.assertEqual(self.requested_pages, [(1, 25), (2, 25)])
+
+    def test_page_size_is_shrunk_to_limit(self):
+        res = self.api._congressus_api_call_pagination(method='get', url_endpoint='/items', page_size=25, limit=5)
+        self.assertEqual(res.data, self.items[:5])
+        self.assertEqual(self.requested_pages, [(1, 5)])
+
+    def test_stop_predicate_stops_after_matching_page(self):
+        res = self.api._congressus_api_call_pagination(method='get', url_endpoint='/items', page_size=25,
+                                                       stop_predicate=lambda item: item['id'] == 40)
+        self.assertEqual(res.data, self.items[:50])
+        self.assertEqual(self.requested_pages, [(1, 25), (2, 25)])
+
+
+class AutocompleteMembersTests(ApiTestMixin, SimpleTestCase):
+    def setUp(self):
+        self.members = [{'id': 1, 'username': 's1000001', 'first_name': 'Ann', 'last_name': 'A'},
+                        {'id': 2, 'username': 's1000002', 'first_name': 'Bob', 'last_name': 'B'},
+                        {'id': 3, 'username': 's2000001', 'first_name': 'Cas', 'last_name': 'C'}]
+        self.has_next = False
+        super().setUp()
+
+    def congressus_request(self, method, url, params=None, **kwargs) -> FakeCongressusResponse:
+        matches = [member for member in self.members if params['term'] in member['username']]
+        return FakeCongressusResponse({'data': matches, 'has_next': self.has_next})
+
+    def autocomplete(self, term: str) -> list[int]:
+        return [member['id'] for member in self.api.autocomplete_members(req=None, term=term).data]
+
+    def test_longer_term_is_narrowed_down_locally(self):
+        self.assertEqual(self.autocomplete('s10'), [1, 2])
+        self.assertEqual(self.autocomplete('S100 '), [1, 2])  # Case and surrounding spaces are ignored
+        self.assertEqual(self.autocomplete('s1000002'), [2])
+        self.assertEqual(self.autocomplete('s20'), [3])  # Not a longer version of a cached term
+        self.assertEqual(self.congressus_requests, [('get', '/members/search')] * 2)
+
+    def test_incomplete_results_are_not_narrowed_down(self):
+        self.has_next = True
+        self.autocomplete('s10')
+        self.autocomplete('s1000002')
+        self.assertEqual(len(self.congressus_requests), 2)
+
+    def test_short_term_is_not_searched(self):
+        self.assertEqual(self.autocomplete('s1'), [])
+        self.assertEqual(self.congressus_requests, [])
+
+
+class SnapshotTests(TemporaryStateMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = self.state_folder / 'snapshot.bin'
+
+    def test_round_trip(self):
+        write_snapshot(self.path, data_version=2, data={'index': [1, 2]})
+        created, data = read_snapshot(self.path, data_version=2, max_age=60)
+        self.assertEqual(data, {'index': [1, 2]})
+        self.assertAlmostEqual(created, time.time(), delta=5)
+
+    def test_unusable_snapshot_is_ignored(self):
+        self.assertIsNone(read_snapshot(self.path, data_version=2, max_age=60))  # Missing
+        write_snapshot(self.path, data_version=2, data={'index': [1, 2]})
+        self.assertIsNone(read_snapshot(self.path, data_version=3, max_age=60))  # Other version
+        with mock.patch('streeplijst.congressus.snapshot.time.time', return_value=time.time() + 120):
+            self.assertIsNone(read_snapshot(self.path, data_version=2, max_age=60))  # Too old
+        self.path.write_bytes(self.path.read_bytes()[:30])
+        with self.assertLogs('api.local', level='WARNING'):
+            self.assertIsNone(read_snapshot(self.path, data_version=2, max_age=60))  # Truncated
+
+    def test_snapshotter_restores_registered_structures(self):
+        states = {'first': [1], 'broken': None, 'removed': [3]}
+        snapshotter = Snapshotter(path=self.path, data_version=1, interval=60, max_age=60)
+        for name in states:
+            snapshotter.register(name=name, get_state=lambda name=name: states[name], restore_state=mock.Mock())
+        snapshotter.mark_changed()
+        snapshotter.write_if_changed()
+
+        restored = Snapshotter(path=self.path, data_version=1, interval=60, max_age=60)
+        restore_first = mock.Mock()
+        restored.register(name='broken', get_state=list, restore_state=mock.Mock(side_effect=ValueError))
+        restored.register(name='first', get_state=list, restore_state=restore_first)
+        with self.assertLogs('api.local', level='WARNING'):  # A broken state does not stop the others
+            self.assertTrue(restored.restore())
+        state, age = restore_first.call_args.args
+        self.assertEqual(state, [1])
+        self.assertLess(age, 5)
+
+
+class ApiSnapshotTests(ApiTestMixin, SimpleTestCase):
+    folder_configuration = [{'name': 'Chips', 'id': 5}]
+
+    def congressus_request(self, method, url, params=None, **kwargs) -> FakeCongressusResponse:
+        return FakeCongressusResponse({'data': [{'id': 1, 'name': 'Chips paprika'}], 'has_next': False})
+
+    def test_restarted_api_continues_from_snapshot(self):
+        self.api._background_executor.submit(lambda: None).result(timeout=5)  # Wait until the index is filled
+        self.api._snapshotter.write_if_changed()
+
+        restarted_api = ApiV30(tenant=self.api.tenant)
+        self.assertEqual([product['id'] for product in restarted_api.search_products(req=None, query='pap').data], [1])
+        self.assertEqual(self.congressus_requests, [('get', '/products')])  # Only the first API fetched products
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    def setUp(self):
+        self.admission = AdmissionController(limits={Priority.BACKGROUND: 2}, max_wait=0.01)
+
+    def test_calls_beyond_cap_are_rejected_until_one_is_released(self):
+        self.assertTrue(self.admission.acquire(Priority.BACKGROUND))
+        self.assertTrue(self.admission.acquire(Priority.BACKGROUND))
+        with self.assertLogs('api.congressus', level='WARNING'):
+            self.assertFalse(self.admission.acquire(Priority.BACKGROUND))
+        self.admission.release(Priority.BACKGROUND)
+        self.assertTrue(self.admission.acquire(Priority.BACKGROUND))
+        self.assertEqual(self.admission.in_flight(Priority.BACKGROUND), 2)
+
+    def test_classes_without_cap_are_always_admitted(self):
+        for _ in range(10):
+            self.assertTrue(self.admission.acquire(Priority.SALE))
+        self.assertEqual(self.admission.in_flight(), 10)
+
+
+class AdmissionTests(ApiTestMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        # Fill all background slots, as if Congressus is slow to answer other calls
+        for _ in range(self.api.ADMISSION_LIMITS[Priority.BACKGROUND]):
+            self.api._admission.acquire(Priority.BACKGROUND)
+
+    def congressus_request(self, method, url, **kwargs) -> FakeCongressusResponse:
+        return FakeCongressusResponse({'data': [{'id': 1, 'name': 'Chips'}], 'has_next': False})
+
+    def test_call_beyond_cap_is_unavailable(self):
+        with self.assertLogs('api.congressus', level='WARNING'):
+            res = self.api.list_streeplijst_folders(req=None)
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res['Retry-After'], str(self.api.ADMISSION_RETRY_AFTER))
+        self.assertEqual(self.congressus_requests, [])
+
+    def test_call_beyond_cap_returns_stale_data(self):
+        self.api._cache.set('folders', value=[{'id': 2, 'name': 'Old'}], ttl=-1)
+        with self.assertLogs('api.congressus', level='WARNING'):
+            res = self.api.list_streeplijst_folders(req=None)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, [{'id': 2, 'name': 'Old'}])
+        self.assertIn('Stale', res['Warning'])
+        self.assertEqual(self.congressus_requests, [])
+
+
+class DeadlineTests(SimpleTestCase):
+    def setUp(self):
+        self.addCleanup(deadline.stop)
+
+    def test_clamp_without_deadline_keeps_timeout(self):
+        self.assertEqual(deadline.clamp(10), 10)
+
+    def test_clamp_shrinks_timeout_to_time_left(self):
+        deadline.start(2)
+        self.assertLessEqual(deadline.clamp(10), 2)
+        self.assertGreater(deadline.clamp(10), 1)
+        self.assertEqual(deadline.clamp(0.5), 0.5)
+
+    def test_clamp_after_deadline_passed(self):
+        deadline.start(-1)
+        self.assertIsNone(deadline.clamp(10))
+
+
+class ApiDeadlineTests(ApiTestMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(deadline.stop)
+        self.timeouts = []
+
+    def congressus_request(self, method, url, timeout=None, **kwargs) -> FakeCongressusResponse:
+        self.timeouts.append(timeout)
+        return FakeCongressusResponse({'id': 1})
+
+    def test_get_timeout_is_shrunk_to_deadline(self):
+        deadline.start(2)
+        self.api._congressus_api_call_single(method='get', url_endpoint='/members/1', timeout=10)
+        self.assertLessEqual(self.timeouts[0], 2)
+
+    def test_post_keeps_full_timeout(self):
+        deadline.start(2)
+        self.api._congressus_api_call_single(method='post', url_endpoint='/sale-invoices', payload={}, timeout=10)
+        self.assertEqual(self.timeouts, [10])  # A POST which is cut off may still be processed
+
+    def test_get_after_deadline_passed_is_not_made(self):
+        deadline.start(-1)
+        res = self.api._congressus_api_call_single(method='get', url_endpoint='/members/1', timeout=10)
+        self.assertEqual(res.status_code, 408)
+        self.assertEqual(self.congressus_requests, [])
+
+
+class RecentPurchasesTests(SimpleTestCase):
+    def setUp(self):
+        self.recent = RecentPurchases(max_members=2, max_sales=3, max_age=60)
+
+    @staticmethod
+    def sale(sale_id: int, member_id: int = 1, **fields) -> dict:
+        return {'id': sale_id, 'member_id': member_id, 'created': f'2024-01-{sale_id:02}T12:00:00', 'items': [],
+                **fields}
+
+    def sale_ids(self, member_id: int = 1, changed: float = None) -> Optional[list[int]]:
+        sales = self.recent.get(member_id, changed=changed)
+        return None if sales is None else [sale['id'] for sale in sales]
+
+    def test_only_filled_members_are_known(self):
+        self.recent.record([self.sale(1)])
+        self.assertIsNone(self.sale_ids())  # Other recent sales of the member may be missing
+        self.recent.fill(1, [self.sale(2), self.sale(1)])
+        self.assertEqual(self.sale_ids(), [2, 1])
+
+    def test_new_sales_push_out_oldest(self):
+        self.recent.fill(1, [self.sale(1), self.sale(2), self.sale(3)])
+        self.recent.record([self.sale(4), self.sale(5, member_id=None)])
+        self.assertEqual(self.sale_ids(), [4, 3, 2])
+
+    def test_changed_sale_replaces_older_version(self):
+        self.recent.fill(1, [self.sale(1), self.sale(2)])
+        self.recent.record([self.sale(1, invoice_status='paid')])
+        self.assertEqual(self.sale_ids(), [2, 1])
+        self.assertEqual(self.recent.get(1)[1]['invoice_status'], 'paid')
+
+    def test_least_recently_used_member_is_dropped(self):
+        self.recent.fill(1, [self.sale(1)])
+        self.recent.fill(2, [self.sale(2, member_id=2)])
+        self.sale_ids(member_id=1)  # Member 2 is now the least recently used
+        self.recent.fill(3, [self.sale(3, member_id=3)])
+        self.assertIsNone(self.sale_ids(member_id=2))
+        self.assertEqual(self.sale_ids(member_id=1), [1])
+
+    def test_sales_changed_elsewhere_or_too_old_are_not_used(self):
+        self.recent.fill(1, [self.sale(1)])
+        self.assertIsNone(self.sale_ids(changed=time.time() + 1))  # A sale was posted by another worker
+        with mock.patch('streeplijst.congressus.recent.time.time', return_value=time.time() + 120):
+            self.assertIsNone(self.sale_ids())
+
+    def test_state_round_trip(self):
+        self.recent.fill(1, [self.sale(1), self.sale(2)])
+        restored = RecentPurchases(max_members=2, max_sales=3, max_age=60)
+        restored.restore_state(self.recent.get_state(), age=1)
+        self.assertEqual(restored.get(1), self.recent.get(1))
+
+
+class SpaceSavingCounterTests(SimpleTestCase):
+    def test_counts_are_exact_within_capacity(self):
+        counter = SpaceSavingCounter(capacity=3)
+        for key in ['cola', 'chips', 'cola', 'beer', 'cola']:
+            counter.add(key, label=key.title())
+        self.assertEqual(counter.top(2), [('cola', 3, 0, 'Cola'), ('chips', 1, 0, 'Chips')])
+
+    def test_least_counted_key_is_replaced_and_never_underestimated(self):
+        counter = SpaceSavingCounter(capacity=2)
+        counter.add('cola', amount=5)
+        counter.add('chips', amount=2)
+        counter.add('beer')
+        self.assertEqual(counter.top(2), [('cola', 5, 0, None), ('beer', 3, 2, None)])
+
+
+class FavouriteProductsTests(SimpleTestCase):
+    def setUp(self):
+        self.favourites = FavouriteProducts(max_members=2, capacity=3, max_age=60)
+
+    def top(self, member_id: int = 1, changed: float = None) -> Optional[list[tuple[int, int]]]:
+        products = self.favourites.get(member_id, limit=2, changed=changed)
+        if products is None:
+            return None
+        return [(product['product_offer_id'], product['quantity']) for product in products]
+
+    def test_sales_are_added_to_seeded_counts(self):
+        self.favourites.fill(1, [{'product_offer_id': 10, 'name': 'Cola', 'quantity': 3},
+                                 {'product_offer_id': 11, 'name': 'Chips', 'quantity': 2}])
+        self.favourites.add_sale({'member_id': 1, 'items': [{'product_offer_id': 11, 'name': 'Chips', 'quantity': 2},
+                                                            {'product_offer_id': 12, 'name': 'Beer', 'quantity': 1}]})
+        self.assertEqual(self.top(), [(11, 4), (10, 3)])
+
+    def test_sales_of_unknown_members_are_ignored(self):
+        self.favourites.add_sale({'member_id': 1, 'items': [{'product_offer_id': 10, 'name': 'Cola', 'quantity': 1}]})
+        self.assertIsNone(self.top())  # Seeded from the sales aggregates when the member is used
+
+    def test_counts_changed_elsewhere_or_too_old_are_not_used(self):
+        self.favourites.fill(1, [{'product_offer_id': 10, 'name': 'Cola', 'quantity': 3}])
+        self.assertIsNone(self.top(changed=time.time() + 1))  # A sale was posted by another worker
+        with mock.patch('streeplijst.congressus.favourites.time.time', return_value=time.time() + 120):
+            self.assertIsNone(self.top())
+
+    def test_least_recently_used_member_is_dropped(self):
+        for member_id in [1, 2]:
+            self.favourites.fill(member_id, [{'product_offer_id': 10, 'name': 'Cola', 'quantity': member_id}])
+        self.top(member_id=1)  # Member 2 is now the least recently used
+        self.favourites.fill(3, [])
+        self.assertIsNone(self.top(member_id=2))
+        self.assertEqual(self.top(member_id=1), [(10, 1)])
+
+    def test_state_round_trip(self):
+        self.favourites.fill(1, [{'product_offer_id': 10, 'name': 'Cola', 'quantity': 3}])
+        restored = FavouriteProducts(max_members=2, capacity=3, max_age=60)
+        restored.restore_state(self.favourites.get_state(), age=1)
+        self.assertEqual(restored.get(1, limit=2), self.favourites.get(1, limit=2))
+
+
+class PrefetchTests(ApiTestMixin, SimpleTestCase):
+    def setUp(self):
+        self.member_status_code = 200
+        super().setUp()
+        self.api._cache.set('member_id:s1', value=1, ttl=60)
+        recent_purchases_patch = mock.patch.object(self.api, '_get_recent_purchases',
+                                                   return_value=Response(data=[{'id': 5}], status=200))
+        self.get_recent_purchases = recent_purchases_patch.start()
+        self.addCleanup(recent_purchases_patch.stop)
+
+    def congressus_request(self, method, url, **kwargs) -> FakeCongressusResponse:
+        return FakeCongressusResponse({'id': 1, 'username': 's1'}, status_code=self.member_status_code)
+
+    def lookup_member(self) -> Response:
+        res = self.api.get_member_by_username(req=None, username='s1', prefetch=['sales'])
+        self.api._prefetch_executor.shutdown(wait=True)  # Wait for the prefetch to finish
+        return res
+
+    def test_member_lookup_prefetches_into_shared_cache(self):
+        self.assertEqual(self.lookup_member().status_code, 200)
+        self.get_recent_purchases.assert_called_once_with(req=None, member_id=1)  # The lookup request is not used
+        self.assertEqual(self.api._get_prefetched('prefetched_recent_purchases:1', changed=None), [{'id': 5}])
+
+    def test_failed_lookup_does_not_prefetch(self):
+        self.member_status_code = 404
+        self.assertEqual(self.lookup_member().status_code, 404)
+        self.get_recent_purchases.assert_not_called()
+
+    def test_failed_prefetch_is_not_stored(self):
+        self.get_recent_purchases.return_value = Response(data={'error': "Request timeout"}, status=408)
+        self.lookup_member()
+        self.assertIsNone(self.api._cache.get('prefetched_recent_purchases:1'))
+
+    def test_prefetch_is_skipped_when_enough_are_in_flight(self):
+        for _ in range(self.api.PREFETCH_MAX_IN_FLIGHT):
+            self.api._prefetch_slots.acquire()
+        self.lookup_member()
+        self.get_recent_purchases.assert_not_called()
+
+    def test_prefetched_data_is_outdated_by_later_sale(self):
+        self.lookup_member()
+        fetched_time = self.api._cache.get('prefetched_recent_purchases:1')['fetched']
+        self.assertIsNone(self.api._get_prefetched('prefetched_recent_purchases:1', changed=fetched_time + 1))
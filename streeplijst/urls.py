@@ -11,15 +11,26 @@ urlpatterns = [
 
     path('<str:version>/members', views.members, name='members'),
     path('<str:version>/members/username/<str:username>', views.member_by_username, name='member_by_username'),
+    path('<str:version>/members/autocomplete', views.members_autocomplete, name='members_autocomplete'),
+    path('<str:version>/members/batch', views.members_batch, name='members_batch'),
     path('<str:version>/members/id/<int:id>', views.member_by_id, name='member_by_id'),  # TODO: remove this?
 
     path('<str:version>/products', views.products, name='products'),
     path('<str:version>/products/folder/<int:folder_id>', views.products_by_folder_id, name='products_by_folder_id'),
+    path('<str:version>/products/search', views.products_search, name='products_search'),
     path('<str:version>/folders', views.folders, name='folders'),
 
+    path('<str:version>/sales/bulk', views.sales_bulk, name='post_sales_bulk'),  # Before the username path
     path('<str:version>/sales/<str:username>', views.sales_by_username, name='sales_by_username'),
+    path('<str:version>/sales/<str:username>/aggregates', views.sales_aggregates_by_username,
+         name='sales_aggregates_by_username'),
+    path('<str:version>/sales/<str:username>/recent', views.sales_recent_by_username, name='sales_recent_by_username'),
+    path('<str:version>/sales/<str:username>/favourites', views.sales_favourites_by_username,
+         name='sales_favourites_by_username'),
     path('<str:version>/sales', views.sales, name='post_sale'),
 
+    path('<str:version>/webhook', views.webhook, name='webhook'),
+
     # Old versions of the paths (not used anyxmore)
     # path('members', views.members, name='members'),
     # path('members/username/<str:username>', views.member_by_username, name='member_by_username'),
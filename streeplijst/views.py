@@ -1,14 +1,42 @@
+import threading
+from typing import Optional, Tuple
+
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.request import Request
 from rest_framework.response import Response
 
+from streeplijst.congressus import webhooks
 from streeplijst.congressus.api import ApiV30, ApiV20
+from streeplijst.congressus.tenants import DEFAULT_TENANT_NAME, TENANTS, Tenant
 
-api_v30_obj = ApiV30()  # TODO: Move this so it is not a module variable
+# One API per tenant, created when the tenant is first used since an API starts threads and restores its snapshot
+_api_v30_objs: dict[str, ApiV30] = {}
+_api_v30_objs_lock = threading.Lock()
 api_v20_obj = ApiV20()
 
 
+def _tenant(req: Request) -> Tenant:
+    """Returns the tenant the request is made for, selected by streeplijst.middleware.TenantMiddleware."""
+    return getattr(req, 'tenant', TENANTS[DEFAULT_TENANT_NAME])
+
+
+def _api_v30_of(tenant: Tenant) -> ApiV30:
+    """Returns the v30 API of a tenant, creating it if the tenant was not used before."""
+    api = _api_v30_objs.get(tenant.name)
+    if api is None:
+        with _api_v30_objs_lock:  # Every tenant gets a single API, even if its first requests arrive together
+            api = _api_v30_objs.get(tenant.name)
+            if api is None:
+                api = _api_v30_objs[tenant.name] = ApiV30(tenant=tenant)
+    return api
+
+
+def api_v30(req: Request) -> ApiV30:
+    """Returns the v30 API of the tenant the request is made for."""
+    return _api_v30_of(_tenant(req))
+
+
 @api_view(['GET'])
 def ping(req: Request, version: str) -> Response:
     """
@@ -18,7 +46,7 @@ def ping(req: Request, version: str) -> Response:
     :param version: API version to use.
     """
     if version == ApiV30.API_VERSION:
-        return api_v30_obj.ping(req=req)
+        return api_v30(req).ping(req=req)
     elif version == ApiV20.API_VERSION:
         return api_v20_obj.ping(req=req)
     else:
@@ -35,7 +63,7 @@ def members(req: Request, version: str) -> Response:
     """
     # return get_members(req)
     if version == ApiV30.API_VERSION:
-        return api_v30_obj.list_members(req=req)
+        return api_v30(req).list_members(req=req)
     elif version == ApiV20.API_VERSION:
         return api_v20_obj.list_members(req=req)
     else:
@@ -52,7 +80,7 @@ def member_by_id(req: Request, version: str, id: int) -> Response:
     :param id: ID to use.
     """
     if version == ApiV30.API_VERSION:
-        return api_v30_obj.get_member_by_id(id=id, req=req)
+        return api_v30(req).get_member_by_id(id=id, req=req)
     elif version == ApiV20.API_VERSION:
         return api_v20_obj.get_member_by_id(id=id, req=req)
     else:
@@ -62,16 +90,61 @@ def member_by_id(req: Request, version: str, id: int) -> Response:
 @api_view(['GET'])
 def member_by_username(req: Request, version: str, username: str) -> Response:
     """
-    Get a specific member from Congressus by their username.
+    Get a specific member from Congressus by their username. Optionally use query parameter 'prefetch' with a comma
+    separated list of 'sales' and 'favourites' to fetch that data of the member in the background, so it is ready when
+    it is requested next.
 
     :param req: Request object.
     :param version: API version to use.
     :param username: Username to search for.
     """
+    prefetch, prefetch_error_res = _prefetch(req)
+    if prefetch_error_res is not None:
+        return prefetch_error_res
+
     if version == ApiV30.API_VERSION:
-        return api_v30_obj.get_member_by_username(username=username, req=req)
+        return api_v30(req).get_member_by_username(username=username, prefetch=prefetch, req=req)
     elif version == ApiV20.API_VERSION:
-        return api_v20_obj.get_member_by_username(username=username, req=req)
+        return api_v20_obj.get_member_by_username(username=username, prefetch=prefetch, req=req)
+    else:
+        return Response(data={'message': f"API version {version} not recognized"}, status=status.HTTP_404_NOT_FOUND)
+
+
+@api_view(['POST'])
+def members_batch(req: Request, version: str) -> Response:
+    """
+    Get multiple members by their usernames at once, e.g. for a group checkout. The members are looked up concurrently
+    and the result of every unique username is returned in the same order.
+
+    :param req: Request object.
+    :param version: API version to use.
+    """
+    usernames = req.data.get('usernames')
+    if not isinstance(usernames, list) or not all(isinstance(username, str) for username in usernames):
+        return Response(data={'message': "Request data should contain a list of usernames"},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    if version == ApiV30.API_VERSION:
+        return api_v30(req).get_members_by_usernames(usernames=usernames, req=req)
+    elif version == ApiV20.API_VERSION:
+        return api_v20_obj.get_members_by_usernames(usernames=usernames, req=req)
+    else:
+        return Response(data={'message': f"API version {version} not recognized"}, status=status.HTTP_404_NOT_FOUND)
+
+
+@api_view(['GET'])
+def members_autocomplete(req: Request, version: str) -> Response:
+    """
+    Get the members whose username starts with a search term. Use query parameter 'q' for the search term.
+
+    :param req: Request object.
+    :param version: API version to use.
+    """
+    term = req.query_params.get('q', '')
+    if version == ApiV30.API_VERSION:
+        return api_v30(req).autocomplete_members(term=term, req=req)
+    elif version == ApiV20.API_VERSION:
+        return api_v20_obj.autocomplete_members(term=term, req=req)
     else:
         return Response(data={'message': f"API version {version} not recognized"}, status=status.HTTP_404_NOT_FOUND)
 
@@ -85,7 +158,7 @@ def products(req: Request, version: str, ) -> Response:
     :param version: API version to use.
     """
     if version == ApiV30.API_VERSION:
-        return api_v30_obj.list_products()
+        return api_v30(req).list_products()
     elif version == ApiV20.API_VERSION:
         return api_v20_obj.list_products(req=req)
     else:
@@ -102,13 +175,38 @@ def products_by_folder_id(req: Request, version: str, folder_id: int) -> Respons
     :param folder_id: Folder ID to search for.
     """
     if version == ApiV30.API_VERSION:
-        return api_v30_obj.list_products_in_folder(folder_id=folder_id, req=req)
+        return api_v30(req).list_products_in_folder(folder_id=folder_id, req=req)
     elif version == ApiV20.API_VERSION:
         return api_v20_obj.list_products_in_folder(folder_id=folder_id, req=req)
     else:
         return Response(data={'message': f"API version {version} not recognized"}, status=status.HTTP_404_NOT_FOUND)
 
 
+@api_view(['GET'])
+def products_search(req: Request, version: str) -> Response:
+    """
+    Search the products in all Streeplijst folders. Use query parameter 'q' for the search query and optionally 'limit'
+    for the max number of results.
+
+    :param req: Request object.
+    :param version: API version to use.
+    """
+    query = req.query_params.get('q', '')
+    limit = req.query_params.get('limit')
+    if limit is not None:
+        if not limit.isdigit():
+            return Response(data={'message': "Query parameter limit should be a positive integer"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        limit = int(limit)
+
+    if version == ApiV30.API_VERSION:
+        return api_v30(req).search_products(query=query, limit=limit, req=req)
+    elif version == ApiV20.API_VERSION:
+        return api_v20_obj.search_products(query=query, limit=limit, req=req)
+    else:
+        return Response(data={'message': f"API version {version} not recognized"}, status=status.HTTP_404_NOT_FOUND)
+
+
 @api_view(['GET'])
 def folders(req: Request, version: str) -> Response:
     """
@@ -118,26 +216,170 @@ def folders(req: Request, version: str) -> Response:
     :param version: API version to use.
     """
     if version == ApiV30.API_VERSION:
-        return api_v30_obj.list_streeplijst_folders(req=req)
+        return api_v30(req).list_streeplijst_folders(req=req)
     elif version == ApiV20.API_VERSION:
         return api_v20_obj.list_streeplijst_folders(req=req)
     else:
         return Response(data={'message': f"API version {version} not recognized"}, status=status.HTTP_404_NOT_FOUND)
 
 
+def _prefetch(req: Request) -> Tuple[list[str], Optional[Response]]:
+    """
+    Get the optional query parameter 'prefetch' of a request for a member.
+
+    :param req: Request object.
+    :return: The data to prefetch, and a response with an error if the parameter is invalid.
+    """
+    prefetch = [item.strip() for item in req.query_params.get('prefetch', '').split(',') if item.strip()]
+    unknown = [item for item in prefetch if item not in ApiV30.PREFETCH_OPTIONS]
+    if unknown:
+        return [], Response(data={'message': f"Query parameter prefetch should only contain "
+                                             f"{', '.join(ApiV30.PREFETCH_OPTIONS)}, not {', '.join(unknown)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+    return prefetch, None
+
+
+def _sales_limit(req: Request) -> Tuple[Optional[int], Optional[Response]]:
+    """
+    Get the optional query parameter 'limit' of a request for a page of sales.
+
+    :param req: Request object.
+    :return: The limit, or None if it is not given, and a response with an error if the limit is invalid.
+    """
+    limit = req.query_params.get('limit')
+    if limit is None:
+        return None, None
+    if not limit.isdigit() or int(limit) == 0:
+        return None, Response(data={'message': "Query parameter limit should be a positive integer"},
+                              status=status.HTTP_400_BAD_REQUEST)
+    return int(limit), None
+
+
 @api_view(['GET'])
 def sales_by_username(req: Request, version: str, username: str = None) -> Response:
     """
     Get all sales of a specific user. Uses the member_id query (https://docs.congressus.nl/#!/default/get_sales).
+    Optionally use query parameters 'limit' and 'cursor' to get a single page of sales instead.
 
     :param req: Request object.
     :param version: API version to use.
     :param username: Username to search for.
     """
+    limit, limit_error_res = _sales_limit(req)
+    if limit_error_res is not None:
+        return limit_error_res
+    cursor = req.query_params.get('cursor')
+
     if version == ApiV30.API_VERSION:
-        return api_v30_obj.get_sales_by_username(username=username, req=req)
+        return api_v30(req).get_sales_by_username(username=username, limit=limit, cursor=cursor, req=req)
     if version == ApiV20.API_VERSION:
-        return api_v20_obj.get_sales_by_username(username=username, req=req)
+        return api_v20_obj.get_sales_by_username(username=username, limit=limit, cursor=cursor, req=req)
+    else:
+        return Response(data={'message': f"API version {version} not recognized"}, status=status.HTTP_404_NOT_FOUND)
+
+
+@api_view(['GET'])
+def sales_aggregates_by_username(req: Request, version: str, username: str) -> Response:
+    """
+    Get the total spending of a specific user per month and the number of times they bought each product.
+
+    :param req: Request object.
+    :param version: API version to use.
+    :param username: Username to search for.
+    """
+    if version == ApiV30.API_VERSION:
+        return api_v30(req).get_sales_aggregates_by_username(username=username, req=req)
+    elif version == ApiV20.API_VERSION:
+        return api_v20_obj.get_sales_aggregates_by_username(username=username, req=req)
+    else:
+        return Response(data={'message': f"API version {version} not recognized"}, status=status.HTTP_404_NOT_FOUND)
+
+
+@api_view(['GET'])
+def sales_recent_by_username(req: Request, version: str, username: str) -> Response:
+    """
+    Get the most recent sales of a specific user, e.g. to show right after a sale.
+
+    :param req: Request object.
+    :param version: API version to use.
+    :param username: Username to search for.
+    """
+    if version == ApiV30.API_VERSION:
+        return api_v30(req).get_recent_purchases_by_username(username=username, req=req)
+    elif version == ApiV20.API_VERSION:
+        return api_v20_obj.get_recent_purchases_by_username(username=username, req=req)
+    else:
+        return Response(data={'message': f"API version {version} not recognized"}, status=status.HTTP_404_NOT_FOUND)
+
+
+@api_view(['GET'])
+def sales_favourites_by_username(req: Request, version: str, username: str) -> Response:
+    """
+    Get the products a specific user bought most often, e.g. to show as quick buy buttons.
+
+    :param req: Request object.
+    :param version: API version to use.
+    :param username: Username to search for.
+    """
+    if version == ApiV30.API_VERSION:
+        return api_v30(req).get_favourite_products_by_username(username=username, req=req)
+    elif version == ApiV20.API_VERSION:
+        return api_v20_obj.get_favourite_products_by_username(username=username, req=req)
+    else:
+        return Response(data={'message': f"API version {version} not recognized"}, status=status.HTTP_404_NOT_FOUND)
+
+
+@api_view(['POST'])
+def sales_bulk(req: Request, version: str) -> Response:
+    """
+    Post multiple sales at once, e.g. for a round of drinks. The sales are posted concurrently and the result of every
+    sale is returned in the same order.
+
+    :param req: Request object.
+    :param version: API version to use.
+    """
+    sales_data = req.data.get('sales') if isinstance(req.data, dict) else None
+    if not isinstance(sales_data, list):
+        return Response(data={'message': "Request data should contain a list of sales"},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    if version == ApiV30.API_VERSION:
+        return api_v30(req).post_sales_bulk(sales=sales_data, req=req)
+    elif version == ApiV20.API_VERSION:
+        return api_v20_obj.post_sales_bulk(sales=sales_data, req=req)
+    else:
+        return Response(data={'message': f"API version {version} not recognized"}, status=status.HTTP_404_NOT_FOUND)
+
+
+@api_view(['POST'])
+def webhook(req: Request, version: str) -> Response:
+    """
+    Receive a notification of changed products, product folders or members, and invalidate their cached data. The
+    notification must be signed with or contain the webhook secret of the tenant, see streeplijst.congressus.webhooks.
+    Congressus cannot send the tenant headers, so the URL of the webhook of a tenant other than the default tenant
+    names it in the 'tenant' query parameter, and the webhook secret proves the notification is from that tenant.
+
+    :param req: Request object.
+    :param version: API version to use.
+    """
+    tenant = _tenant(req)
+    if 'tenant' in req.query_params:
+        tenant = TENANTS.get(req.query_params['tenant'])
+        if tenant is None:
+            return Response(data={'message': f"Tenant {req.query_params['tenant']} not recognized"},
+                            status=status.HTTP_404_NOT_FOUND)
+    body = req.body  # Read the raw body before it is parsed, the signature is computed over the raw body
+    if not webhooks.is_authentic(body=body, headers=req.headers, secret=tenant.webhook_secret):
+        return Response(data={'message': "Webhook is not authenticated"}, status=status.HTTP_403_FORBIDDEN)
+    try:
+        changes = webhooks.parse_changes(req.data)
+    except ValueError as e:
+        return Response(data={'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if version == ApiV30.API_VERSION:
+        return _api_v30_of(tenant).handle_webhook(changes=changes, req=req)
+    elif version == ApiV20.API_VERSION:
+        return api_v20_obj.handle_webhook(changes=changes, req=req)
     else:
         return Response(data={'message': f"API version {version} not recognized"}, status=status.HTTP_404_NOT_FOUND)
 
@@ -148,9 +390,14 @@ def sales(req: Request, version: str) -> Response:
         if req.method == 'POST':
             member_id = req.data['member_id']
             items = req.data['items']
-            return api_v30_obj.post_sale(req=req, member_id=member_id, items=items)
+            # Clients can supply an idempotency key so they can safely retry a sale
+            idempotency_key = req.headers.get('Idempotency-Key') or req.data.get('idempotency_key')
+            return api_v30(req).post_sale(req=req, member_id=member_id, items=items, idempotency_key=idempotency_key)
         elif req.method == 'GET':
-            return api_v30_obj.get_sales(req=req)
+            limit, limit_error_res = _sales_limit(req)
+            if limit_error_res is not None:
+                return limit_error_res
+            return api_v30(req).get_sales(limit=limit, cursor=req.query_params.get('cursor'), req=req)
 
     if version == ApiV20.API_VERSION:
         if req.method == 'POST':